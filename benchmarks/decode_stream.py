@@ -0,0 +1,62 @@
+"""
+Throughput of utils.decode_stream over a synthetic docker push progress stream.
+
+    python benchmarks/decode_stream.py [--size MB] [--chunk BYTES]
+
+The stream is generated on the fly and cut in chunks that do not line up with the events, so memory
+use stays flat whatever the size.
+"""
+from __future__ import print_function
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from tutumcli.utils import decode_stream
+
+
+def progress_events(layers=8):
+    for current in itertools.count(512, 512):
+        for layer in range(layers):
+            total = (layer + 1) * 64 * 1024 * 1024
+            yield json.dumps({"status": "Pushing", "id": "%012x" % layer,
+                              "progressDetail": {"current": current % total, "total": total},
+                              "progress": "[%-50s] %d B/%d B" % ("=" * (current % total * 50 / total), current % total,
+                                                                total)}) + "\r\n"
+
+
+def chunked(size, chunk_size):
+    # one block of events is built up front and repeated, so that generating the stream does not
+    # dominate the timing
+    block = "".join(itertools.islice(progress_events(), 10000))
+    doubled = block + block
+    position = 0
+    for sent in xrange(0, size, chunk_size):
+        yield doubled[position:position + chunk_size]
+        position = (position + chunk_size) % len(block)
+    # completes the last event
+    yield doubled[position:doubled.index("\r\n", position) + 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', help='stream size in MB (default: 2048)', type=int, default=2048)
+    parser.add_argument('--chunk', help='chunk size in bytes (default: 4093)', type=int, default=4093)
+    args = parser.parse_args()
+
+    size = args.size * 1024 * 1024
+    started = time.time()
+    count = 0
+    for _ in decode_stream(chunked(size, args.chunk)):
+        count += 1
+    elapsed = time.time() - started
+    print("%d MB, %d events in %.1fs: %.1f MB/s, %.0f events/s" % (args.size, count, elapsed,
+                                                                   args.size / elapsed, count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
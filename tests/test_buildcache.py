@@ -0,0 +1,78 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+import docker
+import mock
+from tutumcli.buildcache import *
+
+
+class BuildCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.context = tempfile.mkdtemp()
+        self.environ = mock.patch.dict(os.environ, {'TUTUM_CACHE_DIR': self.cache_dir})
+        self.environ.start()
+        self._write("Dockerfile", "FROM busybox\n")
+        self._write(".dockerignore", "# comment\n.git\n*.log\nbuild/\n!build/keep.txt\n")
+        self._write("app/main.py", "print 'hello'\n")
+        self._write("server.log", "noise")
+        self._write(".git/HEAD", "ref: refs/heads/master")
+        self._write("build/out.bin", "binary")
+        self._write("build/keep.txt", "kept")
+
+    def tearDown(self):
+        self.environ.stop()
+        shutil.rmtree(self.cache_dir)
+        shutil.rmtree(self.context)
+
+    def _write(self, relpath, data):
+        path = os.path.join(self.context, relpath)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(data)
+
+    def test_is_ignored(self):
+        patterns = read_dockerignore(self.context)
+        self.assertEqual([(".git", False), ("*.log", False), ("build", False), ("build/keep.txt", True)], patterns)
+        self.assertTrue(is_ignored(".git/HEAD", patterns))
+        self.assertTrue(is_ignored("server.log", patterns))
+        self.assertTrue(is_ignored("build/out.bin", patterns))
+        self.assertFalse(is_ignored("build/keep.txt", patterns))
+        self.assertFalse(is_ignored("app/main.py", patterns))
+
+    def test_context_hash_ignores_excluded_files(self):
+        hasher = ContextHasher(self.context)
+        context_hash = hasher.compute()
+        self.assertEqual(4, hasher.files_read)
+        self._write("server.log", "more noise")
+        self._write(".git/HEAD", "ref: refs/heads/other")
+        self.assertEqual(context_hash, ContextHasher(self.context).compute())
+        self._write("build/keep.txt", "changed")
+        self.assertNotEqual(context_hash, ContextHasher(self.context).compute())
+
+    def test_context_hash_only_reads_changed_files(self):
+        context_hash = ContextHasher(self.context).compute()
+        hasher = ContextHasher(self.context)
+        self.assertEqual(context_hash, hasher.compute())
+        self.assertEqual(0, hasher.files_read)
+
+        self._write("app/main.py", "print 'bye!'\n")
+        hasher = ContextHasher(self.context)
+        self.assertNotEqual(context_hash, hasher.compute())
+        self.assertEqual(1, hasher.files_read)
+
+        os.chmod(os.path.join(self.context, "app/main.py"), 0o755)
+        self.assertNotEqual(context_hash, ContextHasher(self.context).compute())
+
+    def test_retag_build(self):
+        docker_client = mock.MagicMock()
+        self.assertIsNone(retag_build(docker_client, "abc", "user/app:v2"))
+        save_build("abc", "user/app:v1", "sha256:1234")
+        self.assertEqual("user/app:v1", retag_build(docker_client, "abc", "user/app:v2")['tag'])
+        docker_client.tag.assert_called_once_with("sha256:1234", "user/app", tag="v2", force=True)
+
+        docker_client.inspect_image.side_effect = docker.errors.APIError("not found", mock.MagicMock())
+        self.assertIsNone(retag_build(docker_client, "abc", "user/app:v2"))
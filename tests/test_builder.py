@@ -0,0 +1,109 @@
+import unittest
+import StringIO
+import os
+import shutil
+import tempfile
+
+import mock
+from tutumcli.builder import *
+from tutumcli.exceptions import BadParameter, BuildError
+from tutumcli.parallel import PrefixedOutput, run_jobs
+
+
+class BuilderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.context = tempfile.mkdtemp()
+        self.environ = mock.patch.dict(os.environ, {'TUTUM_CACHE_DIR': self.cache_dir})
+        self.environ.start()
+        for name in ["api", "web"]:
+            os.makedirs(os.path.join(self.context, name))
+            with open(os.path.join(self.context, name, "Dockerfile"), 'w') as f:
+                f.write("FROM busybox\nLABEL service=%s\n" % name)
+
+    def tearDown(self):
+        self.environ.stop()
+        shutil.rmtree(self.cache_dir)
+        shutil.rmtree(self.context)
+
+    def _docker_client(self, status=0):
+        docker_client = mock.MagicMock()
+        docker_client.create_container.return_value = {"Id": "container"}
+        docker_client.attach.return_value = iter(["Step 0 : FROM busybox\nStep", " 1 : done\n", "Successfully built"])
+        docker_client.wait.return_value = status
+        docker_client.inspect_image.return_value = {"Id": "sha256:1234"}
+        return docker_client
+
+    def test_load_build_file(self):
+        path = os.path.join(self.context, "builds.yml")
+        with open(path, 'w') as f:
+            f.write("builds:\n  - directory: api\n    tag: user/api\n  - directory: web\n    tag: user/web:v2\n")
+        self.assertEqual([(os.path.join(self.context, "api"), "user/api"),
+                          (os.path.join(self.context, "web"), "user/web:v2")], load_build_file(path))
+
+        with open(path, 'w') as f:
+            f.write("- directory: api\n")
+        self.assertRaises(BadParameter, load_build_file, path)
+        with open(path, 'w') as f:
+            f.write("api: user/api\n")
+        self.assertRaises(BadParameter, load_build_file, path)
+
+    def test_run_builder(self):
+        docker_client = self._docker_client()
+        output = StringIO.StringIO()
+        directory = os.path.join(self.context, "api")
+        prepare = mock.Mock()
+        self.assertEqual(BUILT, run_builder(docker_client, directory, "user/api", None, False, output.write,
+                                            prepare=prepare))
+        prepare.assert_called_once_with()
+        self.assertEqual("Step 0 : FROM busybox\nStep 1 : done\nSuccessfully built", output.getvalue())
+        docker_client.start.assert_called_once_with(container="container", privileged=True, binds={
+            directory: {'bind': "/app", 'ro': False},
+            "/var/run/docker.sock": {'bind': "/var/run/docker.sock", 'ro': False}})
+
+        docker_client = self._docker_client()
+        prepare = mock.Mock()
+        self.assertEqual(RETAGGED, run_builder(docker_client, directory, "user/api:v2", None, False, output.write,
+                                               prepare=prepare))
+        docker_client.tag.assert_called_once_with("sha256:1234", "user/api", tag="v2", force=True)
+        self.assertFalse(docker_client.create_container.called)
+        self.assertFalse(prepare.called)
+
+        docker_client = self._docker_client(status=1)
+        self.assertRaises(BuildError, run_builder, docker_client, directory, "user/api", None, True, output.write)
+
+    @mock.patch('tutumcli.builder.utils.stream_output')
+    @mock.patch('tutumcli.builder.utils.is_image_pull_needed', return_value=True)
+    def test_builder_image_pulled_once(self, mock_is_image_pull_needed, mock_stream_output):
+        docker_client = self._docker_client()
+        builder_image = BuilderImage(docker_client, 'always', 3600, StringIO.StringIO())
+        builder_image.prepare()
+        builder_image.prepare()
+        docker_client.pull.assert_called_once_with(BUILDER_IMAGE, stream=True)
+        mock_is_image_pull_needed.assert_called_once_with(docker_client, BUILDER_IMAGE, 'always', 3600)
+
+    def test_build_jobs_in_parallel(self):
+        stdout = StringIO.StringIO()
+        stderr = StringIO.StringIO()
+        output = PrefixedOutput(["user/api", "user/web"], stdout, stderr)
+        jobs = [BuildJob(os.path.join(self.context, "api"), "user/api", self._docker_client(), None, False, output),
+                BuildJob(os.path.join(self.context, "web"), "user/web", self._docker_client(2), None, False, output)]
+        run_jobs(jobs, 2)
+
+        self.assertEqual([BUILT, FAILED], [job.status for job in jobs])
+        lines = stdout.getvalue().splitlines()
+        self.assertIn("user/api | Step 1 : done", lines)
+        self.assertIn("user/api | Successfully built", lines)
+        self.assertEqual(3, len([line for line in lines if line.startswith("user/web | ")]))
+        self.assertEqual("user/web | The builder exited with status 2\n", stderr.getvalue())
+
+    def test_build_jobs_save_builds_once_over(self):
+        output = PrefixedOutput(["user/api", "user/web"], StringIO.StringIO(), StringIO.StringIO())
+        jobs = [BuildJob(os.path.join(self.context, name), "user/%s" % name, self._docker_client(), None, False, output)
+                for name in ["api", "web"]]
+        run_jobs(jobs, 2)
+
+        self.assertEqual({}, buildcache.utils.load_cache(buildcache.BUILD_CACHE))
+        buildcache.save_builds([job.cache_entry for job in jobs])
+        builds = buildcache.utils.load_cache(buildcache.BUILD_CACHE)
+        self.assertEqual(["user/api", "user/web"], sorted([build['tag'] for build in builds.values()]))
@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
 import unittest
+import json
+import os
+import shutil
+import tempfile
 import __builtin__
 import StringIO
 import uuid
 
+import docker
 import mock
 from tutum.api.exceptions import *
 from tutumcli.commands import *
@@ -296,7 +301,7 @@ SERVICE1  7A4CFE51  \u25b6 Running              3  test/service1              ww
 SERVICE2  8B4CFE51  \u25fc Stopped              2  test/service2              www.myhello2service.com  service2'''
         mock_list.return_value = self.servicelist
         mock_stack.return_value = self.stacklist
-        service_ps(False, 'Running', None)
+        service_ps(False, 'Running', None, False)
 
         mock_list.assert_called_with(state='Running', stack=None)
         self.buf.getvalue().strip()
@@ -310,7 +315,7 @@ SERVICE2  8B4CFE51  \u25fc Stopped              2  test/service2              ww
 8B4CFE51-03BB-42D6-825E-3B533888D8CD'''
         mock_stack.return_value = self.stacklist
         mock_list.return_value = self.servicelist
-        service_ps(True, None, None)
+        service_ps(True, None, None, False)
 
         self.assertEqual(output, self.buf.getvalue().strip())
         self.buf.truncate(0)
@@ -318,7 +323,7 @@ SERVICE2  8B4CFE51  \u25fc Stopped              2  test/service2              ww
     @mock.patch('tutumcli.commands.sys.exit')
     @mock.patch('tutumcli.commands.tutum.Service.list', side_effect=TutumApiError)
     def test_service_ps_with_exception(self, mock_list, mock_exit):
-        service_ps(False, None, None)
+        service_ps(False, None, None, False)
         mock_exit.assert_called_with(EXCEPTION_EXIT_CODE)
 
     @mock.patch('tutumcli.commands.tutum.Stack.list')
@@ -332,7 +337,7 @@ SERVICE2  8B4CFE51  \u25fc Stopped                 2  test/service2
         self.servicelist[0].synchronized = False
         mock_stack.return_value = self.stacklist
         mock_list.return_value = self.servicelist
-        service_ps(False, 'Running', None)
+        service_ps(False, 'Running', None, False)
 
         mock_list.assert_called_with(state='Running', stack=None)
         self.assertEqual(output, self.buf.getvalue().strip())
@@ -631,6 +636,39 @@ class ServiceRedeployTestCase(unittest.TestCase):
         mock_exit.assert_called_with(EXCEPTION_EXIT_CODE)
 
 
+class ContainerExecTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stderr = sys.stderr
+        sys.stderr = self.buf = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+
+    @mock.patch('tutumcli.commands.sys.exit', side_effect=SystemExit)
+    @mock.patch('tutumcli.commands.tutum.Utils.fetch_remote_container')
+    def test_container_exec_refuses_record_without_tty(self, mock_fetch_remote_container, mock_exit):
+        self.assertRaises(SystemExit, container_exec, 'web-1', ['ls'], True, 30, 10, 0, 3, False, 'session.cast')
+        mock_exit.assert_called_with(EXCEPTION_EXIT_CODE)
+        self.assertFalse(mock_fetch_remote_container.called)
+        self.assertIn("--record", self.buf.getvalue())
+
+    @mock.patch('tutumcli.commands.sys.exit', side_effect=SystemExit)
+    @mock.patch('tutumcli.commands.tutum.Utils.fetch_remote_service')
+    def test_container_exec_fanout_refuses_record(self, mock_fetch_remote_service, mock_exit):
+        self.assertRaises(SystemExit, container_exec_fanout, ['ls'], 'web', None, 10, 30, 10, 0, 3, False,
+                          'session.cast')
+        mock_exit.assert_called_with(EXCEPTION_EXIT_CODE)
+        self.assertFalse(mock_fetch_remote_service.called)
+
+    @mock.patch('tutumcli.commands.sys.exit', side_effect=SystemExit)
+    @mock.patch('tutumcli.commands.tutum.Utils.fetch_remote_service')
+    def test_container_exec_fanout_refuses_parallel_below_one(self, mock_fetch_remote_service, mock_exit):
+        self.assertRaises(SystemExit, container_exec_fanout, ['ls'], 'web', None, 0, 30, 10, 0, 3, False, None)
+        mock_exit.assert_called_with(EXCEPTION_EXIT_CODE)
+        self.assertFalse(mock_fetch_remote_service.called)
+        self.assertIn("--parallel", self.buf.getvalue())
+
+
 class ContainerInspectTestCase(unittest.TestCase):
     def setUp(self):
         self.stdout = sys.stdout
@@ -739,7 +777,7 @@ CONTAINER2  8B4CFE51  \u25fc Stopped  test/container2  /bin/sh
         mock_service.return_value = self.servicelist
         mock_list.return_value = self.containerlist
 
-        container_ps(False, 'Running', None, False)
+        container_ps(False, 'Running', None, False, False)
 
         mock_list.assert_called_with(state='Running', service=None)
         self.assertEqual(output, self.buf.getvalue().strip())
@@ -757,7 +795,7 @@ CONTAINER2  8B4CFE51-03BB-42D6-825E-3B533888D8CD  \u25fc Stopped  test/container
         mock_stack.return_value = self.stacklist
         mock_service.return_value = self.servicelist
         mock_list.return_value = self.containerlist
-        container_ps(False, 'Running', None, True)
+        container_ps(False, 'Running', None, True, False)
 
         mock_list.assert_called_with(state='Running', service=None)
         self.assertEqual(output, self.buf.getvalue().strip())
@@ -774,7 +812,7 @@ CONTAINER2  8B4CFE51-03BB-42D6-825E-3B533888D8CD  \u25fc Stopped  test/container
         mock_stack.return_value = self.stacklist
         mock_service.return_value = self.servicelist
         mock_list.return_value = self.containerlist
-        container_ps(True, None, None, False)
+        container_ps(True, None, None, False, False)
         self.assertEqual(output, self.buf.getvalue().strip())
         self.buf.truncate(0)
 
@@ -782,7 +820,7 @@ CONTAINER2  8B4CFE51-03BB-42D6-825E-3B533888D8CD  \u25fc Stopped  test/container
     @mock.patch('tutumcli.commands.sys.exit')
     @mock.patch('tutumcli.commands.tutum.Container.list', side_effect=TutumApiError)
     def test_container_ps_with_exception(self, mock_list, mock_exit):
-        container_ps(None, None, None, False)
+        container_ps(None, None, None, False, False)
 
         mock_exit.assert_called_with(EXCEPTION_EXIT_CODE)
 
@@ -899,6 +937,56 @@ class ContainerRedeployTestCase(unittest.TestCase):
         mock_exit.assert_called_with(EXCEPTION_EXIT_CODE)
 
 
+class BuildTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stderr = sys.stderr
+        sys.stderr = self.buf = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+
+    @mock.patch('tutumcli.commands.sys.exit', side_effect=SystemExit)
+    @mock.patch('tutumcli.commands.utils.get_docker_client')
+    def test_build_refuses_parallel_below_one(self, mock_get_docker_client, mock_exit):
+        self.assertRaises(SystemExit, build, None, None, None, False, 86400, False, 'builds.yml', -1)
+        mock_exit.assert_called_with(EXCEPTION_EXIT_CODE)
+        self.assertFalse(mock_get_docker_client.called)
+        self.assertIn("--parallel", self.buf.getvalue())
+
+    @mock.patch('tutumcli.commands.sys.exit', side_effect=SystemExit)
+    @mock.patch('tutumcli.commands.utils.get_docker_client')
+    def test_build_refuses_tag_with_build_file(self, mock_get_docker_client, mock_exit):
+        self.assertRaises(SystemExit, build, 'user/web', None, None, False, 86400, False, 'builds.yml', 4)
+        mock_exit.assert_called_with(EXCEPTION_EXIT_CODE)
+        self.assertFalse(mock_get_docker_client.called)
+        self.assertIn("-t", self.buf.getvalue())
+
+
+class ImagePushTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stderr = sys.stderr
+        sys.stderr = self.buf = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+
+    @mock.patch('tutumcli.commands.sys.exit', side_effect=SystemExit)
+    @mock.patch('tutumcli.commands.utils.get_docker_client')
+    def test_image_push_refuses_parallel_below_one(self, mock_get_docker_client, mock_exit):
+        self.assertRaises(SystemExit, image_push, ['user/web'], False, None, 0, 3)
+        mock_exit.assert_called_with(EXCEPTION_EXIT_CODE)
+        self.assertFalse(mock_get_docker_client.called)
+        self.assertIn("--parallel", self.buf.getvalue())
+
+    @mock.patch('tutumcli.commands.sys.exit', side_effect=SystemExit)
+    @mock.patch('tutumcli.commands.utils.get_docker_client')
+    def test_image_push_refuses_public_with_destinations(self, mock_get_docker_client, mock_exit):
+        self.assertRaises(SystemExit, image_push, ['user/web'], True, 'tutum', 4, 3)
+        mock_exit.assert_called_with(EXCEPTION_EXIT_CODE)
+        self.assertFalse(mock_get_docker_client.called)
+        self.assertIn("--public", self.buf.getvalue())
+
+
 class ImageListTestCase(unittest.TestCase):
     def setUp(self):
         self.stdout = sys.stdout
@@ -1019,9 +1107,14 @@ class ImageSearchTestCase(unittest.TestCase):
     def setUp(self):
         self.stdout = sys.stdout
         sys.stdout = self.buf = StringIO.StringIO()
+        self.cache_dir = tempfile.mkdtemp()
+        self.environ = mock.patch.dict(os.environ, {'TUTUM_CACHE_DIR': self.cache_dir})
+        self.environ.start()
 
     def tearDown(self):
         sys.stdout = self.stdout
+        self.environ.stop()
+        shutil.rmtree(self.cache_dir)
 
     @mock.patch.object(tutumcli.commands.utils.docker.Client, 'search')
     @mock.patch('tutumcli.utils.get_docker_client')
@@ -1053,16 +1146,39 @@ class ImageSearchTestCase(unittest.TestCase):
 wma55/u1210sshd  1st image            0  ✓
 jdswinbank/sshd  2nd image            0              ✓
 vgauthier/sshd   3rd image            0  ✓           ✓'''
-        image_search('keyword')
+        image_search('keyword', None, None, False, 'table', 3600)
         self.assertEqual(output, self.buf.getvalue().strip())
         self.buf.truncate(0)
 
+    @mock.patch.object(tutumcli.commands.utils.docker.Client, 'search')
+    @mock.patch('tutumcli.utils.get_docker_client')
+    def test_image_search_filters_cached_results(self, mock_get_docker_client, mock_search):
+        mock_get_docker_client.return_value = docker.Client()
+        mock_search.return_value = [
+            {"description": "web", "is_official": False, "is_trusted": False, "name": "user/nginx", "star_count": 3},
+            {"description": "web", "is_official": True, "is_trusted": False, "name": "nginx", "star_count": 900},
+            {"description": "web", "is_official": True, "is_trusted": True, "name": "tutum/nginx", "star_count": 10},
+            {"description": "web", "is_official": False, "is_trusted": True, "name": "other/nginx", "star_count": 50}]
+        image_search('nginx', 2, 5, False, 'json', 3600)
+        self.assertEqual(["nginx", "tutum/nginx"], [result["name"] for result in json.loads(self.buf.getvalue())])
+        self.buf.truncate(0)
+
+        image_search('nginx', None, None, True, 'json', 3600)
+        self.assertEqual(["nginx", "tutum/nginx"], [result["name"] for result in json.loads(self.buf.getvalue())])
+        self.buf.truncate(0)
+        mock_search.assert_called_once_with('nginx')
+
+        image_search('nginx', 1, None, False, 'table', 0)
+        self.assertIn("user/nginx", self.buf.getvalue())
+        self.assertNotIn("tutum/nginx", self.buf.getvalue())
+        self.assertEqual(2, mock_search.call_count)
+
     @mock.patch('tutumcli.commands.sys.exit')
     @mock.patch.object(tutumcli.commands.utils.docker.Client, 'search', side_effect=TutumApiError)
     @mock.patch('tutumcli.utils.get_docker_client')
     def test_image_search_with_exception(self, mock_get_docker_client, mock_search, mock_exit):
         mock_get_docker_client.return_value = docker.Client()
-        image_search('keyword')
+        image_search('keyword', None, None, False, 'table', 3600)
 
         mock_exit.assert_called_with(EXCEPTION_EXIT_CODE)
 
@@ -1128,7 +1244,7 @@ bd276db4  bd276db4-tifayuki.node.tutum.io"              ⚙ Deploying  test_node
         nodecluster = tutumcli.commands.tutum.NodeCluster()
         nodecluster.name = 'test_nodecluster'
         mock_fetch.return_value = nodecluster
-        node_list(quiet=False)
+        node_list(quiet=False, from_cache=False)
 
         self.assertEqual(output, self.buf.getvalue().strip())
         self.buf.truncate(0)
@@ -1142,7 +1258,7 @@ bd276db4-cd35-4311-8110-1c82885c33d2'''
         nodecluster = tutumcli.commands.tutum.NodeCluster()
         nodecluster.name = 'test_nodecluster'
         mock_fetch.return_value = nodecluster
-        node_list(quiet=True)
+        node_list(quiet=True, from_cache=False)
 
         self.assertEqual(output, self.buf.getvalue().strip())
         self.buf.truncate(0)
@@ -1150,7 +1266,7 @@ bd276db4-cd35-4311-8110-1c82885c33d2'''
     @mock.patch('tutumcli.commands.sys.exit')
     @mock.patch('tutumcli.commands.tutum.Node.list', side_effect=TutumApiError)
     def test_node_list(self, mock_list, mock_exit):
-        node_list(False)
+        node_list(False, False)
 
         mock_exit.assert_called_with(EXCEPTION_EXIT_CODE)
 
@@ -0,0 +1,221 @@
+import unittest
+import StringIO
+import os
+import shutil
+import sys
+import tempfile
+
+import mock
+import tutum
+from tutum.api.exceptions import *
+from tutumcli.events import *
+from tutumcli.exceptions import *
+
+
+class EventStreamTestCase(unittest.TestCase):
+    def test_event_stream_bad_overflow_policy(self):
+        self.assertRaises(BadParameter, EventStream, overflow='drop-newest')
+
+    def test_event_stream_drop_oldest(self):
+        stream = EventStream(buffer_size=2, overflow=DROP_OLDEST)
+        for i in range(5):
+            stream.put({'id': i})
+        self.assertEqual(3, stream.dropped)
+        self.assertEqual({'id': 3}, stream.buffer.get_nowait())
+        self.assertEqual({'id': 4}, stream.buffer.get_nowait())
+
+    def test_event_stream_iter_raises_errors(self):
+        stream = EventStream()
+        stream._receiver = mock.MagicMock()
+        stream.put({'id': 1})
+        stream.put(TutumAuthError("Not authorized"))
+        iterator = iter(stream)
+        self.assertEqual({'id': 1}, next(iterator))
+        self.assertRaises(TutumAuthError, next, iterator)
+
+    @mock.patch('tutumcli.events.tutum.TutumEvents')
+    def test_event_stream_reconnect_reports_gap(self, mock_events):
+        stream = EventStream(heartbeat=0)
+        gaps = []
+        stream.on_gap(lambda start, end: gaps.append((start, end)))
+        connections = []
+
+        def run_forever():
+            events = mock_events.return_value
+            connections.append(True)
+            events.open_handler()
+            events.message_handler({'id': len(connections)})
+            if len(connections) == 2:
+                stream._stopped.set()
+
+        mock_events.return_value.auth_error = False
+        mock_events.return_value.on_open.side_effect = \
+            lambda handler: setattr(mock_events.return_value, 'open_handler', handler)
+        mock_events.return_value.on_message.side_effect = \
+            lambda handler: setattr(mock_events.return_value, 'message_handler', handler)
+        mock_events.return_value.ws.run_forever.side_effect = run_forever
+        with mock.patch.object(stream._stopped, 'wait'):
+            stream._receive()
+
+        self.assertEqual(2, len(connections))
+        self.assertEqual(1, len(gaps))
+        self.assertLessEqual(gaps[0][0], gaps[0][1])
+        self.assertEqual([{'id': 1}, {'id': 2}], [stream.buffer.get_nowait(), stream.buffer.get_nowait()])
+
+    @mock.patch('tutumcli.events.tutum.TutumEvents')
+    def test_event_stream_auth_error(self, mock_events):
+        stream = EventStream(heartbeat=0)
+        mock_events.return_value.auth_error = True
+        stream._receive()
+        self.assertIsInstance(stream.buffer.get_nowait(), TutumAuthError)
+
+
+class StateMirrorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.mirror = StateMirror(os.path.join(self.tmpdir, MIRROR_FILE))
+        self.mirror.objects['stack'] = {
+            '/api/v1/stack/1/': {'uuid': '7a4cfe51-03bb-42d6-825e-3b533888d8cd', 'name': 'web',
+                                 'resource_uri': '/api/v1/stack/1/', 'state': 'Running'},
+            '/api/v1/stack/2/': {'uuid': '8b4cfe51-03bb-42d6-825e-3b533888d8cd', 'name': 'db',
+                                 'resource_uri': '/api/v1/stack/2/', 'state': 'Stopped'},
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_state_mirror_list(self):
+        self.assertEqual(['db', 'web'], [s.name for s in self.mirror.list('stack')])
+        self.assertEqual(['web'], [s.name for s in self.mirror.list('stack', state='Running')])
+        self.assertEqual(['db', 'web'], [s.name for s in self.mirror.list('stack', state=None)])
+
+    def test_state_mirror_find(self):
+        self.assertEqual('web', self.mirror.find('stack', '7a4c').name)
+        self.assertEqual('db', self.mirror.find('stack', 'db').name)
+        self.assertIsInstance(self.mirror.find('stack', 'cache'), ObjectNotFound)
+        self.mirror.objects['stack']['/api/v1/stack/2/']['name'] = 'web'
+        self.assertIsInstance(self.mirror.find('stack', 'web'), NonUniqueIdentifier)
+
+    @mock.patch('tutumcli.events.tutum.Utils.fetch_by_resource_uri')
+    def test_state_mirror_apply_and_refresh(self, mock_fetch):
+        self.mirror.apply({'type': 'stack', 'action': 'update', 'state': 'Stopping',
+                           'resource_uri': '/api/v1/stack/1/'})
+        self.mirror.apply({'type': 'stack', 'action': 'delete', 'resource_uri': '/api/v1/stack/2/'})
+        self.mirror.apply({'type': 'action', 'action': 'create', 'resource_uri': '/api/v1/action/3/'})
+        self.assertEqual('Stopping', self.mirror.objects['stack']['/api/v1/stack/1/']['state'])
+
+        stack = tutum.Stack(uuid='7a4cfe51-03bb-42d6-825e-3b533888d8cd', name='web',
+                            resource_uri='/api/v1/stack/1/', state='Stopped')
+        mock_fetch.side_effect = lambda uri: stack if uri == '/api/v1/stack/1/' else \
+            _raise(TutumApiError("Status 404 (GET %s). Response: " % uri))
+        self.mirror.refresh()
+
+        self.assertEqual(['/api/v1/stack/1/'], self.mirror.objects['stack'].keys())
+        self.assertEqual('Stopped', self.mirror.objects['stack']['/api/v1/stack/1/']['state'])
+        self.assertEqual(set(), self.mirror.pending)
+
+    def test_state_mirror_save_and_load(self):
+        self.mirror.save()
+        mirror = StateMirror.load(self.mirror.path)
+        self.assertEqual(self.mirror.objects, mirror.objects)
+        self.assertFalse(mirror.is_stale)
+        mirror.updated -= mirror.reconcile_interval * 3
+        self.assertTrue(mirror.is_stale)
+        self.assertIsNone(StateMirror.load(os.path.join(self.tmpdir, 'missing.json')))
+
+    @mock.patch('tutumcli.events.utils.get_cache_path')
+    def test_get_state(self, mock_get_cache_path):
+        mock_get_cache_path.return_value = self.mirror.path
+        stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            self.assertIsInstance(get_state(True), LiveState)
+            self.mirror.save()
+            self.assertIsInstance(get_state(True), StateMirror)
+            self.assertIsInstance(get_state(False), LiveState)
+        finally:
+            sys.stderr = stderr
+
+
+def _raise(e):
+    raise e
+
+
+class EventLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'events.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def record(self, events, block_size=2):
+        recorder = EventRecorder(self.path, block_size=block_size)
+        for timestamp, event in events:
+            recorder.write(event, timestamp)
+        recorder.close()
+
+    def test_event_log_round_trip(self):
+        events = [(1000.0 + i, {'type': 'container', 'state': 'Running', 'id': i}) for i in range(5)]
+        self.record(events)
+        self.assertEqual(events, list(read_event_log(self.path)))
+        with open(self.path + EVENT_LOG_INDEX_SUFFIX) as f:
+            self.assertEqual(3, len(f.readlines()))
+
+    def test_event_log_append(self):
+        self.record([(1000.0, {'id': 1})])
+        self.record([(1001.0, {'id': 2})])
+        self.assertEqual([{'id': 1}, {'id': 2}], [e for t, e in read_event_log(self.path)])
+
+    def test_event_log_without_index(self):
+        self.record([(1000.0, {'id': 1}), (1001.0, {'id': 2}), (1002.0, {'id': 3})])
+        os.remove(self.path + EVENT_LOG_INDEX_SUFFIX)
+        self.assertEqual([{'id': 1}, {'id': 2}, {'id': 3}], [e for t, e in read_event_log(self.path)])
+
+    def test_event_log_ignores_truncated_block(self):
+        self.record([(1000.0, {'id': 1}), (1001.0, {'id': 2}), (1002.0, {'id': 3})])
+        with open(self.path, 'ab') as f:
+            f.write('\x1f\x8b\x08')
+        self.assertEqual([{'id': 1}, {'id': 2}, {'id': 3}], [e for t, e in read_event_log(self.path)])
+
+    @mock.patch('tutumcli.events.time.sleep')
+    def test_replay_event_log_speed(self, mock_sleep):
+        self.record([(1000.0, {'id': 1}), (1010.0, {'id': 2})])
+        self.assertEqual([(1000.0, {'id': 1}), (1010.0, {'id': 2})], list(replay_event_log(self.path, 10)))
+        self.assertAlmostEqual(1, mock_sleep.call_args[0][0], places=1)
+        mock_sleep.reset_mock()
+        list(replay_event_log(self.path, 0))
+        self.assertFalse(mock_sleep.called)
+
+
+class EventStatsTestCase(unittest.TestCase):
+    def test_event_stats_windows(self):
+        stats = EventStats()
+        stats.add({'type': 'container', 'action': 'update', 'state': 'Running',
+                   'parents': ['/api/v1/service/7a4cfe51-03bb-42d6-825e-3b533888d8cd/']}, 1000)
+        stats.add({'type': 'container', 'action': 'update', 'state': 'Stopped'}, 1200)
+        stats.add({'type': 'service', 'action': 'create',
+                   'resource_uri': '/api/v1/service/7a4cfe51-03bb-42d6-825e-3b533888d8cd/'}, 1230)
+
+        counts = stats.snapshot(1235)['counts']
+        self.assertEqual({'1m': 1, '5m': 2, '15m': 2}, counts['type']['container'])
+        self.assertEqual({'1m': 1, '5m': 1, '15m': 1}, counts['type']['service'])
+        self.assertEqual({'1m': 0, '5m': 1, '15m': 1}, counts['state']['Running'])
+        self.assertEqual({'1m': 1, '5m': 2, '15m': 2}, counts['service']['7a4cfe51'])
+
+        counts = stats.snapshot(2000)['counts']
+        self.assertEqual({'1m': 0, '5m': 0, '15m': 1}, counts['type']['container'])
+        self.assertEqual({}, stats.snapshot(3000)['counts'])
+
+    def test_event_stats_deployment_latencies(self):
+        stats = EventStats()
+        for timestamp, state in [(1000, 'Redeploying'), (1005, 'Redeploying'), (1030, 'Running')]:
+            stats.add({'type': 'service', 'state': state, 'resource_uri': '/api/v1/service/1/'}, timestamp)
+        stats.add({'type': 'container', 'state': 'Starting', 'resource_uri': '/api/v1/container/1/'}, 1000)
+        stats.add({'type': 'container', 'state': 'Start failed', 'resource_uri': '/api/v1/container/1/'}, 1010)
+
+        latencies = stats.snapshot(1040)['latencies']
+        self.assertEqual({'count': 1, 'mean': 30, 'p95': 30, 'max': 30}, latencies['service redeploy'])
+        self.assertEqual({'count': 1, 'mean': 10, 'p95': 10, 'max': 10}, latencies['container deploy'])
+        self.assertEqual({}, stats.deploying)
+        self.assertEqual({}, stats.snapshot(5000)['latencies'])
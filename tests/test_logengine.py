@@ -0,0 +1,130 @@
+import unittest
+import base64
+import hashlib
+import json
+import socket
+import struct
+import threading
+import StringIO
+
+import mock
+import tutum
+from websocket import ABNF
+from tutumcli.logengine import *
+from tutumcli.logs import LogSource, LogMultiplexer, stream_logs
+
+
+def _frame(payload, opcode=ABNF.OPCODE_TEXT, fin=True, mask_key=None):
+    header = chr((0x80 if fin else 0) | opcode)
+    mask_bit = 0x80 if mask_key else 0
+    if len(payload) < 126:
+        header += chr(mask_bit | len(payload))
+    elif len(payload) < 1 << 16:
+        header += chr(mask_bit | 126) + struct.pack("!H", len(payload))
+    else:
+        header += chr(mask_bit | 127) + struct.pack("!Q", len(payload))
+    if mask_key:
+        return header + mask_key + ABNF.mask(mask_key, payload)
+    return header + payload
+
+
+class FrameParserTestCase(unittest.TestCase):
+    def test_frame_parser_partial_frames(self):
+        parser = FrameParser()
+        data = _frame('a' * 200) + _frame('b' * 70000) + _frame('c', mask_key='abcd')
+        frames = []
+        for i in range(0, len(data), 1000):
+            frames.extend(parser.feed(data[i:i + 1000]))
+        self.assertEqual([(ABNF.OPCODE_TEXT, 'a' * 200), (ABNF.OPCODE_TEXT, 'b' * 70000), (ABNF.OPCODE_TEXT, 'c')],
+                         frames)
+        self.assertEqual("", parser.buffer)
+
+    def test_create_frame_masks_payload(self):
+        for payload in ["", "a", "\x00\xff" * 3, "x" * 70001]:
+            self.assertEqual(ABNF.mask("abcd", payload), mask("abcd", payload))
+            self.assertEqual([(ABNF.OPCODE_BINARY, payload)],
+                             FrameParser().feed(create_frame(payload, ABNF.OPCODE_BINARY)))
+
+    def test_frame_parser_fragments_and_control_frames(self):
+        parser = FrameParser()
+        data = _frame('ab', fin=False) + _frame('', ABNF.OPCODE_PING) + _frame('cd', OPCODE_CONT)
+        self.assertEqual([(ABNF.OPCODE_PING, ''), (ABNF.OPCODE_TEXT, 'abcd')], parser.feed(data))
+
+
+class LogEngineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(16)
+        self.stream_url = tutum.stream_url
+        tutum.stream_url = 'ws://127.0.0.1:%d/v1/' % self.server.getsockname()[1]
+        self.requests = []
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        tutum.stream_url = self.stream_url
+        self.server.close()
+
+    def serve(self):
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except socket.error:
+                return
+            request = ""
+            while "\r\n\r\n" not in request:
+                request += client.recv(4096)
+            self.requests.append(request.split("\r\n")[0])
+            key = [line.split(":", 1)[1].strip() for line in request.split("\r\n")
+                   if line.lower().startswith("sec-websocket-key")][0]
+            accept = base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID).digest())
+            response = "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n" \
+                       "Sec-WebSocket-Accept: %s\r\n\r\n" % accept
+            name = request.split(" ")[1].split("/")[3]
+            for i in range(3):
+                response += _frame(json.dumps({'type': 'log', 'log': '%s %d\n' % (name, i), 'timestamp': i}))
+            client.sendall(response + _frame('', ABNF.OPCODE_CLOSE))
+            client.close()
+
+    def test_log_engine_streams_sources_in_one_thread(self):
+        engine = LogEngine()
+        sources = [LogSource('web-%d' % i, 'container', 'web-%d' % i, None, False, buffer_size=2, engine=engine)
+                   for i in range(20)]
+        output = mock.MagicMock()
+        self.assertEqual([], LogMultiplexer(sources, output).run())
+        lines = "".join([c[0][0] for c in output.write.call_args_list]).splitlines()
+        self.assertEqual(60, len(lines))
+        self.assertIn('web-7  | web-7 2', lines)
+        self.assertEqual(20, len(self.requests))
+
+    def test_stream_logs(self):
+        output = StringIO.StringIO()
+        targets = [('web-1', 'container', 'web-1'), ('web', 'service', 'web')]
+        self.assertEqual([], stream_logs(targets, output, None, False))
+        lines = output.getvalue().splitlines()
+        self.assertEqual(['web   | web 0', 'web   | web 1', 'web   | web 2'],
+                         [line for line in lines if line.startswith('web ')])
+        self.assertEqual(6, len(lines))
+        self.assertEqual(['GET /v1/container/web-1/logs/', 'GET /v1/service/web/logs/'],
+                         sorted([request.split("?")[0] for request in self.requests]))
+
+    def test_log_engine_reports_handshake_errors(self):
+        tutum.stream_url = 'ws://127.0.0.1:1/v1/'
+        engine = LogEngine()
+        source = LogSource('web-1', 'container', 'uuid', None, False, engine=engine)
+        self.assertEqual([source], LogMultiplexer([source], mock.MagicMock()).run())
+
+    def test_log_engine_replays_after_reconnection(self):
+        engine = LogEngine()
+        source = LogSource('web-1', 'container', 'uuid', None, True, engine=engine)
+        source._on_message(json.dumps({'type': 'log', 'log': 'a\n', 'timestamp': 10}))
+        engine.connections[source] = mock.MagicMock(opened=True)
+        engine._disconnect(source, None)
+        self.assertEqual(10, source.replay_timestamp)
+        self.assertEqual(RECONNECT_TAIL, engine.reconnects[0][3])
+        source._on_message(json.dumps({'type': 'log', 'log': 'a\n', 'timestamp': 10}))
+        source._on_message(json.dumps({'type': 'log', 'log': 'b\n', 'timestamp': 11}))
+        self.assertEqual(['a\n', 'b\n'], [source.buffer.get_nowait()['log'] for i in range(2)])
+        self.assertIsNone(source.replay_timestamp)
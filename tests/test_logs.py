@@ -0,0 +1,191 @@
+import unittest
+import StringIO
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import mock
+from tutumcli.logs import *
+from tutumcli.exceptions import *
+
+
+class LogFilterTestCase(unittest.TestCase):
+    def test_log_filter_grep_and_exclude(self):
+        log_filter = LogFilter(grep=['error', 'warn'], exclude=['healthcheck'])
+        message = {'log': 'info: started\nerror: failed\nwarn: healthcheck slow\nwarn: disk\n', 'timestamp': 10}
+        self.assertEqual({'log': 'error: failed\nwarn: disk\n', 'timestamp': 10}, log_filter.apply(message))
+        self.assertIsNone(log_filter.apply({'log': 'info: ok\n'}))
+
+    def test_log_filter_time_window(self):
+        log_filter = LogFilter(since=10, until=20)
+        self.assertIsNone(log_filter.apply({'log': 'a\n', 'timestamp': 9}))
+        self.assertEqual({'log': 'a\n', 'timestamp': 10}, log_filter.apply({'log': 'a\n', 'timestamp': 10}))
+        self.assertTrue(log_filter.is_after({'log': 'a\n', 'timestamp': 21}))
+        self.assertFalse(LogFilter().is_after({'log': 'a\n', 'timestamp': 21}))
+
+    def test_log_filter_bad_pattern(self):
+        self.assertRaises(BadParameter, LogFilter, grep=['('])
+
+
+class LogSourceTestCase(unittest.TestCase):
+    def feed(self, source, messages):
+        for timestamp, log in messages:
+            source._on_message(json.dumps({'type': 'log', 'log': log, 'timestamp': timestamp}))
+        lines = []
+        while not source.buffer.empty():
+            lines.append(source.buffer.get_nowait()['log'])
+        return lines
+
+    def test_log_source_skips_replayed_lines(self):
+        source = LogSource('web-1', 'container', 'uuid', None, True)
+        self.assertEqual(['a\n', 'b\n', 'b\n', 'c\n'],
+                         self.feed(source, [(10, 'a\n'), (11, 'b\n'), (11, 'b\n'), (11, 'c\n')]))
+        source.start_replay()
+        # only the lines up to the last one seen are skipped, then out of order lines are kept again
+        self.assertEqual(['b\n', 'd\n', 'a\n', 'c\n'],
+                         self.feed(source, [(10, 'a\n'), (11, 'b\n'), (11, 'b\n'), (11, 'b\n'), (11, 'd\n'),
+                                            (12, 'a\n'), (11, 'c\n')]))
+
+    def test_log_source_keeps_repeated_and_interleaved_lines(self):
+        source = LogSource('web', 'service', 'uuid', None, False)
+        self.assertEqual(['ping', 'ping', 'a', 'from container 2'],
+                         self.feed(source, [(100, 'ping'), (100, 'ping'), (101, 'a'), (100.5, 'from container 2')]))
+
+    def test_log_source_error(self):
+        source = LogSource('web-1', 'container', 'uuid', None, True)
+        source._on_message(json.dumps({'type': 'error', 'data': {'errorMessage': 'UNAUTHORIZED'}}))
+        self.assertEqual('UNAUTHORIZED', source.error)
+        self.assertTrue(source.buffer.empty())
+
+    def test_log_source_filters_before_buffering(self):
+        source = LogSource('web-1', 'container', 'uuid', None, True, log_filter=LogFilter(grep=['b'], until=12))
+        source.stop = mock.MagicMock()
+        for timestamp, log in [(10, 'a\n'), (11, 'b\n'), (13, 'b\n')]:
+            source._on_message(json.dumps({'type': 'log', 'log': log, 'timestamp': timestamp}))
+        self.assertEqual('b\n', source.buffer.get_nowait()['log'])
+        self.assertTrue(source.buffer.empty())
+        self.assertTrue(source.stop.called)
+
+
+class LogMultiplexerTestCase(unittest.TestCase):
+    def fake_source(self, name, messages):
+        source = LogSource(name, 'container', name, None, False)
+        source.start = lambda notify: [source.put(m) for m in messages + [None]]
+        return source
+
+    def test_log_multiplexer_single_source(self):
+        output = StringIO.StringIO()
+        LogMultiplexer([self.fake_source('web-1', [{'log': 'a\n'}, {'log': 'b\n'}])], output).run()
+        self.assertEqual('a\nb\n', output.getvalue())
+
+    def test_log_multiplexer_prefixes_sources(self):
+        output = StringIO.StringIO()
+        sources = [self.fake_source('web-1', [{'log': 'a\nb\n'}]), self.fake_source('db-10', [{'log': 'c'}])]
+        errors = LogMultiplexer(sources, output).run()
+        self.assertEqual([], errors)
+        self.assertEqual(['web-1 | a', 'web-1 | b', 'db-10 | c'], output.getvalue().splitlines())
+
+
+class LogMergerTestCase(unittest.TestCase):
+    def fake_source(self, name, messages, follow=False):
+        source = LogSource(name, 'container', name, None, follow)
+        source.start = lambda notify: [source.put(m) for m in messages + [None]]
+        return source
+
+    def test_log_merger_orders_by_timestamp(self):
+        output = StringIO.StringIO()
+        sources = [self.fake_source('web-1', [{'log': 'a\n', 'timestamp': 1}, {'log': 'd\n', 'timestamp': 4}]),
+                   self.fake_source('web-2', [{'log': 'b\n', 'timestamp': 2}, {'log': 'c\n', 'timestamp': 3},
+                                              {'log': 'e\n', 'timestamp': 5}]),
+                   self.fake_source('web-3', [])]
+        LogMerger(sources, output).run()
+        self.assertEqual(['web-1 | a', 'web-2 | b', 'web-2 | c', 'web-1 | d', 'web-2 | e'],
+                         output.getvalue().splitlines())
+
+    def test_log_merger_keeps_source_order_on_ties(self):
+        output = StringIO.StringIO()
+        sources = [self.fake_source('web-1', [{'log': 'a\n', 'timestamp': 1}, {'log': 'b\n', 'timestamp': 1}]),
+                   self.fake_source('web-2', [{'log': 'c\n', 'timestamp': 1}])]
+        LogMerger(sources, output).run()
+        lines = output.getvalue().splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertLess(lines.index('web-1 | a'), lines.index('web-1 | b'))
+
+    def test_log_merger_window_when_following(self):
+        output = StringIO.StringIO()
+        sources = [self.fake_source('web-1', [{'log': 'b\n', 'timestamp': 2}, {'log': 'd\n', 'timestamp': 4}], True),
+                   self.fake_source('web-2', [{'log': 'a\n', 'timestamp': 1}, {'log': 'c\n', 'timestamp': 3}], True)]
+        LogMerger(sources, output, window=5).run()
+        self.assertEqual(['web-2 | a', 'web-1 | b', 'web-2 | c', 'web-1 | d'], output.getvalue().splitlines())
+
+
+class LogArchiverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def fake_source(self, name, messages):
+        source = LogSource(name, 'container', name, None, False)
+        source.start = lambda notify: [source.put(m) for m in messages + [None]]
+        return source
+
+    def test_log_archiver_writes_one_file_per_source(self):
+        sources = [self.fake_source('web-1', [{'log': 'a\n'}, {'log': 'b\n'}]),
+                   self.fake_source('web-2', [{'log': 'c\n'}])]
+        self.assertEqual([], LogArchiver(sources, os.path.join(self.tmpdir, 'logs')).run())
+        with open(os.path.join(self.tmpdir, 'logs', 'web-1.log')) as f:
+            self.assertEqual('a\nb\n', f.read())
+        with open(os.path.join(self.tmpdir, 'logs', 'web-2.log')) as f:
+            self.assertEqual('c\n', f.read())
+
+    def test_log_file_rotates_and_compresses(self):
+        compressor = LogCompressor()
+        log_file = LogFile(self.tmpdir, 'web-1', compressor, 4, None)
+        log_file.write('abc\n')
+        log_file.flush()
+        log_file.write('d\n')
+        log_file.close()
+        compressor.stop()
+
+        names = sorted(os.listdir(self.tmpdir))
+        self.assertEqual(2, len(names))
+        self.assertEqual('web-1.log', names[1])
+        self.assertTrue(names[0].startswith('web-1-') and names[0].endswith('.log.gz'))
+        f = gzip.open(os.path.join(self.tmpdir, names[0]))
+        self.assertEqual('abc\n', f.read())
+        f.close()
+        with open(os.path.join(self.tmpdir, 'web-1.log')) as f:
+            self.assertEqual('d\n', f.read())
+
+    @mock.patch('tutumcli.logs.time.time')
+    def test_log_archiver_rotates_quiet_sources(self, mock_time):
+        mock_time.return_value = 1000.0
+        source = LogSource('web-1', 'container', 'web-1', None, True)
+        source.start = lambda notify: source.put({'log': 'a\n'})
+        directory = os.path.join(self.tmpdir, 'logs')
+        archiver = LogArchiver([source], directory, rotate_interval=60)
+        thread = threading.Thread(target=archiver.run)
+        thread.start()
+        try:
+            for i in range(50):
+                if os.path.getsize(os.path.join(directory, 'web-1.log')):
+                    break
+                time.sleep(0.1)
+            mock_time.return_value = 1061.0
+            for i in range(50):
+                if len(os.listdir(directory)) == 2:
+                    break
+                time.sleep(0.1)
+        finally:
+            source.put(None)
+            thread.join()
+        names = sorted(os.listdir(directory))
+        self.assertEqual(2, len(names))
+        self.assertTrue(names[0].startswith('web-1-'))
+        self.assertEqual(0, os.path.getsize(os.path.join(directory, 'web-1.log')))
@@ -32,13 +32,16 @@ class PatchHelpOptionTestCase(unittest.TestCase):
             ['tutum', 'container', 'start'],
             ['tutum', 'container', 'stop'],
             ['tutum', 'container', 'terminate'],
+            ['tutum', 'cp'],
             ['tutum', 'image'],
             ['tutum', 'image', 'register'],
             ['tutum', 'image', 'push'],
             ['tutum', 'image', 'rm'],
             ['tutum', 'image', 'search'],
             ['tutum', 'image', 'update'],
+            ['tutum', 'port-forward'],
             ['tutum', 'push'],
+            ['tutum', 'replay'],
             ['tutum', 'run'],
             ['tutum', 'exec'],
             ['tutum', 'node'],
@@ -114,7 +117,11 @@ class CommandsDispatchTestCase(unittest.TestCase):
     def test_build_dispatch(self, mock_cmds):
         args = self.parser.parse_args(['build', '-t', 'mysql', '.'])
         dispatch_cmds(args)
-        mock_cmds.build.assert_called_with(args.tag, args.directory, args.sock)
+        mock_cmds.build.assert_called_with(args.tag, args.directory, args.sock, None, 86400, False, None, 4)
+
+        args = self.parser.parse_args(['build', '-f', 'builds.yml', '--parallel', '8'])
+        dispatch_cmds(args)
+        mock_cmds.build.assert_called_with(None, None, None, None, 86400, False, 'builds.yml', 8)
 
     @mock.patch('tutumcli.tutum_cli.commands')
     def test_run_dispatch(self, mock_cmds):
@@ -137,13 +144,53 @@ class CommandsDispatchTestCase(unittest.TestCase):
     def test_push_dispatch(self, mock_cmds):
         args = self.parser.parse_args(['push', 'name'])
         dispatch_cmds(args)
-        mock_cmds.image_push(args.name, args.public)
+        mock_cmds.image_push.assert_called_with(['name'], False, None, 4, 3)
+
+        args = self.parser.parse_args(['push', 'web', 'api:v2', '--to', 'public,tutum', '--parallel', '2'])
+        dispatch_cmds(args)
+        mock_cmds.image_push.assert_called_with(['web', 'api:v2'], False, 'public,tutum', 2, 3)
+
+    @mock.patch('tutumcli.tutum_cli.commands')
+    def test_event_dispatch(self, mock_cmds):
+        args = self.parser.parse_args(['event', '--on-full', 'drop-oldest'])
+        dispatch_cmds(args)
+        mock_cmds.event.assert_called_with(1024, 'drop-oldest', 30, None, None, 1.0, False, 5, 'table')
+
+    @mock.patch('tutumcli.tutum_cli.commands')
+    def test_watch_dispatch(self, mock_cmds):
+        args = self.parser.parse_args(['watch'])
+        dispatch_cmds(args)
+        mock_cmds.watch.assert_called_with(300)
+
+    @mock.patch('tutumcli.tutum_cli.commands')
+    def test_cp_dispatch(self, mock_cmds):
+        args = self.parser.parse_args(['cp', 'dump.sql', 'db-1:/tmp'])
+        dispatch_cmds(args)
+        mock_cmds.cp.assert_called_with('dump.sql', 'db-1:/tmp')
+
+    @mock.patch('tutumcli.tutum_cli.commands')
+    def test_port_forward_dispatch(self, mock_cmds):
+        args = self.parser.parse_args(['port-forward', 'db-1', '15432:5432', '8080'])
+        dispatch_cmds(args)
+        mock_cmds.port_forward.assert_called_with('db-1', ['15432:5432', '8080'], '127.0.0.1')
+
+    @mock.patch('tutumcli.tutum_cli.commands')
+    def test_replay_dispatch(self, mock_cmds):
+        args = self.parser.parse_args(['replay', 'session.cast', '--speed', '2'])
+        dispatch_cmds(args)
+        mock_cmds.replay.assert_called_with('session.cast', 2.0, None)
 
     @mock.patch('tutumcli.tutum_cli.commands')
     def test_exec_dispatch(self, mock_cmds):
         args = self.parser.parse_args(['exec', 'command', 'mysql', '.'])
         dispatch_cmds(args)
-        mock_cmds.container_exec.assert_called_with(args.identifier, args.command)
+        mock_cmds.container_exec.assert_called_with(args.identifier, args.command, args.no_tty, 30, 10, 0, 3,
+                                                    False, None)
+
+        args = self.parser.parse_args(['exec', '--service', 'web', '--', 'uptime', '-a'])
+        dispatch_cmds(args)
+        mock_cmds.container_exec_fanout.assert_called_with(['uptime', '-a'], 'web', None, 10, 30, 10, 0, 3, False,
+                                                           None)
 
     @mock.patch('tutumcli.tutum_cli.commands')
     def test_up_dispatch(self, mock_cmds):
@@ -176,11 +223,12 @@ class CommandsDispatchTestCase(unittest.TestCase):
 
         args = self.parser.parse_args(['service', 'logs', 'id'])
         dispatch_cmds(args)
-        mock_cmds.service_logs.assert_called_with(args.identifier, None, False)
+        mock_cmds.service_logs.assert_called_with(args.identifier, None, False, False, None, None, None, None, None,
+                                                  100, 3600)
 
         args = self.parser.parse_args(['service', 'ps'])
         dispatch_cmds(args)
-        mock_cmds.service_ps.assert_called_with(args.quiet, args.status, args.stack)
+        mock_cmds.service_ps.assert_called_with(args.quiet, args.status, args.stack, args.from_cache)
 
         args = self.parser.parse_args(['service', 'redeploy', 'mysql'])
         dispatch_cmds(args)
@@ -236,7 +284,8 @@ class CommandsDispatchTestCase(unittest.TestCase):
     def test_container_dispatch(self, mock_cmds):
         args = self.parser.parse_args(['container', 'exec', 'id'])
         dispatch_cmds(args)
-        mock_cmds.container_exec.assert_called_with(args.identifier, args.command)
+        mock_cmds.container_exec.assert_called_with(args.identifier, args.command, args.no_tty, 30, 10, 0, 3,
+                                                    False, None)
 
         args = self.parser.parse_args(['container', 'inspect', 'id'])
         dispatch_cmds(args)
@@ -244,11 +293,12 @@ class CommandsDispatchTestCase(unittest.TestCase):
 
         args = self.parser.parse_args(['container', 'logs', 'id'])
         dispatch_cmds(args)
-        mock_cmds.container_logs.assert_called_with(args.identifier, None, False)
+        mock_cmds.container_logs.assert_called_with(args.identifier, None, False, None, None, None, None, None, 100,
+                                                    3600)
 
         args = self.parser.parse_args(['container', 'ps'])
         dispatch_cmds(args)
-        mock_cmds.container_ps.assert_called_with(args.quiet, args.status, args.service, args.no_trunc)
+        mock_cmds.container_ps.assert_called_with(args.quiet, args.status, args.service, args.no_trunc, args.from_cache)
 
         args = self.parser.parse_args(['container', 'start', 'id'])
         dispatch_cmds(args)
@@ -274,7 +324,7 @@ class CommandsDispatchTestCase(unittest.TestCase):
 
         args = self.parser.parse_args(['image', 'push', 'name'])
         dispatch_cmds(args)
-        mock_cmds.image_push(args.name, args.public)
+        mock_cmds.image_push.assert_called_with(['name'], False, None, 4, 3)
 
         args = self.parser.parse_args(['image', 'rm', 'name'])
         dispatch_cmds(args)
@@ -282,7 +332,7 @@ class CommandsDispatchTestCase(unittest.TestCase):
 
         args = self.parser.parse_args(['image', 'search', 'name'])
         dispatch_cmds(args)
-        mock_cmds.image_search(args.query)
+        mock_cmds.image_search.assert_called_with('name', None, None, False, 'table', 3600)
 
         args = self.parser.parse_args(['image', 'update', 'name'])
         dispatch_cmds(args)
@@ -373,6 +423,11 @@ class CommandsDispatchTestCase(unittest.TestCase):
         dispatch_cmds(args)
         mock_cmds.stack_list.assert_called_with(args.quiet)
 
+        args = self.parser.parse_args(['stack', 'logs', 'id'])
+        dispatch_cmds(args)
+        mock_cmds.stack_logs.assert_called_with(args.identifier, None, False, False, None, None, None, None, None,
+                                                100, 3600)
+
         args = self.parser.parse_args(['stack', 'redeploy', 'id'])
         dispatch_cmds(args)
         mock_cmds.stack_redeploy.assert_called_with(args.identifier, args.sync)
@@ -0,0 +1,89 @@
+import unittest
+import json
+import socket
+
+import mock
+from websocket import ABNF
+from tutumcli.exceptions import BadParameter, PortForwardError
+from tutumcli.logengine import FrameParser
+from tutumcli.portforward import *
+
+
+class ParsePortsTestCase(unittest.TestCase):
+    def test_parse_ports(self):
+        self.assertEqual((15432, 5432), parse_ports("15432:5432"))
+        self.assertEqual((8080, 8080), parse_ports("8080"))
+        self.assertEqual((0, 80), parse_ports("0:80"))
+        self.assertRaises(BadParameter, parse_ports, "web:80")
+        self.assertRaises(BadParameter, parse_ports, "1:2:3")
+        self.assertRaises(BadParameter, parse_ports, "8080:0")
+        self.assertRaises(BadParameter, parse_ports, "70000:80")
+
+
+class TunnelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client, self.peer = socket.socketpair()
+        self.client.setblocking(0)
+        self.tunnel = Tunnel(self.client, "ws://stream.tutum.co/v1/container/uuid/exec/")
+        self.tunnel.connection.opened = True
+
+    def tearDown(self):
+        self.tunnel.close()
+        self.peer.close()
+
+    def test_tunnel_sends_client_data_as_frames(self):
+        self.assertTrue(self.tunnel.wants_client_read())
+        self.peer.sendall("GET / caf\xc3")
+        self.tunnel.on_client_readable()
+        self.peer.sendall("\xa9\r\n")
+        self.tunnel.on_client_readable()
+        self.assertEqual([(ABNF.OPCODE_TEXT, "GET / caf"), (ABNF.OPCODE_TEXT, "\xc3\xa9\r\n")],
+                         FrameParser().feed(self.tunnel.connection.outgoing))
+
+        self.tunnel.connection.outgoing = "x" * MAX_BUFFER
+        self.assertFalse(self.tunnel.wants_client_read())
+
+    def test_tunnel_writes_remote_output_to_client(self):
+        self.tunnel.connection = mock.MagicMock()
+        self.tunnel.connection.read.return_value = ([(ABNF.OPCODE_TEXT, '{"streamType": "stdout", "output": "HTTP"}'),
+                                                     (ABNF.OPCODE_TEXT, '{"streamType": "stderr", "output": "oops"}'),
+                                                     (ABNF.OPCODE_BINARY, "\xff\x00"),
+                                                     (ABNF.OPCODE_PING, "hi")], False)
+        self.tunnel.on_remote_readable()
+        self.tunnel.connection.send_frame.assert_called_once_with("hi", ABNF.OPCODE_PONG)
+        self.assertEqual(6, self.tunnel.to_client_size)
+        self.tunnel.on_client_writable()
+        self.assertEqual("HTTP\xff\x00", self.peer.recv(100))
+        self.assertEqual(0, self.tunnel.to_client_size)
+
+        self.tunnel.connection.read.return_value = ([(ABNF.OPCODE_CLOSE, "")], False)
+        self.tunnel.on_remote_readable()
+        self.assertTrue(self.tunnel.is_done())
+
+    def test_tunnel_refuses_binary_client_data(self):
+        self.peer.sendall("\x00\xff\xfe")
+        self.assertRaises(PortForwardError, self.tunnel.on_client_readable)
+        self.assertEqual("", self.tunnel.connection.outgoing)
+
+    def test_tunnel_refuses_binary_output_sent_as_text(self):
+        self.tunnel.connection = mock.MagicMock()
+        self.tunnel.connection.read.return_value = ([(ABNF.OPCODE_TEXT, json.dumps({'streamType': 'stdout',
+                                                                                    'output': u'R\ufffd\x00'}))], False)
+        self.assertRaises(PortForwardError, self.tunnel.on_remote_readable)
+        self.assertEqual(0, self.tunnel.to_client_size)
+
+    def test_tunnel_backpressure(self):
+        self.tunnel.connection = mock.MagicMock()
+        self.tunnel.connection.wants_read.return_value = True
+        self.tunnel._queue("x" * MAX_BUFFER)
+        self.assertFalse(self.tunnel.wants_remote_read())
+        self.tunnel.on_client_writable()
+        self.assertTrue(0 < self.tunnel.to_client_size < MAX_BUFFER)
+        self.assertTrue(self.tunnel.wants_remote_read())
+
+    def test_tunnel_client_eof(self):
+        self.peer.shutdown(socket.SHUT_WR)
+        self.tunnel.on_client_readable()
+        self.assertTrue(self.tunnel.client_eof)
+        self.assertFalse(self.tunnel.wants_client_read())
+        self.assertFalse(self.tunnel.is_done())
@@ -0,0 +1,118 @@
+import unittest
+import StringIO
+import json
+import socket
+
+import mock
+from tutumcli.push import *
+from tutumcli.parallel import run_jobs
+
+
+def push_events(layers, error=None):
+    events = [{"status": "The push refers to a repository"}]
+    for layer, size in layers:
+        events.append({"status": "Buffering to disk", "id": layer, "progressDetail": {"current": size, "total": 0}})
+        events.append({"status": "Pushing", "id": layer, "progressDetail": {"current": size / 2, "total": size}})
+        events.append({"status": "Pushing", "id": layer, "progressDetail": {"current": size - 1, "total": size}})
+        events.append({"status": "Image successfully pushed", "id": layer})
+    events.append({"status": "Image already exists", "id": "base"})
+    if error:
+        events.append({"errorDetail": {"message": error}, "error": error})
+    return [json.dumps(event) for event in events]
+
+
+class PushTestCase(unittest.TestCase):
+    def test_repositories(self):
+        self.assertEqual(("user/app", "v2"), split_tag("user/app:v2"))
+        self.assertEqual(("localhost:5000/app", None), split_tag("localhost:5000/app"))
+        self.assertEqual(("tutum.co/user/app", "v2"), get_tutum_repository("other/app:v2", "https://tutum.co/", "user"))
+
+    def test_push_jobs(self):
+        docker_client = mock.MagicMock()
+
+        def push(repository, tag, stream):
+            if repository == "tutum.co/user/web":
+                return iter(push_events([("l1", 1000), ("l2", 3000)]))
+            return iter(push_events([("l3", 500)], "Error: Status 401 trying to push repository"))
+
+        docker_client.push.side_effect = push
+        # child mocks created lazily by two threads at once can replace each other
+        docker_client.tag.return_value = None
+        stdout = StringIO.StringIO()
+        monitor = PushMonitor(stdout)
+        jobs = [PushJob("web", TUTUM, docker_client, monitor, "tutum.co", "user"),
+                PushJob("web", PUBLIC, docker_client, monitor, "tutum.co", "user")]
+        monitor.start(jobs)
+        run_jobs(jobs, 2)
+
+        self.assertEqual([PUSHED, FAILED], [job.status for job in jobs])
+        self.assertEqual(4000, jobs[0].transferred)
+        self.assertEqual(500, jobs[1].transferred)
+        self.assertIn("status 401", str(jobs[1].error).lower())
+        docker_client.tag.assert_any_call("web", "tutum.co/user/web", tag=None, force=True)
+        docker_client.tag.assert_any_call("web", "web", force=True)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(["Pushing web to tutum.co/user/web ...", "Pushing web to web ..."], lines[:2])
+        self.assertIn("tutum.co/user/web: pushed 3.9 KB in", stdout.getvalue())
+
+    def test_transient_errors(self):
+        self.assertTrue(is_transient_error("Received unexpected HTTP status: 503 Service Unavailable"))
+        self.assertTrue(is_transient_error("Put https://registry/v1/images/l1/layer: net/http: TLS handshake timeout"))
+        self.assertTrue(is_transient_error(socket.error(104, "Connection reset by peer")))
+        self.assertFalse(is_transient_error("Error: Status 401 trying to push repository"))
+        self.assertFalse(is_transient_error("No such id: web"))
+
+    @mock.patch('tutumcli.push.time.sleep')
+    def test_push_job_retries_transient_errors(self, mock_sleep):
+        docker_client = mock.MagicMock()
+        docker_client.push.side_effect = [
+            iter(push_events([("l1", 1000)], "Received unexpected HTTP status: 502 Bad Gateway")),
+            iter(push_events([("l2", 3000)], "Error: i/o timeout")),
+            iter(push_events([("l3", 500)]))]
+        job = PushJob("web", TUTUM, docker_client, PushMonitor(StringIO.StringIO()), "tutum.co", "user")
+        job.run()
+
+        self.assertEqual(PUSHED, job.status)
+        self.assertEqual(3, len(job.attempts))
+        self.assertEqual([1000, 3000, 500], [attempt['sent'] for attempt in job.attempts])
+        self.assertEqual(4500, job.transferred)
+        self.assertEqual([mock.call(RETRY_BACKOFF), mock.call(RETRY_BACKOFF * 2)], mock_sleep.call_args_list)
+        report = job.report_attempts()
+        self.assertIn("tutum.co/user/web attempt 1: failed in", report[0])
+        self.assertIn("502 Bad Gateway", report[0])
+        self.assertIn("attempt 3: pushed in", report[2])
+        self.assertIn("1 layers already pushed", report[2])
+
+    @mock.patch('tutumcli.push.time.sleep')
+    def test_push_job_gives_up(self, mock_sleep):
+        docker_client = mock.MagicMock()
+        docker_client.push.side_effect = lambda *args, **kwargs: iter(push_events([], "status 500 from registry"))
+        job = PushJob("web", TUTUM, docker_client, PushMonitor(StringIO.StringIO()), "tutum.co", "user", retries=2)
+        job.run()
+        self.assertEqual(FAILED, job.status)
+        self.assertEqual(3, len(job.attempts))
+
+        docker_client.push.side_effect = lambda *args, **kwargs: iter(push_events([], "Status 401"))
+        job.run()
+        self.assertEqual(FAILED, job.status)
+        self.assertEqual(1, len(job.attempts))
+
+    @mock.patch('tutumcli.push.time.time')
+    @mock.patch('tutumcli.push.os.isatty')
+    def test_push_monitor_redraws_at_frame_rate(self, mock_isatty, mock_time):
+        mock_isatty.return_value = True
+        mock_time.return_value = 100.0
+        stream = mock.MagicMock()
+        output = StringIO.StringIO()
+        stream.write.side_effect = output.write
+        monitor = PushMonitor(stream, frame_rate=10)
+        job = PushJob("web", TUTUM, mock.MagicMock(), monitor, "tutum.co", "user")
+        monitor.start([job])
+        job.started = 99.0
+        job.layers = {"l1": [512 * 1024, 1024 * 1024]}
+        monitor.refresh()
+        monitor.refresh()
+        mock_time.return_value = 100.2
+        monitor.refresh()
+        self.assertEqual(2, output.getvalue().count("\x1b[1A"))
+        self.assertIn("tutum.co/user/web: 512.0 KB / 1.0 MB (50%), 0.5 MB/s", output.getvalue())
@@ -0,0 +1,59 @@
+import unittest
+import StringIO
+import json
+import os
+import tempfile
+
+import mock
+from tutumcli.recording import *
+
+
+class SessionRecorderTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_session_recorder_writes_asciicast(self):
+        recorder = SessionRecorder(self.path, 120, 40, ["bash"], flush_interval=0.01)
+        recorder.write("$ ls\r\n")
+        recorder.write("caf\xc3")
+        recorder.write("\xa9\r\n")
+        recorder.write(u"\u2713")
+        recorder.write("")
+        recorder.close()
+
+        with open(self.path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(2, lines[0]['version'])
+        self.assertEqual((120, 40, "bash"), (lines[0]['width'], lines[0]['height'], lines[0]['command']))
+        self.assertEqual([u"$ ls\r\n", u"caf", u"\xe9\r\n", u"\u2713"], [line[2] for line in lines[1:]])
+        self.assertEqual(["o"] * 4, [line[1] for line in lines[1:]])
+        elapsed = [line[0] for line in lines[1:]]
+        self.assertEqual(sorted(elapsed), elapsed)
+
+    @mock.patch('tutumcli.recording.time.sleep')
+    def test_replay_session(self, mock_sleep):
+        with open(self.path, 'w') as f:
+            f.write(json.dumps({"version": 2, "width": 80, "height": 24}) + "\n")
+            f.write(json.dumps([0.5, "o", "$ "]) + "\n")
+            f.write(json.dumps([0.6, "i", "l"]) + "\n")
+            f.write(json.dumps([30.5, "o", u"caf\xe9\r\n"]) + "\n")
+            f.write('[31.0, "o", "trunc')
+
+        stream = StringIO.StringIO()
+        with mock.patch('tutumcli.recording.time.time', return_value=100.0):
+            replay_session(self.path, stream, speed=2, idle_limit=2)
+        self.assertEqual("$ caf\xc3\xa9\r\n", stream.getvalue())
+        self.assertEqual([mock.call(0.25), mock.call(1.25)], mock_sleep.call_args_list)
+
+        mock_sleep.reset_mock()
+        replay_session(self.path, StringIO.StringIO(), speed=0)
+        self.assertFalse(mock_sleep.called)
+
+    def test_read_session_rejects_other_formats(self):
+        with open(self.path, 'w') as f:
+            f.write(json.dumps({"version": 1}) + "\n")
+        self.assertRaises(ValueError, list, read_session(self.path))
@@ -0,0 +1,205 @@
+import unittest
+import StringIO
+import os
+import socket
+import time
+
+import mock
+from tutum import TutumAuthError, TutumApiError
+from websocket import ABNF
+from tutumcli.parallel import PrefixedOutput, run_jobs
+from tutumcli.shell import *
+
+
+class ReadInputTestCase(unittest.TestCase):
+    def setUp(self):
+        self.read_fd, self.write_fd = os.pipe()
+
+    def tearDown(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+    def test_is_incomplete_escape(self):
+        self.assertTrue(is_incomplete_escape('ls\x1b'))
+        self.assertTrue(is_incomplete_escape('\x1b['))
+        self.assertTrue(is_incomplete_escape('\x1b[1;5'))
+        self.assertFalse(is_incomplete_escape('\x1b[A'))
+        self.assertFalse(is_incomplete_escape('\x1b[1;5C'))
+        self.assertTrue(is_incomplete_escape('\x1bO'))
+        self.assertFalse(is_incomplete_escape('\x1bOP'))
+        self.assertFalse(is_incomplete_escape('abc'))
+
+    def test_read_input_coalesces_paste(self):
+        script = "echo hello\n" * 1000
+        os.write(self.write_fd, script)
+        self.assertEqual(script, read_input(self.read_fd))
+
+    def test_read_input_limits_batch_size(self):
+        os.write(self.write_fd, "a" * (INPUT_BATCH + 10))
+        self.assertEqual(INPUT_BATCH, len(read_input(self.read_fd)))
+        self.assertEqual("a" * 10, read_input(self.read_fd))
+
+    @mock.patch('tutumcli.shell.select.select')
+    def test_read_input_completes_escape_sequence(self, mock_select):
+        os.write(self.write_fd, "\x1b[")
+
+        timeouts = []
+
+        def select(r, w, x, timeout):
+            timeouts.append(timeout)
+            if len(timeouts) == 1:
+                os.write(self.write_fd, "A")
+                return [self.read_fd], [], []
+            return [], [], []
+
+        mock_select.side_effect = select
+        self.assertEqual("\x1b[A", read_input(self.read_fd))
+        self.assertEqual([ESCAPE_WINDOW, INPUT_WINDOW], timeouts)
+
+
+class OutputBufferTestCase(unittest.TestCase):
+    def test_output_buffer_writes_once_per_flush(self):
+        stdout = mock.MagicMock()
+        stderr = StringIO.StringIO()
+        output = OutputBuffer(stdout, stderr)
+        output.write(stdout, "a")
+        output.write(stdout, u"\xe9")
+        output.write(stderr, "err")
+        self.assertFalse(stdout.write.called)
+        output.flush()
+        stdout.write.assert_called_once_with("a\xc3\xa9")
+        self.assertEqual("err", stderr.getvalue())
+        output.flush()
+        self.assertEqual(1, stdout.write.call_count)
+
+
+def frame(opcode, data=""):
+    return ABNF(1, 0, 0, 0, opcode, 0, data)
+
+
+class MessageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sock_r, self.sock_w = os.pipe()
+        os.write(self.sock_w, "x")
+
+    def tearDown(self):
+        for fd in [self.sock_r, self.sock_w]:
+            os.close(fd)
+
+    def test_parse_message(self):
+        self.assertEqual(("stderr", "oops"), parse_message('{"streamType": "stderr", "output": "oops"}'))
+        self.assertEqual(("stdout", "not json"), parse_message("not json"))
+        self.assertRaises(TutumAuthError, parse_message, '{"type": "error", "data": {"errorMessage": "UNAUTHORIZED"}}')
+        self.assertRaises(TutumApiError, parse_message, '{"type": "error", "data": {"errorMessage": "Not found"}}')
+
+    def test_recv_message_passes_pongs_to_keepalive(self):
+        ws = mock.MagicMock()
+        ws.sock = self.sock_r
+        ws.io_sock = None
+        ws.recv_frame.side_effect = [frame(ABNF.OPCODE_PING, "hi"), frame(ABNF.OPCODE_PONG, "%.6f" % time.time()),
+                                     frame(ABNF.OPCODE_TEXT, "out")]
+        keepalive = Keepalive(ws)
+        self.assertEqual((ABNF.OPCODE_TEXT, "out"), recv_message(ws, keepalive))
+        ws.pong.assert_called_once_with("hi")
+        self.assertEqual(1, len(keepalive.rtts))
+
+
+class KeepaliveTestCase(unittest.TestCase):
+    @mock.patch('tutumcli.shell.time.time')
+    def test_keepalive_pings_when_due(self, mock_time):
+        mock_time.return_value = 100.0
+        ws = mock.MagicMock()
+        keepalive = Keepalive(ws, interval=30)
+        mock_time.return_value = 120.0
+        self.assertEqual(5, keepalive.timeout())
+        keepalive.check()
+        self.assertFalse(ws.ping.called)
+        mock_time.return_value = 130.0
+        keepalive.check()
+        ws.ping.assert_called_once_with("130.000000")
+
+    @mock.patch('tutumcli.shell.time.time')
+    def test_keepalive_measures_round_trip(self, mock_time):
+        mock_time.return_value = 100.25
+        keepalive = Keepalive(mock.MagicMock())
+        keepalive.on_frame(frame(ABNF.OPCODE_PONG, "100.000000"))
+        keepalive.on_frame(frame(ABNF.OPCODE_PONG, "garbage"))
+        self.assertEqual([0.25], keepalive.rtts)
+        self.assertEqual("round-trip latency: last 250ms, avg 250ms, max 250ms (1 pings)", keepalive.report())
+
+    @mock.patch('tutumcli.shell.time.time')
+    def test_keepalive_read_timeout(self, mock_time):
+        mock_time.return_value = 100.0
+        keepalive = Keepalive(mock.MagicMock(), interval=0, read_timeout=10)
+        mock_time.return_value = 108.0
+        self.assertEqual(2, keepalive.timeout())
+        keepalive.check()
+        mock_time.return_value = 111.0
+        self.assertRaises(ExecTimeoutError, keepalive.check)
+
+    @mock.patch('tutumcli.shell.time.sleep')
+    @mock.patch('tutumcli.shell.websocket.create_connection')
+    def test_connect_retries(self, mock_create_connection, mock_sleep):
+        ws = mock.MagicMock()
+        mock_create_connection.side_effect = [socket.error("refused"), socket.error("refused"), ws]
+        self.assertEqual(ws, connect("wss://stream/exec", 10, 60, retries=2))
+        ws.settimeout.assert_called_once_with(60)
+        self.assertEqual([mock.call(1), mock.call(2)], mock_sleep.call_args_list)
+
+        mock_create_connection.side_effect = socket.error("refused")
+        self.assertRaises(socket.error, connect, "wss://stream/exec", 10, retries=1)
+
+
+class FanOutExecTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sock_r, self.sock_w = os.pipe()
+        os.write(self.sock_w, "x")
+
+    def tearDown(self):
+        os.close(self.sock_r)
+        os.close(self.sock_w)
+
+    def test_wrap_command(self):
+        self.assertEqual(["sh", "-c", "echo 'a b'; echo %s$?" % EXIT_MARKER], wrap_command(["echo", "a b"]))
+
+    def test_exit_marker_after_output_without_trailing_newline(self):
+        stdout = StringIO.StringIO()
+        output = PrefixedOutput(['web-1'], stdout, StringIO.StringIO())
+        target = FanOutTarget('web-1', 'uuid-1', ['printf', 'hi'], output)
+        target._feed(stdout, "hi")
+        target._feed(stdout, "%s3\n" % EXIT_MARKER)
+        target._feed(stdout, "", final=True)
+
+        self.assertEqual(3, target.status)
+        self.assertEqual("web-1 | hi\n", stdout.getvalue())
+
+    @mock.patch('tutumcli.shell.websocket.create_connection')
+    def test_fan_out_exec(self, mock_create_connection):
+        messages = {
+            'uuid-1': ['{"streamType": "stdout", "output": "up 3 d"}',
+                       '{"streamType": "stdout", "output": "ays\\n%s0\\n"}' % EXIT_MARKER],
+            'uuid-2': ['{"streamType": "stderr", "output": "uptime: not found\\n"}',
+                       '{"streamType": "stdout", "output": "%s127\\n"}' % EXIT_MARKER],
+            'uuid-3': [],
+        }
+
+        def create_connection(url, timeout):
+            ws = mock.MagicMock()
+            ws.sock = self.sock_r
+            ws.io_sock = None
+            uuid = url.split('/')[-3]
+            ws.recv_frame.side_effect = [frame(ABNF.OPCODE_TEXT, m) for m in messages[uuid]] + \
+                                        [frame(ABNF.OPCODE_CLOSE)]
+            return ws
+
+        mock_create_connection.side_effect = create_connection
+        stdout = StringIO.StringIO()
+        stderr = StringIO.StringIO()
+        output = PrefixedOutput(['web-1', 'web-2', 'web-3'], stdout, stderr)
+        targets = run_jobs([FanOutTarget('web-%d' % i, 'uuid-%d' % i, ['uptime'], output) for i in range(1, 4)], 2)
+
+        self.assertEqual([0, 127, None], [target.status for target in targets])
+        self.assertIsNotNone(targets[2].error)
+        self.assertEqual("web-1 | up 3 days\n", stdout.getvalue())
+        self.assertEqual("web-2 | uptime: not found\n", stderr.getvalue())
+        self.assertEqual(3, mock_create_connection.call_count)
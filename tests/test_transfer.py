@@ -0,0 +1,180 @@
+import unittest
+import StringIO
+import base64
+import json
+import os
+import shutil
+import socket
+import tarfile
+import tempfile
+
+import mock
+from websocket import ABNF
+from tutumcli.transfer import *
+from tutumcli.exceptions import *
+
+
+class TransferTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse_location(self):
+        self.assertEqual(('web-1', '/tmp'), parse_location('web-1:/tmp'))
+        self.assertEqual((None, self.tmpdir), parse_location(self.tmpdir))
+        self.assertEqual((None, 'dump.sql'), parse_location('dump.sql'))
+        self.assertRaises(BadParameter, parse_location, 'web-1:')
+
+    def test_base64_writer_accepts_any_split(self):
+        data = os.urandom(1000)
+        encoded = base64.encodestring(data)
+        output = StringIO.StringIO()
+        writer = Base64Writer(output)
+        for i in range(0, len(encoded), 7):
+            writer.write(unicode(encoded[i:i + 7]))
+        writer.close()
+        self.assertEqual(data, output.getvalue())
+
+    def test_base64_writer_refuses_corrupted_data(self):
+        writer = Base64Writer(StringIO.StringIO())
+        self.assertRaises(TransferError, writer.write, u"aGVsbG8\ufffd")
+        self.assertRaises(TransferError, writer.write, "not base64!")
+
+    @mock.patch('tutumcli.transfer.websocket.create_connection')
+    def test_upload(self, mock_create_connection):
+        path = os.path.join(self.tmpdir, 'config')
+        with open(path, 'w') as f:
+            f.write(os.urandom(CHUNK * 2))
+        mock_create_connection.return_value.recv_data.return_value = (ABNF.OPCODE_CLOSE, None)
+
+        upload('uuid', path, '/etc/app')
+
+        url = mock_create_connection.call_args[0][0]
+        self.assertIn('container/uuid/exec/', url)
+        self.assertIn('base64+-d+%7C+tar+xzf+-+-C+%2Fetc%2Fapp', url)
+        sent = [c[0][0] for c in mock_create_connection.return_value.send.call_args_list]
+        archive = tarfile.open(fileobj=StringIO.StringIO(base64.b64decode("".join(sent))), mode='r:gz')
+        self.assertEqual(['config'], archive.getnames())
+        self.assertIn('head+-c+%d' % len("".join(sent)), url)
+
+    @mock.patch('tutumcli.transfer.websocket.create_connection')
+    def test_download(self, mock_create_connection):
+        archive = StringIO.StringIO()
+        tar = tarfile.open(fileobj=archive, mode='w:gz')
+        info = tarfile.TarInfo('app.log')
+        info.size = 5
+        tar.addfile(info, StringIO.StringIO('hello'))
+        tar.close()
+        encoded = base64.encodestring(archive.getvalue())
+        messages = [(ABNF.OPCODE_TEXT, json.dumps({'streamType': 'stdout', 'output': encoded[i:i + 10]}))
+                    for i in range(0, len(encoded), 10)]
+        mock_create_connection.return_value.recv_data.side_effect = messages + [(ABNF.OPCODE_CLOSE, None)]
+
+        download('uuid', '/var/log/app.log', os.path.join(self.tmpdir, 'logs'))
+
+        self.assertIn('tar+czf+-+-C+%2Fvar%2Flog+app.log', mock_create_connection.call_args[0][0])
+        with open(os.path.join(self.tmpdir, 'logs', 'app.log')) as f:
+            self.assertEqual('hello', f.read())
+
+    @mock.patch('tutumcli.transfer.websocket.create_connection')
+    def test_download_refuses_links_outside(self, mock_create_connection):
+        archive = StringIO.StringIO()
+        tar = tarfile.open(fileobj=archive, mode='w:gz')
+        info = tarfile.TarInfo('x')
+        info.type = tarfile.SYMTYPE
+        info.linkname = self.tmpdir
+        tar.addfile(info)
+        info = tarfile.TarInfo('x/passwd')
+        info.size = 5
+        tar.addfile(info, StringIO.StringIO('owned'))
+        tar.close()
+        encoded = base64.encodestring(archive.getvalue())
+        mock_create_connection.return_value.recv_data.side_effect = [
+            (ABNF.OPCODE_TEXT, json.dumps({'streamType': 'stdout', 'output': encoded})), (ABNF.OPCODE_CLOSE, None)]
+        local_dir = os.path.join(self.tmpdir, 'logs')
+
+        self.assertRaises(TransferError, download, 'uuid', '/var/log', local_dir)
+        self.assertEqual([], os.listdir(local_dir))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'passwd')))
+
+    def test_check_member(self):
+        def member(name, type=tarfile.REGTYPE, linkname=''):
+            info = tarfile.TarInfo(name)
+            info.type = type
+            info.linkname = linkname
+            return info
+
+        check_member(member('app/current', tarfile.SYMTYPE, 'releases/1'), self.tmpdir)
+        check_member(member('app/log', tarfile.SYMTYPE, '../log'), self.tmpdir)
+        check_member(member('app/copy', tarfile.LNKTYPE, 'app/config'), self.tmpdir)
+        self.assertRaises(TransferError, check_member, member('/etc/passwd'), self.tmpdir)
+        self.assertRaises(TransferError, check_member, member('../passwd'), self.tmpdir)
+        self.assertRaises(TransferError, check_member, member('app/etc', tarfile.SYMTYPE, '/etc'), self.tmpdir)
+        self.assertRaises(TransferError, check_member, member('app/up', tarfile.SYMTYPE, '../../up'), self.tmpdir)
+        self.assertRaises(TransferError, check_member, member('app/shadow', tarfile.LNKTYPE, '/etc/shadow'),
+                          self.tmpdir)
+
+    @mock.patch('tutumcli.transfer.websocket.create_connection')
+    def test_download_reports_remote_errors(self, mock_create_connection):
+        mock_create_connection.return_value.recv_data.side_effect = [
+            (ABNF.OPCODE_TEXT, json.dumps({'streamType': 'stderr', 'output': 'tar: app.log: No such file'})),
+            (ABNF.OPCODE_CLOSE, None)]
+        self.assertRaises(TransferError, download, 'uuid', '/var/log/app.log', self.tmpdir)
+
+
+def frame(opcode, data=""):
+    return ABNF(1, 0, 0, 0, opcode, 0, data)
+
+
+def message(stream_type, output):
+    return frame(ABNF.OPCODE_TEXT, json.dumps({'streamType': stream_type, 'output': output}))
+
+
+class PipeExecTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sock, self.peer = socket.socketpair()
+        self.peer.send("x")
+        self.ws = mock.MagicMock()
+        self.ws.sock = self.sock
+        self.ws.io_sock = None
+
+    def tearDown(self):
+        self.sock.close()
+        self.peer.close()
+
+    def test_wrap_pipe_command(self):
+        self.assertEqual(["sh", "-c", "head -c 8 | base64 -d | tar xf - -C /tmp | base64"],
+                         wrap_pipe_command(["tar", "xf", "-", "-C", "/tmp"], 5))
+        self.assertEqual(["sh", "-c", "cat 'a b' < /dev/null | base64"], wrap_pipe_command(["cat", "a b"]))
+        self.assertEqual(["sh", "-c", "head -c 0 | base64 -d | sh | base64"], wrap_pipe_command([], 0))
+
+    def test_pipe_exec_is_binary_safe(self):
+        data = os.urandom(1000)
+        output = os.urandom(1000)
+        encoded = base64.encodestring(output)
+        messages = [message('stdout', encoded[i:i + 100]) for i in range(0, len(encoded), 100)]
+        self.ws.recv_frame.side_effect = messages + [message('stderr', u'caf\xe9'), frame(ABNF.OPCODE_CLOSE)]
+        staged, size = stage_input(StringIO.StringIO(data))
+        stdout = StringIO.StringIO()
+        stderr = StringIO.StringIO()
+        pipe_exec(self.ws, staged, stdout, stderr)
+
+        sent = "".join([c[0][0] for c in self.ws.send.call_args_list])
+        self.assertEqual(get_encoded_size(size), len(sent))
+        self.assertEqual(data, base64.b64decode(sent))
+        self.assertEqual(output, stdout.getvalue())
+        self.assertEqual('caf\xc3\xa9', stderr.getvalue())
+
+    def test_pipe_exec_refuses_corrupted_output(self):
+        self.ws.recv_frame.side_effect = [message('stdout', u'\ufffd\ufffd'), frame(ABNF.OPCODE_CLOSE)]
+        self.assertRaises(TransferError, pipe_exec, self.ws, None, StringIO.StringIO(), StringIO.StringIO())
+        self.assertFalse(self.ws.send.called)
+
+    def test_pipe_exec_refuses_truncated_output(self):
+        self.ws.recv_frame.side_effect = [message('stdout', 'aGVsbG'), frame(ABNF.OPCODE_CLOSE)]
+        self.assertRaises(TransferError, pipe_exec, self.ws, None, StringIO.StringIO(), StringIO.StringIO())
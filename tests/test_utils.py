@@ -1,8 +1,16 @@
 # -*- coding: utf-8 -*-
 import unittest
+import StringIO
 import __builtin__
+import json
+import os
+import shutil
+import tempfile
+import threading
 
+import docker
 import mock
+import requests
 from tutum.api.exceptions import *
 import tutumcli
 from tutumcli.utils import *
@@ -46,6 +54,20 @@ class DateTimeConversionTestCase(unittest.TestCase):
         self.assertNotRegexpMatches(utc_datetime, r".* ago")
 
 
+class ParseTimeTestCase(unittest.TestCase):
+    @mock.patch('tutumcli.utils.time.time')
+    def test_parse_time(self, mock_time):
+        mock_time.return_value = 10000
+        self.assertIsNone(parse_time(None))
+        self.assertEqual(9400, parse_time('10m'))
+        self.assertEqual(2800, parse_time('2h'))
+        self.assertEqual(1431000000, parse_time('1431000000'))
+        self.assertEqual(1430474400, parse_time('2015-05-01T10:00:00+00:00'))
+
+    def test_parse_time_bad_format(self):
+        self.assertRaises(BadParameter, parse_time, 'yesterday')
+
+
 class IsUuidTestCase(unittest.TestCase):
     def test_is_uuid4(self):
         self.assertTrue(is_uuid4('7a4cfe51-038b-42d6-825e-3b533888d8cd'))
@@ -77,6 +99,219 @@ class GetDockerClientTestCase(unittest.TestCase):
         mock_getenv.return_value = '/run/mock.docker.sock'
         self.assertRaises(DockerNotFound, get_docker_client)
 
+    @mock.patch('tutumcli.utils.DockerClient')
+    def test_get_docker_client_caches_client_and_version(self, mock_client):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            with mock.patch.dict(os.environ, {'TUTUM_CACHE_DIR': cache_dir, 'DOCKER_HOST': 'tcp://10.0.0.1:2375'}):
+                with mock.patch.dict(tutumcli.utils._docker_clients, clear=True):
+                    mock_client.return_value._version = '1.18'
+                    client = get_docker_client()
+                    self.assertIs(client, get_docker_client())
+                    mock_client.assert_called_once_with('tcp://10.0.0.1:2375', base_url='tcp://10.0.0.1:2375',
+                                                        tls=False, version='auto')
+                    self.assertEqual({'tcp://10.0.0.1:2375': '1.18'}, load_docker_api_versions())
+
+                with mock.patch.dict(tutumcli.utils._docker_clients, clear=True):
+                    get_docker_client()
+                    mock_client.assert_called_with('tcp://10.0.0.1:2375', base_url='tcp://10.0.0.1:2375',
+                                                   tls=False, version='1.18')
+        finally:
+            shutil.rmtree(cache_dir)
+
+    @mock.patch('tutumcli.utils.save_docker_api_version')
+    @mock.patch('tutumcli.utils.DockerClient._retrieve_server_version')
+    @mock.patch('requests.Session.request')
+    def test_docker_client_renegotiates_version(self, mock_request, mock_retrieve, mock_save):
+        mock_retrieve.return_value = '1.17'
+        client = DockerClient('tcp://10.0.0.1:2375', base_url='http://10.0.0.1:2375', version='1.18')
+        mismatch = mock.MagicMock(status_code=400, text="client is newer than server (client API version: 1.18, "
+                                                        "server API version: 1.17)")
+        mock_request.side_effect = [mismatch, mock.MagicMock(status_code=200, json=lambda: [{'Id': 'abc'}])]
+        self.assertEqual([{'Id': 'abc'}], client.images())
+        self.assertEqual('1.17', client._version)
+        mock_save.assert_called_once_with('tcp://10.0.0.1:2375', '1.17')
+        self.assertEqual(['http://10.0.0.1:2375/v1.18/images/json', 'http://10.0.0.1:2375/v1.17/images/json'],
+                         [c[0][1] for c in mock_request.call_args_list])
+
+        not_found = mock.MagicMock(status_code=404, text="No such image")
+        not_found.raise_for_status.side_effect = requests.exceptions.HTTPError()
+        mock_request.side_effect = [not_found]
+        self.assertRaises(docker.errors.APIError, client.inspect_image, 'web')
+        self.assertEqual(1, mock_retrieve.call_count)
+
+    @mock.patch('requests.Session.request', side_effect=requests.exceptions.ConnectionError())
+    def test_docker_client_not_running(self, mock_request):
+        client = DockerClient('tcp://10.0.0.1:2375', base_url='http://10.0.0.1:2375', version='1.18')
+        self.assertRaises(DockerNotFound, client.images)
+
+
+class DecodeStreamTestCase(unittest.TestCase):
+    def test_decode_stream_splits_and_joins_chunks(self):
+        data = '{"status": "a"}\r\n{"status": "b}"}{"id": "c", "progressDetail": {}}\n  {"status": "\u00e9"}\r\n'
+        expected = [{"status": "a"}, {"status": "b}"}, {"id": "c", "progressDetail": {}}, {"status": u"\xe9"}]
+        for size in [1, 2, 7, len(data)]:
+            chunks = [data[i:i + size] for i in range(0, len(data), size)]
+            self.assertEqual(expected, list(decode_stream(iter(chunks))))
+
+    def test_decode_stream_consumes_decoded_data(self):
+        decoder = JSONStreamDecoder()
+        self.assertEqual([{"a": 1}], decoder.feed('{"a": 1}{"b": '))
+        self.assertEqual('{"b": ', decoder.buffer)
+        self.assertEqual([], decoder.feed('[1, 2'))
+        self.assertEqual([{"b": [1, 2]}], decoder.feed(']}\n'))
+        self.assertEqual("", decoder.buffer)
+
+    def test_decode_stream_truncated(self):
+        self.assertRaises(StreamOutputError, list, decode_stream(iter(['{"status": "a"}', '{"status": '])))
+        self.assertRaises(StreamOutputError, list, decode_stream(iter(['not json'])))
+
+
+class StreamOutputTestCase(unittest.TestCase):
+    events = [json.dumps(e) for e in [
+        {"status": "The push refers to a repository [tutum.co/user/app]"},
+        {"status": "Pushing", "id": "abc", "progressDetail": {"current": 10, "total": 100}, "progress": "[=>   ]"},
+        {"status": "Pushing", "id": "def", "progressDetail": {"current": 5, "total": 100}, "progress": "[>    ]"},
+        {"status": "Pushing", "id": "abc", "progressDetail": {"current": 50, "total": 100}, "progress": "[==>  ]"},
+        {"status": "Pushing", "id": "abc", "progressDetail": {"current": 90, "total": 100}, "progress": "[====>]"},
+        {"status": "Pushed", "id": "abc"},
+        {"status": "Pushed", "id": "def"},
+    ]]
+
+    def test_stream_output_without_terminal(self):
+        stream = StringIO.StringIO()
+        self.assertEqual([], stream_output(iter(self.events), stream))
+        self.assertEqual("The push refers to a repository [tutum.co/user/app]\nabc: Pushed\ndef: Pushed\n",
+                         stream.getvalue())
+
+    def test_stream_output_keeps_limited_history(self):
+        history = stream_output(iter(self.events), StringIO.StringIO(), history=2)
+        self.assertEqual([{"status": "Pushed", "id": "abc"}, {"status": "Pushed", "id": "def"}], history)
+
+    def test_stream_output_raises_errors(self):
+        events = [json.dumps({"errorDetail": {"message": "denied"}, "error": "denied"})]
+        self.assertRaises(StreamOutputError, stream_output, iter(events), StringIO.StringIO())
+
+    @mock.patch('tutumcli.utils.time.time')
+    @mock.patch('tutumcli.utils.os.isatty')
+    def test_stream_output_coalesces_progress(self, mock_isatty, mock_time):
+        mock_isatty.return_value = True
+        mock_time.return_value = 100.0
+        stream = mock.MagicMock()
+        stream.fileno.return_value = 1
+        output = StringIO.StringIO()
+        stream.write.side_effect = output.write
+        stream_output(iter(self.events), stream, frame_rate=10)
+        drawn = output.getvalue()
+        # the first progress event is drawn, later ones within the same frame only when a status arrives
+        self.assertIn("abc: Pushing [=>   ]", drawn)
+        self.assertNotIn("[==>  ]", drawn)
+        self.assertIn("abc: Pushing [====>]", drawn)
+        self.assertIn("def: Pushing [>    ]", drawn)
+        self.assertEqual(1, drawn.count("abc: Pushed"))
+        self.assertIn("\x1b[2A\x1b[2K\rabc: Pushed\r\x1b[2B", drawn)
+
+
+class ImagePullTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.environ = mock.patch.dict(os.environ, {'TUTUM_CACHE_DIR': self.cache_dir})
+        self.environ.start()
+        self.docker_client = mock.MagicMock()
+        self.docker_client.inspect_image.return_value = {'RepoDigests': ['tutum/builder@sha256:aaa']}
+
+    def tearDown(self):
+        self.environ.stop()
+        shutil.rmtree(self.cache_dir)
+
+    def test_split_image_name(self):
+        self.assertEqual(("tutum/builder", "latest"), split_image_name("tutum/builder"))
+        self.assertEqual(("tutum/builder", "v2"), split_image_name("tutum/builder:v2"))
+        self.assertEqual(("localhost:5000/app", "latest"), split_image_name("localhost:5000/app"))
+
+    @mock.patch('tutumcli.utils.get_registry_image_digest')
+    def test_image_pull_policies(self, mock_digest):
+        self.assertTrue(is_image_pull_needed(self.docker_client, "tutum/builder:latest", 'always'))
+        self.assertFalse(is_image_pull_needed(self.docker_client, "tutum/builder:latest", 'never'))
+        self.assertFalse(is_image_pull_needed(self.docker_client, "tutum/builder:latest", 'missing'))
+        response = mock.MagicMock(status_code=404)
+        self.docker_client.inspect_image.side_effect = docker.errors.APIError("not found", response)
+        self.assertTrue(is_image_pull_needed(self.docker_client, "tutum/builder:latest", 'missing'))
+        self.assertTrue(is_image_pull_needed(self.docker_client, "tutum/builder:latest"))
+        self.assertFalse(mock_digest.called)
+
+    @mock.patch('tutumcli.utils.time.time')
+    @mock.patch('tutumcli.utils.get_registry_image_digest')
+    def test_image_pull_compares_digests_once_per_interval(self, mock_digest, mock_time):
+        mock_time.return_value = 1000.0
+        mock_digest.return_value = "sha256:aaa"
+        self.assertFalse(is_image_pull_needed(self.docker_client, "tutum/builder:latest", interval=3600))
+        mock_time.return_value = 2000.0
+        self.assertFalse(is_image_pull_needed(self.docker_client, "tutum/builder:latest", interval=3600))
+        self.assertEqual(1, mock_digest.call_count)
+
+        mock_time.return_value = 5000.0
+        mock_digest.return_value = "sha256:bbb"
+        self.assertTrue(is_image_pull_needed(self.docker_client, "tutum/builder:latest", interval=3600))
+        mock_digest.side_effect = requests.exceptions.ConnectionError()
+        self.assertTrue(is_image_pull_needed(self.docker_client, "tutum/builder:latest", interval=3600))
+
+        record_image_pull("tutum/builder:latest")
+        self.assertFalse(is_image_pull_needed(self.docker_client, "tutum/builder:latest", interval=3600))
+
+
+class CacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.environ = mock.patch.dict(os.environ, {'TUTUM_CACHE_DIR': self.cache_dir})
+        self.environ.start()
+
+    def tearDown(self):
+        self.environ.stop()
+        shutil.rmtree(self.cache_dir)
+
+    def test_save_cache_from_several_threads(self):
+        threads = [threading.Thread(target=save_cache, args=("builds.json", {"writer": i, "data": "x" * 100000}))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertIn(load_cache("builds.json")["writer"], range(8))
+        self.assertEqual(["builds.json"], os.listdir(self.cache_dir))
+
+
+class SearchImagesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.environ = mock.patch.dict(os.environ, {'TUTUM_CACHE_DIR': self.cache_dir})
+        self.environ.start()
+
+    def tearDown(self):
+        self.environ.stop()
+        shutil.rmtree(self.cache_dir)
+
+    @mock.patch('tutumcli.utils.SEARCH_CACHE_SIZE', 2)
+    @mock.patch('tutumcli.utils.time.time')
+    @mock.patch('tutumcli.utils.get_docker_client')
+    def test_search_images_expires_and_prunes(self, mock_get_docker_client, mock_time):
+        search = mock_get_docker_client.return_value.search
+        search.side_effect = lambda text: [{"name": text}]
+        mock_time.return_value = 1000.0
+        self.assertEqual([{"name": "redis"}], search_images("redis", 60))
+        mock_time.return_value = 1059.0
+        self.assertEqual([{"name": "redis"}], search_images("redis", 60))
+        self.assertEqual(1, search.call_count)
+        mock_time.return_value = 1061.0
+        search_images("redis", 60)
+        self.assertEqual(2, search.call_count)
+
+        mock_time.return_value = 1100.0
+        search_images("nginx", 60)
+        mock_time.return_value = 1101.0
+        search_images("mysql", 60)
+        self.assertEqual(["mysql", "nginx"], sorted(load_cache(SEARCH_CACHE)))
+
 
 class ParseLinksTestCase(unittest.TestCase):
     def test_parse_links(self):
@@ -0,0 +1,142 @@
+import fnmatch
+import hashlib
+import os
+import stat
+import time
+
+import docker
+
+from tutumcli import utils
+
+
+BUILD_CACHE = 'build_contexts.json'
+# contexts remembered, the oldest ones are forgotten first
+BUILD_CACHE_SIZE = 500
+HASH_BLOCK = 1024 * 1024
+
+
+def read_dockerignore(directory):
+    try:
+        with open(os.path.join(directory, ".dockerignore")) as f:
+            lines = [line.strip() for line in f]
+    except IOError:
+        return []
+    patterns = []
+    for line in lines:
+        if not line or line.startswith("#"):
+            continue
+        negate = line.startswith("!")
+        pattern = os.path.normpath(line.lstrip("!").strip()).lstrip("/")
+        patterns.append((pattern, negate))
+    return patterns
+
+
+def is_ignored(path, patterns):
+    # like docker, a pattern matching a directory excludes everything below it, and the last matching
+    # pattern wins so that !pattern can include files back
+    ignored = False
+    parts = path.split(os.sep)
+    prefixes = [os.sep.join(parts[:i]) for i in range(1, len(parts) + 1)]
+    for pattern, negate in patterns:
+        if any(fnmatch.fnmatch(prefix, pattern) for prefix in prefixes):
+            ignored = not negate
+    return ignored
+
+
+def hash_file(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(HASH_BLOCK)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ContextHasher(object):
+    # Content hash of a build context. The hash of every file is kept in an index along with its
+    # size and modification time, and a file is only read again when one of them changed.
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.index_name = "build_index_%s.json" % hashlib.sha1(self.directory).hexdigest()[:16]
+        self.index = utils.load_cache(self.index_name)
+        self.files_read = 0
+
+    def _file_hash(self, relpath, st):
+        entry = self.index.get(relpath)
+        if entry and entry[0] == st.st_mtime and entry[1] == st.st_size:
+            return entry[2]
+        digest = hash_file(os.path.join(self.directory, relpath))
+        self.files_read += 1
+        self.index[relpath] = [st.st_mtime, st.st_size, digest]
+        return digest
+
+    def _walk(self, patterns):
+        # excluded directories are only skipped as a whole when no pattern can include files back
+        can_prune = not any(negate for pattern, negate in patterns)
+        for root, dirs, files in os.walk(self.directory):
+            relroot = os.path.relpath(root, self.directory)
+            relroot = "" if relroot == "." else relroot
+            if can_prune:
+                dirs[:] = [d for d in dirs if not is_ignored(os.path.join(relroot, d), patterns)]
+            dirs.sort()
+            for name in sorted(files + [d for d in dirs if os.path.islink(os.path.join(root, d))]):
+                relpath = os.path.join(relroot, name)
+                # docker always sends the Dockerfile and the .dockerignore
+                if relpath not in ("Dockerfile", ".dockerignore") and is_ignored(relpath, patterns):
+                    continue
+                yield relpath
+
+    def compute(self):
+        patterns = read_dockerignore(self.directory)
+        digest = hashlib.sha256()
+        seen = set()
+        for relpath in self._walk(patterns):
+            path = os.path.join(self.directory, relpath)
+            st = os.lstat(path)
+            if stat.S_ISLNK(st.st_mode):
+                content = "link:" + os.readlink(path)
+            elif stat.S_ISREG(st.st_mode):
+                content = self._file_hash(relpath, st)
+            else:
+                continue
+            seen.add(relpath)
+            digest.update("%s\0%o\0%s\n" % (relpath, st.st_mode & 0o111, content))
+        self.index = dict([(relpath, entry) for relpath, entry in self.index.items() if relpath in seen])
+        utils.save_cache(self.index_name, self.index)
+        return digest.hexdigest()
+
+
+def find_build(context_hash):
+    return utils.load_cache(BUILD_CACHE).get(context_hash)
+
+
+def save_build(context_hash, tag, image_id):
+    save_builds([(context_hash, tag, image_id)])
+
+
+def save_builds(entries):
+    # not thread safe, parallel builds are saved together once they are over
+    builds = utils.load_cache(BUILD_CACHE)
+    for context_hash, tag, image_id in entries:
+        builds[context_hash] = {'tag': tag, 'image': image_id, 'time': time.time()}
+    if len(builds) > BUILD_CACHE_SIZE:
+        for key in sorted(builds, key=lambda key: builds[key]['time'])[:len(builds) - BUILD_CACHE_SIZE]:
+            del builds[key]
+    utils.save_cache(BUILD_CACHE, builds)
+
+
+def retag_build(docker_client, context_hash, tag):
+    # tags the image of a previous build of the same context, returns None when there is none left
+    build = find_build(context_hash)
+    if not build:
+        return None
+    try:
+        docker_client.inspect_image(build['image'])
+    except docker.errors.APIError:
+        return None
+    repository, image_tag = utils.split_image_name(tag)
+    docker_client.tag(build['image'], repository, tag=image_tag, force=True)
+    return build
@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+
+import yaml
+
+from exceptions import BadParameter, BuildError
+from tutumcli import buildcache
+from tutumcli import utils
+
+
+BUILDER_IMAGE = "tutum/builder:latest"
+DOCKER_SOCK = "/var/run/docker.sock"
+BUILT = "built"
+RETAGGED = "retagged"
+FAILED = "failed"
+
+
+def load_build_file(path):
+    # either a list of builds or a mapping with a `builds` list, directories are relative to the file
+    with open(path) as f:
+        data = yaml.safe_load(f)
+    if isinstance(data, dict):
+        data = data.get('builds')
+    if not isinstance(data, list) or not data:
+        raise BadParameter("%s must contain a list of builds, each with a directory and a tag" % path)
+    base = os.path.dirname(os.path.abspath(path))
+    builds = []
+    for entry in data:
+        if not isinstance(entry, dict) or not entry.get('directory') or not entry.get('tag'):
+            raise BadParameter("Invalid build in %s, a directory and a tag are required: %s" % (path, entry))
+        builds.append((os.path.join(base, str(entry['directory'])), str(entry['tag'])))
+    return builds
+
+
+class BuilderImage(object):
+    # Pulls the builder image according to the pull policy, the first time a build actually runs it:
+    # builds whose context did not change are retagged without asking the registry.
+
+    def __init__(self, docker_client, policy, interval, stream):
+        self.docker_client = docker_client
+        self.policy = policy
+        self.interval = interval
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.ready = False
+
+    def prepare(self):
+        with self.lock:
+            if self.ready:
+                return
+            if utils.is_image_pull_needed(self.docker_client, BUILDER_IMAGE, self.policy, self.interval):
+                output = self.docker_client.pull(BUILDER_IMAGE, stream=True)
+                utils.stream_output(output, self.stream)
+                utils.record_image_pull(BUILDER_IMAGE)
+            self.ready = True
+
+
+def run_builder(docker_client, directory, tag, docker_sock, force, write, save=buildcache.save_build,
+                prepare=None):
+    binds = {
+        os.path.abspath(directory): {'bind': "/app", 'ro': False},
+        docker_sock or DOCKER_SOCK: {'bind': "/var/run/docker.sock", 'ro': False}
+    }
+
+    context_hash = None
+    if tag:
+        context_hash = buildcache.ContextHasher(directory).compute()
+        build = None if force else buildcache.retag_build(docker_client, context_hash, tag)
+        if build:
+            write("The context did not change since %s was built, tagged %s as %s\n" % (build['tag'],
+                                                                                       build['image'][:12], tag))
+            return RETAGGED
+    if prepare:
+        prepare()
+    container = docker_client.create_container(image=BUILDER_IMAGE, environment={"IMAGE_NAME": tag})
+    docker_client.start(container=container.get("Id"), privileged=True, binds=binds)
+    output = docker_client.attach(container.get("Id"), stream=True)
+    for chunk in output:
+        write(chunk)
+    status = docker_client.wait(container.get("Id"))
+    if status != 0:
+        raise BuildError("The builder exited with status %d" % status)
+    if context_hash:
+        save(context_hash, tag, docker_client.inspect_image(tag)['Id'])
+    return BUILT
+
+
+class BuildJob(object):
+    # One build of a parallel run, its output is written line by line with the tag as prefix. The
+    # build is kept in `cache_entry` for the caller to save once every build is over.
+
+    def __init__(self, directory, tag, docker_client, docker_sock, force, output, prepare=None):
+        self.directory = directory
+        self.tag = tag
+        self.docker_client = docker_client
+        self.docker_sock = docker_sock
+        self.force = force
+        self.output = output
+        self.prepare = prepare
+        self.partial = ""
+        self.status = None
+        self.error = None
+        self.duration = 0
+        self.cache_entry = None
+
+    def _feed(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        lines = (self.partial + data).split("\n")
+        self.partial = lines.pop()
+        self.output.write_lines(self.tag, self.output.stdout, lines)
+
+    def _save(self, context_hash, tag, image_id):
+        self.cache_entry = (context_hash, tag, image_id)
+
+    def run(self):
+        started = time.time()
+        try:
+            self.status = run_builder(self.docker_client, self.directory, self.tag, self.docker_sock, self.force,
+                                      self._feed, self._save, self.prepare)
+        except Exception as e:
+            self.status = FAILED
+            self.error = e
+        if self.partial:
+            self.output.write_lines(self.tag, self.output.stdout, [self.partial])
+            self.partial = ""
+        if self.error:
+            self.output.write_lines(self.tag, self.output.stderr, [str(self.error)])
+        self.duration = time.time() - started
@@ -4,33 +4,41 @@ import json
 import sys
 import os
 import logging
-from os.path import join, expanduser, abspath
+from os.path import join, expanduser
 import ConfigParser
 import select
 import termios
 import tty
 import signal
 import errno
-import urllib
+import time
+import Queue
 
 import websocket
 import tutum
-import docker
 import yaml
 from tutum.api import auth
 from tutum.api import exceptions
-from tutum import TutumAuthError, TutumApiError, ObjectNotFound, NonUniqueIdentifier
+from tutum import TutumAuthError, ObjectNotFound, NonUniqueIdentifier
 
-from exceptions import StreamOutputError
+from exceptions import BadParameter
+from tutumcli import builder
+from tutumcli import buildcache
 from tutumcli import utils
+from tutumcli import events
+from tutumcli import logs
+from tutumcli import parallel as parallel_io
+from tutumcli import portforward
+from tutumcli import push
+from tutumcli import recording
+from tutumcli import shell as shell_io
+from tutumcli import transfer
 
 
 TUTUM_FILE = '.tutum'
 AUTH_SECTION = 'auth'
 USER_OPTION = "user"
 APIKEY_OPTION = 'apikey'
-AUTH_ERROR = 'auth_error'
-NO_ERROR = 'no_error'
 
 TUTUM_AUTH_ERROR_EXIT_CODE = 2
 EXCEPTION_EXIT_CODE = 3
@@ -95,7 +103,7 @@ def verify_auth(args):
             print(e, file=sys.stderr)
             sys.exit(EXCEPTION_EXIT_CODE)
 
-    if args.cmd != 'login':
+    if args.cmd not in ['login', 'replay'] and not getattr(args, 'replay', None):
         try:
             tutum.api.http.send_request("GET", "/auth")
         except tutum.TutumAuthError:
@@ -112,44 +120,151 @@ def verify_auth(args):
                     print("Not Authorized, Please login:", file=sys.stderr)
 
 
-def build(tag, working_directory, docker_sock):
-    build_image = "tutum/builder:latest"
-    if not docker_sock:
-        docker_sock = "/var/run/docker.sock"
+def build(tag, working_directory, docker_sock, pull, pull_interval, force, build_file, parallel):
     try:
+        if bool(working_directory) == bool(build_file):
+            raise BadParameter("Either a working directory or a build file (-f) is required")
+        if build_file and tag:
+            raise BadParameter("-t cannot be used with -f, every build in the file has its own tag")
+        parallel_io.check_parallel(parallel)
+        builds = builder.load_build_file(build_file) if build_file else [(working_directory, tag)]
         docker_client = utils.get_docker_client()
-        binds = {
-            abspath(working_directory):
-                {
-                    'bind': "/app",
-                    'ro': False
-                }
-        }
-        binds[docker_sock] = \
-            {
-                'bind': "/var/run/docker.sock",
-                'ro': False
-            }
-
-        output = docker_client.pull(build_image, stream=True)
-        utils.stream_output(output, sys.stdout)
-        container = docker_client.create_container(image=build_image, environment={"IMAGE_NAME": tag})
-        docker_client.start(container=container.get("Id"), privileged=True, binds=binds)
-        output = docker_client.attach(container.get("Id"), stream=True)
-        for chunck in output:
-            print(chunck, end="")
+        builder_image = builder.BuilderImage(docker_client, pull, pull_interval, sys.stdout)
+        if not build_file:
+            builder.run_builder(docker_client, working_directory, tag, docker_sock, force, sys.stdout.write,
+                                prepare=builder_image.prepare)
+            return
+        output = parallel_io.PrefixedOutput([build_tag for directory, build_tag in builds], sys.stdout, sys.stderr)
+        started = time.time()
+        jobs = parallel_io.run_jobs([builder.BuildJob(directory, build_tag, docker_client, docker_sock, force, output,
+                                                      builder_image.prepare)
+                                    for directory, build_tag in builds], parallel)
+        buildcache.save_builds([job.cache_entry for job in jobs if job.cache_entry])
+    except KeyboardInterrupt:
+        sys.exit(EXCEPTION_EXIT_CODE)
     except Exception as e:
         print(e, file=sys.stderr)
         sys.exit(EXCEPTION_EXIT_CODE)
 
+    print("")
+    utils.tabulate_result([[job.tag, job.directory, job.status, "%.1fs" % job.duration] for job in jobs],
+                          ["TAG", "DIRECTORY", "STATUS", "DURATION"])
+    print("%d builds in %.1fs" % (len(jobs), time.time() - started))
+    if any(job.status == builder.FAILED for job in jobs):
+        sys.exit(EXCEPTION_EXIT_CODE)
+
+
+def event(buffer_size, overflow, heartbeat, record, replay, speed, stats, stats_interval, stats_format):
+    def report_gap(disconnected_at, reconnected_at):
+        print("Event stream reconnected, events between %s and %s may be missing" %
+              (time.strftime("%H:%M:%S", time.localtime(disconnected_at)),
+               time.strftime("%H:%M:%S", time.localtime(reconnected_at))), file=sys.stderr)
+
+    def report_stats(timestamp=None):
+        snapshot = aggregator.snapshot(timestamp)
+        if stats_format == 'json':
+            print(json.dumps(snapshot))
+            sys.stdout.flush()
+            return
+
+        windows = [name for name, span in events.STATS_WINDOWS]
+        data_list = []
+        for field in events.STATS_FIELDS:
+            values = snapshot['counts'].get(field, {})
+            for value in sorted(values, key=lambda v: -values[v][windows[-1]]):
+                data_list.append([field.upper(), value] + [values[value][name] for name in windows])
+        if len(data_list) == 0:
+            data_list.append(["", "", "", "", ""])
+        if is_terminal:
+            # clear the screen and redraw from the top
+            sys.stdout.write("%c[2J%c[H" % (27, 27))
+        else:
+            print()
+        utils.tabulate_result(data_list, ["FIELD", "VALUE"] + [name.upper() for name in windows])
+        if snapshot['latencies']:
+            print()
+            utils.tabulate_result([[kind, l['count'], "%.1fs" % l['mean'], "%.1fs" % l['p95'], "%.1fs" % l['max']]
+                                   for kind, l in sorted(snapshot['latencies'].items())],
+                                  ["LATENCY (%s)" % windows[-1].upper(), "COUNT", "MEAN", "P95", "MAX"])
+        sys.stdout.flush()
+
+    def handle(e, timestamp=None):
+        if aggregator:
+            aggregator.add(e, timestamp)
+        else:
+            print(e)
 
-def event():
+    stream = None
+    recorder = None
+    aggregator = events.EventStats() if stats else None
+    is_terminal = hasattr(sys.stdout, 'fileno') and os.isatty(sys.stdout.fileno())
+    next_report = time.time() + stats_interval
+    try:
+        if replay:
+            # statistics of a replay follow the recorded timeline rather than the wall clock
+            timestamp = None
+            for timestamp, e in events.replay_event_log(replay, speed):
+                handle(e, timestamp)
+                if aggregator and time.time() >= next_report:
+                    report_stats(timestamp)
+                    next_report = time.time() + stats_interval
+            if aggregator:
+                report_stats(timestamp)
+            return
+
+        if record:
+            recorder = events.EventRecorder(record)
+        stream = events.EventStream(buffer_size=buffer_size, overflow=overflow, heartbeat=heartbeat)
+        stream.on_gap(report_gap)
+        stream.start()
+        while True:
+            try:
+                e = stream.get(timeout=1)
+                if recorder:
+                    recorder.write(e)
+                handle(e)
+            except Queue.Empty:
+                if recorder:
+                    recorder.flush()
+            if aggregator and time.time() >= next_report:
+                report_stats()
+                next_report = time.time() + stats_interval
+    except KeyboardInterrupt:
+        pass
+    except TutumAuthError:
+        print("Not Authorized", file=sys.stderr)
+        sys.exit(TUTUM_AUTH_ERROR_EXIT_CODE)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        sys.exit(EXCEPTION_EXIT_CODE)
+    finally:
+        if recorder:
+            recorder.close()
+        if stream:
+            stream.stop()
+            if stream.dropped:
+                print("%d events were dropped because the output could not keep up" % stream.dropped,
+                      file=sys.stderr)
+
+
+def watch(reconcile_interval):
+    stream = None
     try:
-        events = tutum.TutumEvents()
-        events.on_message(lambda e: print(e))
-        events.run_forever()
+        mirror = events.StateMirror(utils.get_cache_path(events.MIRROR_FILE), reconcile_interval)
+        stream = events.EventStream()
+        print("Mirroring Tutum state into %s" % mirror.path, file=sys.stderr)
+        mirror.run(stream)
     except KeyboardInterrupt:
         pass
+    except TutumAuthError:
+        print("Not Authorized", file=sys.stderr)
+        sys.exit(TUTUM_AUTH_ERROR_EXIT_CODE)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        sys.exit(EXCEPTION_EXIT_CODE)
+    finally:
+        if stream:
+            stream.stop()
 
 
 def service_inspect(identifiers):
@@ -165,40 +280,71 @@ def service_inspect(identifiers):
         sys.exit(EXCEPTION_EXIT_CODE)
 
 
-def service_logs(identifiers, tail, follow):
+def _get_service_log_targets(service, merge):
+    if not merge:
+        return [(service.name, 'service', service.uuid)]
+    return [(container.name, 'container', container.uuid)
+            for container in tutum.Container.list(service=service.resource_uri) if container.state != "Terminated"]
+
+
+def _stream_logs(identifiers, get_targets, tail, follow, merge, grep, exclude, since, until, output, rotate_size,
+                 rotate_interval):
+    try:
+        log_filter = logs.LogFilter(grep, exclude, utils.parse_time(since), utils.parse_time(until))
+    except Exception as e:
+        print(e, file=sys.stderr)
+        sys.exit(EXCEPTION_EXIT_CODE)
     has_exception = False
+    targets = []
     for identifier in identifiers:
         try:
-            service = tutum.Utils.fetch_remote_service(identifier)
-            service.logs(tail, follow)
-        except KeyboardInterrupt:
-            pass
+            targets.extend(get_targets(identifier))
         except Exception as e:
             print(e, file=sys.stderr)
             has_exception = True
+    try:
+        for source in logs.stream_logs(targets, sys.stdout, tail, follow, merge, log_filter, output, rotate_size,
+                                       rotate_interval):
+            print("%s: %s" % (source.name, source.error), file=sys.stderr)
+            has_exception = True
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(e, file=sys.stderr)
+        has_exception = True
     if has_exception:
         sys.exit(EXCEPTION_EXIT_CODE)
 
 
-def service_ps(quiet, status, stack):
+def service_logs(identifiers, tail, follow, merge, grep, exclude, since, until, output, rotate_size,
+                 rotate_interval):
+    def get_targets(identifier):
+        return _get_service_log_targets(tutum.Utils.fetch_remote_service(identifier), merge)
+
+    _stream_logs(identifiers, get_targets, tail, follow, merge, grep, exclude, since, until, output, rotate_size,
+                 rotate_interval)
+
+
+def service_ps(quiet, status, stack, from_cache):
     try:
         headers = ["NAME", "UUID", "STATUS", "#CONTAINERS", "IMAGE", "DEPLOYED", "PUBLIC DNS", "STACK"]
 
+        state = events.get_state(from_cache)
         stack_resource_uri = None
         if stack:
-            s = tutum.Utils.fetch_remote_stack(stack, raise_exceptions=False)
+            s = state.find('stack', stack)
             if isinstance(s, NonUniqueIdentifier):
                 raise NonUniqueIdentifier("Identifier %s matches more than one stack, please use UUID instead" % stack)
             if isinstance(s, ObjectNotFound):
                 raise ObjectNotFound("Identifier '%s' does not match any stack" % stack)
             stack_resource_uri = s.resource_uri
-        service_list = tutum.Service.list(state=status, stack=stack_resource_uri)
+        service_list = state.list('service', state=status, stack=stack_resource_uri)
 
         data_list = []
         long_uuid_list = []
         has_unsynchronized_service = False
         stacks = {}
-        for stack in tutum.Stack.list():
+        for stack in state.list('stack'):
             stacks[stack.resource_uri] = stack.name
         for service in service_list:
             service_state = utils.add_unicode_symbol_to_state(service.state)
@@ -503,55 +649,169 @@ def service_terminate(identifiers, sync):
         sys.exit(EXCEPTION_EXIT_CODE)
 
 
-def container_exec(identifier, command):
+def cp(source, destination):
+    try:
+        source_container, source_path = transfer.parse_location(source)
+        destination_container, destination_path = transfer.parse_location(destination)
+        if bool(source_container) == bool(destination_container):
+            raise BadParameter("Either the source or the destination must be a container path (container:path)")
+        if source_container:
+            container = tutum.Utils.fetch_remote_container(source_container)
+            transfer.download(container.uuid, source_path, destination_path)
+        else:
+            container = tutum.Utils.fetch_remote_container(destination_container)
+            transfer.upload(container.uuid, source_path, destination_path)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        sys.exit(EXCEPTION_EXIT_CODE)
+
+
+def port_forward(identifier, ports, address):
+    forwarder = None
+    try:
+        ports = [portforward.parse_ports(port) for port in ports]
+        container = tutum.Utils.fetch_remote_container(identifier)
+        forwarder = portforward.PortForwarder(container.uuid, ports, address)
+        for (host, local_port), remote_port in forwarder.addresses():
+            print("Forwarding from %s:%d to %s:%d" % (host, local_port, container.name, remote_port))
+        forwarder.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(e, file=sys.stderr)
+        sys.exit(EXCEPTION_EXIT_CODE)
+    finally:
+        if forwarder:
+            forwarder.close()
+
+
+def container_exec_fanout(command, service, stack, parallel, ping_interval, connect_timeout, read_timeout, retries,
+                          latency, record):
+    try:
+        if record:
+            raise BadParameter("--record is only supported for interactive sessions in a single container")
+        parallel_io.check_parallel(parallel)
+        services = [tutum.Utils.fetch_remote_service(service)] if service else []
+        if stack:
+            services = tutum.Service.list(stack=tutum.Utils.fetch_remote_stack(stack).resource_uri)
+        containers = []
+        for s in services:
+            containers.extend(tutum.Container.list(service=s.resource_uri, state="Running"))
+        if not containers:
+            raise ObjectNotFound("There are no running containers in %s" % (service or stack))
+        output = parallel_io.PrefixedOutput([container.name for container in containers], sys.stdout, sys.stderr)
+        targets = parallel_io.run_jobs([shell_io.FanOutTarget(container.name, container.uuid, command, output,
+                                                             ping_interval, connect_timeout, read_timeout, retries)
+                                       for container in containers], parallel)
+    except KeyboardInterrupt:
+        sys.exit(EXCEPTION_EXIT_CODE)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        sys.exit(EXCEPTION_EXIT_CODE)
+
+    if latency:
+        for target in targets:
+            if target.keepalive:
+                print("%s: %s" % (target.name, target.keepalive.report()), file=sys.stderr)
+    errors = [target for target in targets if target.error]
+    failed = [target for target in targets if not target.error and target.status]
+    for target in errors:
+        print("%s: %s" % (target.name, target.error), file=sys.stderr)
+    if errors or failed:
+        print("%d of %d containers failed: %s" % (len(errors) + len(failed), len(targets),
+                                                  ", ".join([target.name for target in errors + failed])),
+              file=sys.stderr)
+    if errors:
+        sys.exit(EXCEPTION_EXIT_CODE)
+    if failed:
+        sys.exit(max([target.status for target in failed]))
+
+
+def container_exec(identifier, command, no_tty, ping_interval, connect_timeout, read_timeout, retries, latency,
+                   record):
+    def invoke_command(container_uuid):
+        errorcode = 0
+        keepalive = None
+        staged = None
+        try:
+            staged, size = (None, None) if sys.stdin.isatty() else transfer.stage_input(sys.stdin)
+            url = shell_io.get_exec_url(container_uuid, transfer.wrap_pipe_command(command, size))
+            shell = shell_io.connect(url, connect_timeout, read_timeout, retries)
+            keepalive = shell_io.Keepalive(shell, ping_interval, read_timeout)
+            transfer.pipe_exec(shell, staged, sys.stdout, sys.stderr, keepalive)
+        except TutumAuthError:
+            sys.stderr.write("Not Authorized\n")
+            errorcode = TUTUM_AUTH_ERROR_EXIT_CODE
+        except websocket.WebSocketConnectionClosedException:
+            pass
+        except websocket.WebSocketException:
+            sys.stderr.write("Connection is already closed.\n")
+            errorcode = EXCEPTION_EXIT_CODE
+        except Exception as e:
+            sys.stderr.write("%s\n" % e)
+            errorcode = EXCEPTION_EXIT_CODE
+        finally:
+            if staged:
+                staged.close()
+            if latency and keepalive:
+                sys.stderr.write("%s\n" % keepalive.report())
+            sys.stdout.flush()
+            sys.stderr.flush()
+            exit(errorcode)
+
     def invoke_shell(url):
-        shell = websocket.create_connection(url, timeout=10)
+        shell = shell_io.connect(url, connect_timeout, read_timeout)
+        keepalive = shell_io.Keepalive(shell, ping_interval, read_timeout)
 
         oldtty = termios.tcgetattr(sys.stdin)
         old_handler = signal.getsignal(signal.SIGWINCH)
         errorcode = 0
+        output = shell_io.OutputBuffer(sys.stdout, sys.stderr)
+        recorder = None
+
+        def write_output(stream, data):
+            output.write(stream, data)
+            if recorder:
+                recorder.write(data)
 
         try:
+            if record:
+                width, height = recording.get_terminal_size(sys.stdout.fileno())
+                recorder = recording.SessionRecorder(record, width, height, command)
             tty.setraw(sys.stdin.fileno())
             tty.setcbreak(sys.stdin.fileno())
 
             while True:
                 try:
-                    r, w, e = select.select([shell.sock, sys.stdin], [], [shell.sock], 5)
+                    keepalive.check()
+                    r, w, e = select.select([shell.sock, sys.stdin], [], [shell.sock], keepalive.timeout())
                     if sys.stdin in r:
-                        x = sys.stdin.read(1)
-                        # read arrows
-                        if x == '\x1b':
-                            x += sys.stdin.read(1)
-                            if x[1] == '[':
-                                x += sys.stdin.read(1)
+                        x = shell_io.read_input(sys.stdin.fileno())
                         if len(x) == 0:
                             shell.send('\n')
                         shell.send(x)
 
                     if shell.sock in r:
-                        data = shell.recv()
-                        if not data:
-                            continue
                         try:
-                            message = json.loads(data)
-                            if message.get("type") == "error":
-                                if message.get("data", {}).get("errorMessage") == "UNAUTHORIZED":
-                                    raise TutumAuthError
-                                else:
-                                    raise TutumApiError(message)
-                            streamType = message.get("streamType")
-                            if streamType == "stdout":
-                                sys.stdout.write(message.get("output"))
-                                sys.stdout.flush()
-                            elif streamType == "stderr":
-                                sys.stderr.write(message.get("output"))
-                                sys.stderr.flush()
-                        except TutumAuthError:
-                            raise
-                        except:
-                            sys.stdout.write(data)
-                            sys.stdout.flush()
+                            for i in range(shell_io.OUTPUT_BATCH):
+                                opcode, data = shell_io.recv_message(shell, keepalive)
+                                if opcode == websocket.ABNF.OPCODE_CLOSE:
+                                    return
+                                if data:
+                                    try:
+                                        streamType, message_output = shell_io.parse_message(data)
+                                        if streamType == "stdout":
+                                            write_output(sys.stdout, message_output)
+                                        elif streamType == "stderr":
+                                            write_output(sys.stderr, message_output)
+                                    except TutumAuthError:
+                                        raise
+                                    except:
+                                        write_output(sys.stdout, data)
+                                if not shell_io.has_pending_data(shell):
+                                    break
+                        finally:
+                            output.flush()
                 except (select.error, IOError) as e:
                     if e.args and e.args[0] == errno.EINTR:
                         pass
@@ -572,37 +832,39 @@ def container_exec(identifier, command):
             sys.stderr.flush()
             errorcode = EXCEPTION_EXIT_CODE
         finally:
+            if latency:
+                sys.stderr.write("%s\r\n" % keepalive.report())
+                sys.stderr.flush()
+            if recorder:
+                recorder.close()
             termios.tcsetattr(sys.stdin, termios.TCSADRAIN, oldtty)
             signal.signal(signal.SIGWINCH, old_handler)
             exit(errorcode)
 
+    interactive = not no_tty and sys.stdin.isatty() and sys.stdout.isatty()
     try:
+        if record and not interactive:
+            raise BadParameter("--record is only supported for interactive sessions, not with --no-tty or when "
+                               "stdin or stdout is not a terminal")
         container = tutum.Utils.fetch_remote_container(identifier)
     except Exception as e:
         print(e, file=sys.stderr)
         sys.exit(EXCEPTION_EXIT_CODE)
 
-    if tutum.tutum_auth:
-        endpoint = "container/%s/exec/?auth=%s" % (container.uuid, urllib.quote_plus(tutum.tutum_auth))
+    if not interactive:
+        invoke_command(container.uuid)
     else:
-        endpoint = "container/%s/exec/?user=%s&token=%s" % (container.uuid, tutum.user, tutum.apikey)
-
-    if command:
-        escaped_cmd = []
-        for c in command:
-            if r'"' in c:
-                c = c.replace(r'"', r'\"')
-            if " " in c:
-                c = '"%s"' % c
-            escaped_cmd.append(c)
+        invoke_shell(shell_io.get_exec_url(container.uuid, command))
 
-        escaped_cmd = " ".join(escaped_cmd)
-        cli_log.debug("escaped command: %s" % escaped_cmd)
-        endpoint = "%s&command=%s" % (endpoint, urllib.quote_plus(escaped_cmd))
 
-    url = "/".join([tutum.stream_url.rstrip("/"), endpoint.lstrip('/')])
-    cli_log.debug("websocket url: %s" % url)
-    invoke_shell(url)
+def replay(path, speed, idle_limit):
+    try:
+        recording.replay_session(path, sys.stdout, speed, idle_limit)
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(e, file=sys.stderr)
+        sys.exit(EXCEPTION_EXIT_CODE)
 
 
 def container_inspect(identifiers):
@@ -618,19 +880,14 @@ def container_inspect(identifiers):
         sys.exit(EXCEPTION_EXIT_CODE)
 
 
-def container_logs(identifiers, tail, follow):
-    has_exception = False
-    for identifier in identifiers:
-        try:
-            container = tutum.Utils.fetch_remote_container(identifier)
-            container.logs(tail, follow)
-        except KeyboardInterrupt:
-            pass
-        except Exception as e:
-            print(e, file=sys.stderr)
-            has_exception = True
-    if has_exception:
-        sys.exit(EXCEPTION_EXIT_CODE)
+def container_logs(identifiers, tail, follow, grep, exclude, since, until, output, rotate_size,
+                   rotate_interval):
+    def get_targets(identifier):
+        container = tutum.Utils.fetch_remote_container(identifier)
+        return [(container.name, 'container', container.uuid)]
+
+    _stream_logs(identifiers, get_targets, tail, follow, False, grep, exclude, since, until, output, rotate_size,
+                 rotate_interval)
 
 
 def container_redeploy(identifiers, sync):
@@ -649,13 +906,14 @@ def container_redeploy(identifiers, sync):
         sys.exit(EXCEPTION_EXIT_CODE)
 
 
-def container_ps(quiet, status, service, no_trunc):
+def container_ps(quiet, status, service, no_trunc, from_cache):
     try:
         headers = ["NAME", "UUID", "STATUS", "IMAGE", "RUN COMMAND", "EXIT CODE", "DEPLOYED", "PORTS", "NODE", "STACK"]
 
+        state = events.get_state(from_cache)
         service_resrouce_uri = None
         if service:
-            s = tutum.Utils.fetch_remote_service(service, raise_exceptions=False)
+            s = state.find('service', service)
             if isinstance(s, NonUniqueIdentifier):
                 raise NonUniqueIdentifier(
                     "Identifier %s matches more than one service, please use UUID instead" % service)
@@ -663,18 +921,18 @@ def container_ps(quiet, status, service, no_trunc):
                 raise ObjectNotFound("Identifier '%s' does not match any service" % service)
             service_resrouce_uri = s.resource_uri
 
-        containers = tutum.Container.list(state=status, service=service_resrouce_uri)
+        containers = state.list('container', state=status, service=service_resrouce_uri)
 
         data_list = []
         long_uuid_list = []
         stacks = {}
-        for stack in tutum.Stack.list():
+        for stack in state.list('stack'):
             stacks[stack.resource_uri] = stack.name
         services = {}
-        for s in tutum.Service.list():
+        for s in state.list('service'):
             services[s.resource_uri] = s.stack
         nodes = {}
-        for n in tutum.Node.list():
+        for n in state.list('node'):
             nodes[n.resource_uri] = n.uuid
 
         for container in containers:
@@ -821,103 +1079,78 @@ def image_register(repository, description, username, password, sync):
         sys.exit(EXCEPTION_EXIT_CODE)
 
 
-def image_push(name, public):
-    def push_to_public(repository):
-        print('Pushing %s to public registry ...' % repository)
-
-        output_status = NO_ERROR
-        # tag a image to its name to check if the images exists
+def image_push(names, public, destinations, parallel, retries):
+    def login_to_public():
+        print('Please login prior to push:')
+        username = raw_input('Username: ')
+        password = getpass.getpass()
+        email = raw_input('Email: ')
         try:
-            docker_client.tag(name, name, force=True)
+            result = docker_client.login(username, password=password, email=email)
+            if isinstance(result, dict):
+                print(result.get('Status', None))
         except Exception as e:
             print(e, file=sys.stderr)
-            sys.exit(EXCEPTION_EXIT_CODE)
-        try:
-            tag = None
-            if ':' in repository:
-                tag = repository.split(':')[-1]
-                repository = repository.replace(':%s' % tag, '')
-            output = docker_client.push(repository, tag=tag, stream=True)
-            utils.stream_output(output, sys.stdout)
-        except StreamOutputError as e:
-            if 'status 401' in e.message.lower():
-                output_status = AUTH_ERROR
-            else:
-                print(e, file=sys.stderr)
-                sys.exit(EXCEPTION_EXIT_CODE)
-        except Exception as e:
-            print(e.message, file=sys.stderr)
-            sys.exit(EXCEPTION_EXIT_CODE)
-
-        if output_status == NO_ERROR:
-            print('')
-            sys.exit()
-
-        if output_status == AUTH_ERROR:
-            print('Please login prior to push:')
-            username = raw_input('Username: ')
-            password = getpass.getpass()
-            email = raw_input('Email: ')
-            try:
-                result = docker_client.login(username, password=password, email=email)
-                if isinstance(result, dict):
-                    print(result.get('Status', None))
-            except Exception as e:
-                print(e, file=sys.stderr)
-                sys.exit(TUTUM_AUTH_ERROR_EXIT_CODE)
-            push_to_public(repository)
-
-    def push_to_tutum(repository):
-        print('Pushing %s to Tutum private registry ...' % repository)
+            sys.exit(TUTUM_AUTH_ERROR_EXIT_CODE)
 
-        user = tutum.user
-        apikey = tutum.apikey
-        if user is None or apikey is None:
+    def login_to_tutum():
+        if tutum.user is None or tutum.apikey is None:
             print('Not authorized')
             sys.exit(TUTUM_AUTH_ERROR_EXIT_CODE)
-
         try:
-            registry = os.getenv('TUTUM_REGISTRY_URL') or 'tutum.co'
-            docker_client.login(user, apikey, registry=registry)
+            docker_client.login(tutum.user, tutum.apikey, registry=registry)
         except Exception as e:
             print(e, file=sys.stderr)
             sys.exit(TUTUM_AUTH_ERROR_EXIT_CODE)
 
-        if repository:
-            repository = filter(None, repository.split('/'))[-1]
-        tag = None
-        if ':' in repository:
-            tag = repository.split(':')[-1]
-            repository = repository.replace(':%s' % tag, '')
-        repository = '%s/%s/%s' % (registry.split('//')[-1].split('/')[0], user, repository)
-
-        if tag:
-            print('Tagging %s as %s:%s ...' % (name, repository, tag))
-        else:
-            print('Tagging %s as %s ...' % (name, repository))
-
-        try:
-            docker_client.tag(name, repository, tag=tag, force=True)
-        except Exception as e:
-            print(e, file=sys.stderr)
-            sys.exit(EXCEPTION_EXIT_CODE)
-
-        output = docker_client.push(repository, tag=tag, stream=True)
-        try:
-            utils.stream_output(output, sys.stdout)
-        except docker.errors.APIError as e:
-            print(e.explanation, file=sys.stderr)
-            sys.exit(EXCEPTION_EXIT_CODE)
-        except Exception as e:
-            print(e.message, file=sys.stderr)
+    if public and destinations:
+        print("--public cannot be used with --to, add public to the registries of --to instead", file=sys.stderr)
+        sys.exit(EXCEPTION_EXIT_CODE)
+    destinations = destinations.split(",") if destinations else [push.PUBLIC if public else push.TUTUM]
+    for destination in destinations:
+        if destination not in push.DESTINATIONS:
+            print("Unknown destination %s, choose from %s" % (destination, ", ".join(push.DESTINATIONS)),
+                  file=sys.stderr)
             sys.exit(EXCEPTION_EXIT_CODE)
-        print('')
-
-    docker_client = utils.get_docker_client()
-    if public:
-        push_to_public(name)
-    else:
-        push_to_tutum(name)
+    try:
+        parallel_io.check_parallel(parallel)
+        docker_client = utils.get_docker_client()
+    except Exception as e:
+        print(e, file=sys.stderr)
+        sys.exit(EXCEPTION_EXIT_CODE)
+    registry = os.getenv('TUTUM_REGISTRY_URL') or 'tutum.co'
+    if push.TUTUM in destinations:
+        login_to_tutum()
+
+    monitor = push.PushMonitor(sys.stdout)
+    jobs = [push.PushJob(name, destination, docker_client, monitor, registry, tutum.user, retries)
+            for name in names for destination in destinations]
+    started = time.time()
+    monitor.start(jobs)
+    parallel_io.run_jobs(jobs, parallel)
+
+    unauthorized = [job for job in jobs if job.destination == push.PUBLIC and job.status == push.FAILED and
+                    'status 401' in str(job.error).lower()]
+    if unauthorized:
+        login_to_public()
+        monitor.start(unauthorized)
+        parallel_io.run_jobs(unauthorized, parallel)
+
+    elapsed = time.time() - started
+    print("")
+    utils.tabulate_result([[job.name, job.target, job.status, len(job.attempts), transfer.human_size(job.transferred),
+                            "%.1fs" % job.elapsed, push.human_rate(job.transferred, job.elapsed)] for job in jobs],
+                          ["IMAGE", "DESTINATION", "STATUS", "ATTEMPTS", "SENT", "ELAPSED", "THROUGHPUT"])
+    retried = [job for job in jobs if len(job.attempts) > 1]
+    if retried:
+        print("")
+        for job in retried:
+            print("\n".join(job.report_attempts()))
+    transferred = sum([job.transferred for job in jobs])
+    print("%d pushes, %s sent in %.1fs (%s)" % (len(jobs), transfer.human_size(transferred), elapsed,
+                                                push.human_rate(transferred, elapsed)))
+    if any(job.status == push.FAILED for job in jobs):
+        sys.exit(EXCEPTION_EXIT_CODE)
 
 
 def image_rm(repositories, sync):
@@ -936,10 +1169,12 @@ def image_rm(repositories, sync):
         sys.exit(EXCEPTION_EXIT_CODE)
 
 
-def image_search(text):
+def image_search(text, limit, stars, official, output_format, cache_ttl):
     try:
-        docker_client = utils.get_docker_client()
-        results = docker_client.search(text)
+        results = utils.filter_search_results(utils.search_images(text, cache_ttl), limit, stars, official)
+        if output_format == 'json':
+            print(json.dumps(results, indent=2))
+            return
         headers = ["NAME", "DESCRIPTION", "STARS", "OFFICIAL", "TRUSTED"]
         data_list = []
         if len(results) != 0:
@@ -979,16 +1214,17 @@ def image_update(repositories, username, password, description, sync):
         sys.exit(EXCEPTION_EXIT_CODE)
 
 
-def node_list(quiet):
+def node_list(quiet, from_cache):
     try:
         headers = ["UUID", "FQDN", "LASTSEEN", "STATUS", "CLUSTER", "DOCKER_VER"]
-        node_list = tutum.Node.list()
+        state = events.get_state(from_cache)
+        node_list = state.list('node')
         data_list = []
         long_uuid_list = []
         for node in node_list:
             cluster_name = node.node_cluster
             try:
-                cluster_name = tutum.NodeCluster.fetch(node.node_cluster.strip("/").split("/")[-1]).name
+                cluster_name = state.get('nodecluster', node.node_cluster).name
             except:
                 pass
 
@@ -1571,6 +1807,20 @@ def stack_inspect(identifiers):
         sys.exit(EXCEPTION_EXIT_CODE)
 
 
+def stack_logs(identifiers, tail, follow, merge, grep, exclude, since, until, output, rotate_size,
+               rotate_interval):
+    def get_targets(identifier):
+        stack = tutum.Utils.fetch_remote_stack(identifier)
+        targets = []
+        for service in tutum.Service.list(stack=stack.resource_uri):
+            if service.state != "Terminated":
+                targets.extend(_get_service_log_targets(service, merge))
+        return targets
+
+    _stream_logs(identifiers, get_targets, tail, follow, merge, grep, exclude, since, until, output, rotate_size,
+                 rotate_interval)
+
+
 def stack_list(quiet):
     try:
         headers = ["NAME", "UUID", "STATUS", "DEPLOYED", "DESTROYED"]
@@ -0,0 +1,475 @@
+from __future__ import print_function
+import Queue
+import collections
+import gzip
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import zlib
+
+import tutum
+from tutum import TutumAuthError, TutumApiError, ObjectNotFound, NonUniqueIdentifier
+
+from exceptions import BadParameter
+from tutumcli import utils
+
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop-oldest'
+OVERFLOW_POLICIES = [BLOCK, DROP_OLDEST]
+
+MIN_BACKOFF = 1
+
+MIRROR_FILE = 'state.json'
+
+EVENT_LOG_INDEX_SUFFIX = '.idx'
+
+STATS_WINDOWS = [('1m', 60), ('5m', 300), ('15m', 900)]
+STATS_BUCKET = 10
+STATS_FIELDS = ['type', 'action', 'state', 'service']
+DEPLOY_STATES = {'Starting': 'deploy', 'Redeploying': 'redeploy'}
+SETTLED_STATES = ['Running', 'Partly running', 'Stopped', 'Start failed', 'Stopped with errors', 'Not running',
+                  'Terminated']
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+RESOURCE_CLASSES = {
+    'stack': tutum.Stack,
+    'service': tutum.Service,
+    'container': tutum.Container,
+    'node': tutum.Node,
+    'nodecluster': tutum.NodeCluster,
+}
+
+cli_log = logging.getLogger("cli")
+
+
+class EventStream(object):
+    # Reads tutum events into a bounded buffer from a background thread, reconnecting with
+    # exponential backoff. Gap handlers get the interval in which events may have been missed.
+
+    def __init__(self, buffer_size=1024, overflow=BLOCK, heartbeat=30, max_backoff=60):
+        if overflow not in OVERFLOW_POLICIES:
+            raise BadParameter("Overflow policy must be one of: %s" % ", ".join(OVERFLOW_POLICIES))
+        self.buffer = Queue.Queue(maxsize=buffer_size)
+        self.overflow = overflow
+        self.heartbeat = heartbeat
+        self.max_backoff = max_backoff
+        self.dropped = 0
+        self.gap_handlers = []
+        self._events = None
+        self._disconnected_at = None
+        self._receiver = None
+        self._stopped = threading.Event()
+
+    def on_gap(self, handler):
+        self.gap_handlers.append(handler)
+
+    def start(self):
+        self._receiver = threading.Thread(target=self._receive)
+        self._receiver.daemon = True
+        self._receiver.start()
+        if self.heartbeat:
+            heartbeat = threading.Thread(target=self._send_heartbeats)
+            heartbeat.daemon = True
+            heartbeat.start()
+
+    def stop(self):
+        self._stopped.set()
+        events = self._events
+        if events and events.ws.sock:
+            events.ws.keep_running = False
+            events.ws.sock.close()
+
+    def get(self, timeout=None):
+        item = self.buffer.get(timeout=timeout)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def __iter__(self):
+        while True:
+            try:
+                # a timeout keeps the consumer interruptible by KeyboardInterrupt
+                yield self.get(timeout=1)
+            except Queue.Empty:
+                if self._receiver is None or not self._receiver.is_alive():
+                    return
+
+    def put(self, event):
+        if self.overflow == BLOCK:
+            self.buffer.put(event)
+            return
+        while True:
+            try:
+                self.buffer.put_nowait(event)
+                return
+            except Queue.Full:
+                try:
+                    self.buffer.get_nowait()
+                    self.dropped += 1
+                except Queue.Empty:
+                    pass
+
+    def _on_open(self, events):
+        if self.heartbeat:
+            # a connection that does not even answer our pings is considered dead
+            events.ws.sock.settimeout(self.heartbeat * 3)
+        if self._disconnected_at is not None:
+            reconnected_at = time.time()
+            for handler in self.gap_handlers:
+                handler(self._disconnected_at, reconnected_at)
+            self._disconnected_at = None
+
+    def _receive(self):
+        backoff = MIN_BACKOFF
+        while not self._stopped.is_set():
+            events = tutum.TutumEvents()
+            opened = []
+            events.on_open(lambda: opened.append(True) or self._on_open(events))
+            events.on_message(self.put)
+            events.on_error(lambda e: cli_log.debug("event stream error: %s" % e))
+            self._events = events
+            events.ws.run_forever()
+
+            if events.auth_error:
+                self.put(TutumAuthError("Not authorized"))
+                return
+            if self._stopped.is_set():
+                return
+            if opened:
+                backoff = MIN_BACKOFF
+                self._disconnected_at = time.time()
+            cli_log.debug("event stream disconnected, reconnecting in %ds" % backoff)
+            self._stopped.wait(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def _send_heartbeats(self):
+        while not self._stopped.wait(self.heartbeat):
+            events = self._events
+            if events and events.ws.sock:
+                try:
+                    events.ws.sock.ping()
+                except Exception as e:
+                    cli_log.debug("event stream heartbeat failed: %s" % e)
+
+
+class EventRecorder(object):
+    # Appends events to a log made of independent gzip members of up to `block_size` json lines, so
+    # the file can be read with zcat. Each block is listed in a sidecar index once fully written.
+
+    def __init__(self, path, block_size=256, flush_interval=1):
+        self.path = path
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.records = []
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.log_file = open(path, 'ab')
+        self.index_file = open(path + EVENT_LOG_INDEX_SUFFIX, 'a')
+
+    def write(self, event, timestamp=None):
+        timestamp = timestamp or time.time()
+        if not self.records:
+            self.first_timestamp = timestamp
+        self.last_timestamp = timestamp
+        self.records.append(json.dumps({'t': round(timestamp, 3), 'e': event}, separators=(',', ':')))
+        if len(self.records) >= self.block_size or timestamp - self.first_timestamp >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if not self.records:
+            return
+        compressor = zlib.compressobj(9, zlib.DEFLATED, GZIP_WBITS)
+        block = compressor.compress("\n".join(self.records) + "\n") + compressor.flush()
+        self.log_file.seek(0, os.SEEK_END)
+        offset = self.log_file.tell()
+        self.log_file.write(block)
+        self.log_file.flush()
+        self.index_file.write("%d %d %d %.3f %.3f\n" % (offset, len(block), len(self.records),
+                                                        self.first_timestamp, self.last_timestamp))
+        self.index_file.flush()
+        self.records = []
+
+    def close(self):
+        self.flush()
+        self.log_file.close()
+        self.index_file.close()
+
+
+def read_event_log(path):
+    try:
+        with open(path + EVENT_LOG_INDEX_SUFFIX) as f:
+            blocks = [line.split() for line in f if line.strip()]
+    except IOError:
+        blocks = None
+
+    with open(path, 'rb') as f:
+        if blocks is None:
+            lines = gzip.GzipFile(fileobj=f)
+        else:
+            lines = _read_indexed_lines(f, blocks)
+        try:
+            for line in lines:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record['t'], record['e']
+        except (IOError, EOFError, zlib.error):
+            # a block truncated by an interrupted recording
+            return
+
+
+def _read_indexed_lines(f, blocks):
+    for block in blocks:
+        f.seek(int(block[0]))
+        for line in zlib.decompress(f.read(int(block[1])), GZIP_WBITS).splitlines():
+            yield line
+
+
+def replay_event_log(path, speed):
+    started = None
+    for timestamp, event in read_event_log(path):
+        if speed > 0:
+            if started is None:
+                started = (time.time(), timestamp)
+            delay = (timestamp - started[1]) / speed - (time.time() - started[0])
+            if delay > 0:
+                time.sleep(delay)
+        yield timestamp, event
+
+
+class EventStats(object):
+    # Rolling event counts over STATS_WINDOWS. Events are counted into STATS_BUCKET seconds buckets
+    # shared by every window, and each window keeps running totals that are decremented once per
+    # bucket as it expires, so adding an event costs the same regardless of the traffic.
+
+    def __init__(self):
+        self.totals = dict((name, collections.Counter()) for name, span in STATS_WINDOWS)
+        self.buckets = dict((name, collections.deque()) for name, span in STATS_WINDOWS)
+        self.current = None
+        self.deploying = {}
+        self.latencies = collections.defaultdict(collections.deque)
+
+    def add(self, event, timestamp=None):
+        now = timestamp or time.time()
+        self._expire(now)
+        bucket_start = now - now % STATS_BUCKET
+        if self.current is None or self.current[0] != bucket_start:
+            self.current = (bucket_start, collections.Counter())
+            for name, span in STATS_WINDOWS:
+                self.buckets[name].append(self.current)
+
+        for key in self._keys(event):
+            self.current[1][key] += 1
+            for name, span in STATS_WINDOWS:
+                self.totals[name][key] += 1
+        self._track_deployment(event, now)
+
+    def snapshot(self, timestamp=None):
+        now = timestamp or time.time()
+        self._expire(now)
+        counts = {}
+        for name, span in STATS_WINDOWS:
+            for (field, value), count in self.totals[name].items():
+                windows = counts.setdefault(field, {}).setdefault(value, dict((n, 0) for n, s in STATS_WINDOWS))
+                windows[name] = count
+
+        latencies = {}
+        for kind, finished in self.latencies.items():
+            if not finished:
+                continue
+            seconds = sorted(latency for finished_at, latency in finished)
+            latencies[kind] = {'count': len(seconds),
+                               'mean': round(sum(seconds) / len(seconds), 3),
+                               'p95': round(seconds[int(0.95 * (len(seconds) - 1))], 3),
+                               'max': round(seconds[-1], 3)}
+        return {'time': now, 'counts': counts, 'latencies': latencies}
+
+    def _expire(self, now):
+        for name, span in STATS_WINDOWS:
+            buckets = self.buckets[name]
+            totals = self.totals[name]
+            while buckets and buckets[0][0] <= now - span:
+                for key, count in buckets.popleft()[1].items():
+                    totals[key] -= count
+                    if totals[key] <= 0:
+                        del totals[key]
+        horizon = now - STATS_WINDOWS[-1][1]
+        for finished in self.latencies.values():
+            while finished and finished[0][0] <= horizon:
+                finished.popleft()
+
+    @staticmethod
+    def _keys(event):
+        keys = [(field, event[field]) for field in STATS_FIELDS[:-1] if event.get(field)]
+        if event.get('type') == 'service':
+            service_uri = event.get('resource_uri')
+        else:
+            service_uri = next((uri for uri in event.get('parents') or [] if '/service/' in uri), None)
+        if service_uri:
+            keys.append(('service', service_uri.strip("/").split("/")[-1][:8]))
+        return keys
+
+    def _track_deployment(self, event, now):
+        resource_uri = event.get('resource_uri')
+        state = event.get('state')
+        if event.get('type') not in ('service', 'container') or not resource_uri:
+            return
+        if state in DEPLOY_STATES:
+            self.deploying.setdefault(resource_uri, (DEPLOY_STATES[state], now))
+        elif state in SETTLED_STATES and resource_uri in self.deploying:
+            kind, started = self.deploying.pop(resource_uri)
+            self.latencies["%s %s" % (event['type'], kind)].append((now, now - started))
+
+
+class LiveState(object):
+    # Same interface as StateMirror, answered by the Tutum API
+
+    def list(self, resource, **filters):
+        return RESOURCE_CLASSES[resource].list(**filters)
+
+    def find(self, resource, identifier):
+        return getattr(tutum.Utils, "fetch_remote_%s" % resource)(identifier, raise_exceptions=False)
+
+    def get(self, resource, resource_uri):
+        return RESOURCE_CLASSES[resource].fetch(resource_uri.strip("/").split("/")[-1])
+
+
+class StateMirror(object):
+    # Materialized view of stacks, services, containers, nodes and node clusters kept up to date
+    # from the event stream and reconciled with a full listing every `reconcile_interval` seconds
+
+    def __init__(self, path, reconcile_interval=300):
+        self.path = path
+        self.reconcile_interval = reconcile_interval
+        self.objects = dict((resource, {}) for resource in RESOURCE_CLASSES)
+        self.pending = set()
+        self.updated = None
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return None
+        mirror = cls(path, data.get('reconcile_interval', 0))
+        mirror.objects.update(data.get('objects', {}))
+        mirror.updated = data.get('updated', 0)
+        return mirror
+
+    @property
+    def is_stale(self):
+        # the watcher saves at least once per reconcile interval, so anything older means it has stopped
+        return not self.updated or time.time() - self.updated > self.reconcile_interval * 2 + 60
+
+    def save(self):
+        self.updated = time.time()
+        tmp_path = "%s.tmp" % self.path
+        with open(tmp_path, 'w') as f:
+            json.dump({'updated': self.updated, 'reconcile_interval': self.reconcile_interval,
+                       'objects': self.objects}, f)
+        os.rename(tmp_path, self.path)
+        self.dirty = False
+
+    def reconcile(self):
+        objects = {}
+        for resource, resource_class in RESOURCE_CLASSES.items():
+            objects[resource] = dict((obj.resource_uri, obj.get_all_attributes()) for obj in resource_class.list())
+        self.objects = objects
+        self.pending.clear()
+        self.dirty = True
+
+    def apply(self, event):
+        resource = event.get('type')
+        resource_uri = event.get('resource_uri')
+        if resource not in self.objects or not resource_uri:
+            return
+        attributes = self.objects[resource].get(resource_uri)
+        if attributes is not None and event.get('state'):
+            attributes['state'] = event['state']
+            self.dirty = True
+        # events only carry the state, the rest of the object is refreshed on the next flush
+        self.pending.add((resource, resource_uri))
+
+    def refresh(self):
+        while self.pending:
+            resource, resource_uri = self.pending.pop()
+            try:
+                obj = tutum.Utils.fetch_by_resource_uri(resource_uri)
+                self.objects[resource][resource_uri] = obj.get_all_attributes()
+            except TutumApiError as e:
+                if 'Status 404' not in str(e):
+                    raise
+                self.objects[resource].pop(resource_uri, None)
+            self.dirty = True
+
+    def run(self, stream, flush_interval=1):
+        gaps = []
+        stream.on_gap(lambda disconnected_at, reconnected_at: gaps.append(reconnected_at))
+        stream.start()
+        self.reconcile()
+        self.save()
+        last_reconcile = time.time()
+        next_flush = last_reconcile + flush_interval
+        while True:
+            try:
+                self.apply(stream.get(timeout=max(0, next_flush - time.time())))
+                if time.time() < next_flush:
+                    continue
+            except Queue.Empty:
+                pass
+
+            now = time.time()
+            next_flush = now + flush_interval
+            try:
+                if gaps or now - last_reconcile >= self.reconcile_interval:
+                    del gaps[:]
+                    self.reconcile()
+                    last_reconcile = now
+                else:
+                    self.refresh()
+                if self.dirty:
+                    self.save()
+            except (TutumAuthError, IOError, OSError):
+                raise
+            except Exception as e:
+                print(e, file=sys.stderr)
+                # whatever failed is caught up by a full reconcile on the next flush
+                gaps.append(now)
+
+    def list(self, resource, **filters):
+        objects = []
+        for attributes in self.objects[resource].values():
+            if all(value is None or attributes.get(key) == value for key, value in filters.items()):
+                objects.append(RESOURCE_CLASSES[resource](**attributes))
+        return sorted(objects, key=lambda obj: getattr(obj, 'name', None))
+
+    def find(self, resource, identifier):
+        candidates = self.objects[resource].values()
+        matches = [a for a in candidates if a.get('uuid') == identifier] or \
+                  [a for a in candidates if a.get('uuid', '').startswith(identifier)] or \
+                  [a for a in candidates if a.get('name') == identifier]
+        if len(matches) == 1:
+            return RESOURCE_CLASSES[resource](**matches[0])
+        elif len(matches) == 0:
+            return ObjectNotFound("Cannot find a %s with the identifier '%s'" % (resource, identifier))
+        return NonUniqueIdentifier("More than one %s has the same identifier, please use the long uuid" % resource)
+
+    def get(self, resource, resource_uri):
+        attributes = self.objects[resource].get(resource_uri)
+        if attributes is None:
+            raise ObjectNotFound("Cannot find a %s with the resource uri '%s'" % (resource, resource_uri))
+        return RESOURCE_CLASSES[resource](**attributes)
+
+
+def get_state(from_cache):
+    if from_cache:
+        mirror = StateMirror.load(utils.get_cache_path(MIRROR_FILE))
+        if mirror and not mirror.is_stale:
+            return mirror
+        print("Cached state is missing or out of date (is 'tutum watch' running?), querying Tutum instead",
+              file=sys.stderr)
+    return LiveState()
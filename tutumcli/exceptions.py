@@ -15,4 +15,19 @@ class StreamOutputError(Exception):
 
 
 class InternalError(RuntimeError):
-    pass
\ No newline at end of file
+    pass
+
+class TransferError(RuntimeError):
+    pass
+
+
+class ExecTimeoutError(RuntimeError):
+    pass
+
+
+class BuildError(RuntimeError):
+    pass
+
+
+class PortForwardError(RuntimeError):
+    pass
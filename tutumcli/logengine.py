@@ -0,0 +1,422 @@
+import base64
+import binascii
+import errno
+import hashlib
+import heapq
+import itertools
+import logging
+import os
+import select
+import socket
+import ssl
+import struct
+import threading
+import time
+import urlparse
+
+from tutum.api.base import StreamingLog
+from websocket import ABNF
+
+
+RECV_SIZE = 64 * 1024
+CONNECT_TIMEOUT = 30
+MIN_BACKOFF = 1
+MAX_BACKOFF = 30
+# lines requested again after a reconnection, the ones printed before it are skipped by timestamp
+RECONNECT_TAIL = 100
+# how often sources whose buffer is full are retried
+BACKPRESSURE_INTERVAL = 0.05
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OPCODE_CONT = 0x0
+
+CONNECTING = 'connecting'
+TLS = 'tls'
+HANDSHAKE = 'handshake'
+OPEN = 'open'
+
+cli_log = logging.getLogger("cli")
+
+
+class LogConnectionError(Exception):
+    pass
+
+
+def mask(mask_key, data):
+    # xors the whole payload as one long integer, ABNF.mask loops over every byte in python
+    if not data:
+        return data
+    size = len(data)
+    key = (mask_key * (size // 4 + 1))[:size]
+    value = int(binascii.hexlify(data), 16) ^ int(binascii.hexlify(key), 16)
+    return binascii.unhexlify("%0*x" % (size * 2, value))
+
+
+def create_frame(payload, opcode):
+    if isinstance(payload, unicode):
+        payload = payload.encode('utf-8')
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, 0x80 | length)
+    elif length < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 0x80 | 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 0x80 | 127, length)
+    mask_key = os.urandom(4)
+    return header + mask_key + mask(mask_key, payload)
+
+
+class FrameParser(object):
+    # Incremental websocket frame decoder, data can be fed in chunks of any size.
+
+    def __init__(self):
+        self.buffer = ""
+        self.fragments = []
+        self.fragment_opcode = None
+
+    def feed(self, data):
+        buf = self.buffer + data
+        offset = 0
+        frames = []
+        while len(buf) - offset >= 2:
+            b1, b2 = ord(buf[offset]), ord(buf[offset + 1])
+            fin = b1 & 0x80
+            opcode = b1 & 0x0f
+            masked = b2 & 0x80
+            length = b2 & 0x7f
+            start = offset + 2
+            if length == 126:
+                if len(buf) - start < 2:
+                    break
+                length = struct.unpack("!H", buf[start:start + 2])[0]
+                start += 2
+            elif length == 127:
+                if len(buf) - start < 8:
+                    break
+                length = struct.unpack("!Q", buf[start:start + 8])[0]
+                start += 8
+            if masked:
+                if len(buf) - start < 4:
+                    break
+                mask_key = buf[start:start + 4]
+                start += 4
+            if len(buf) - start < length:
+                break
+            payload = buf[start:start + length]
+            if masked:
+                payload = mask(mask_key, payload)
+            offset = start + length
+
+            if opcode >= ABNF.OPCODE_CLOSE:
+                frames.append((opcode, payload))
+                continue
+            if opcode != OPCODE_CONT:
+                self.fragment_opcode = opcode
+                self.fragments = []
+            self.fragments.append(payload)
+            if fin:
+                frames.append((self.fragment_opcode, "".join(self.fragments)))
+                self.fragments = []
+        self.buffer = buf[offset:]
+        return frames
+
+
+class WebSocketConnection(object):
+    # Non-blocking websocket client. Every step, from the TCP connection to the TLS and HTTP upgrade
+    # handshakes, is driven by the select loop of its owner.
+
+    def __init__(self, url):
+        parsed = urlparse.urlparse(url)
+        self.secure = parsed.scheme == 'wss'
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if self.secure else 80)
+        self.resource = parsed.path + ("?" + parsed.query if parsed.query else "")
+        self.sock = None
+        self.state = None
+        self.tls_want_write = False
+        self.outgoing = ""
+        self.incoming = ""
+        self.parser = FrameParser()
+        self.opened = False
+        self.started = time.time()
+        self.key = None
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def connect(self):
+        family, socktype, proto, _, address = socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_STREAM)[0]
+        self.sock = socket.socket(family, socktype, proto)
+        self.sock.setblocking(0)
+        err = self.sock.connect_ex(address)
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            raise socket.error(err, os.strerror(err))
+        self.state = CONNECTING
+
+    def close(self):
+        if self.sock:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+
+    def wants_read(self):
+        return self.state in (HANDSHAKE, OPEN) or (self.state == TLS and not self.tls_want_write)
+
+    def wants_write(self):
+        return self.state == CONNECTING or (self.state == TLS and self.tls_want_write) or \
+            (self.state in (HANDSHAKE, OPEN) and bool(self.outgoing))
+
+    def send_frame(self, payload, opcode):
+        self.outgoing += create_frame(payload, opcode)
+
+    def on_writable(self):
+        if self.state == CONNECTING:
+            err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                raise socket.error(err, os.strerror(err))
+            if self.secure:
+                self.sock = ssl.wrap_socket(self.sock, do_handshake_on_connect=False)
+                self.state = TLS
+            else:
+                self._start_handshake()
+        if self.state == TLS:
+            self._handshake_tls()
+        if self.outgoing:
+            try:
+                sent = self.sock.send(self.outgoing)
+            except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                return
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            self.outgoing = self.outgoing[sent:]
+
+    def _handshake_tls(self):
+        try:
+            self.sock.do_handshake()
+        except ssl.SSLWantReadError:
+            self.tls_want_write = False
+            return
+        except ssl.SSLWantWriteError:
+            self.tls_want_write = True
+            return
+        self._start_handshake()
+
+    def _start_handshake(self):
+        self.key = base64.b64encode(os.urandom(16))
+        host = self.host if self.port in (80, 443) else "%s:%d" % (self.host, self.port)
+        self.outgoing = "\r\n".join(["GET %s HTTP/1.1" % self.resource,
+                                     "Upgrade: websocket",
+                                     "Connection: Upgrade",
+                                     "Host: %s" % host,
+                                     "Origin: http://%s" % host,
+                                     "Sec-WebSocket-Key: %s" % self.key,
+                                     "Sec-WebSocket-Version: 13",
+                                     "", ""])
+        self.state = HANDSHAKE
+
+    def _check_handshake(self, response):
+        lines = response.split("\r\n")
+        status = lines[0].split(" ", 2)
+        if len(status) < 2 or status[1] != "101":
+            raise LogConnectionError("Handshake status %s" % " ".join(status[1:]))
+        headers = dict([(name.strip().lower(), value.strip())
+                        for name, value in [line.split(":", 1) for line in lines[1:] if ":" in line]])
+        accept = base64.b64encode(hashlib.sha1(self.key + WEBSOCKET_GUID).digest())
+        if headers.get('sec-websocket-accept') != accept:
+            raise LogConnectionError("Invalid handshake response")
+
+    def read(self):
+        # returns the complete frames received and whether the server closed the connection
+        if self.state == TLS:
+            self._handshake_tls()
+            return [], False
+        chunks = []
+        eof = False
+        while True:
+            try:
+                data = self.sock.recv(RECV_SIZE)
+            except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                break
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not data:
+                eof = True
+                break
+            chunks.append(data)
+            # decrypted data left in the TLS buffer would not wake up select again
+            if not self.secure or not self.sock.pending():
+                break
+        data = "".join(chunks)
+        if self.state == HANDSHAKE:
+            self.incoming += data
+            if "\r\n\r\n" not in self.incoming:
+                if eof:
+                    raise LogConnectionError("Connection closed during handshake")
+                return [], False
+            response, data = self.incoming.split("\r\n\r\n", 1)
+            self.incoming = ""
+            self._check_handshake(response)
+            self.state = OPEN
+            self.opened = True
+        return self.parser.feed(data), eof
+
+
+class LogConnection(WebSocketConnection):
+    # Connection to the log stream of one source.
+
+    def __init__(self, source, tail):
+        self.source = source
+        super(LogConnection, self).__init__(StreamingLog(source.obj_type, source.uuid, tail, source.follow).ws.url)
+
+
+class LogEngine(object):
+    # Holds the log connections of any number of sources in a single thread. A source whose buffer
+    # is full is not read from until the writer catches up, and reconnections of every source are
+    # scheduled on one shared timer heap.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = False
+        self.added = []
+        self.sources = []
+        self.connections = {}
+        self.finished = set()
+        self.backoff = {}
+        self.reconnects = []
+        self.sequence = itertools.count()
+        self.wake_read, self.wake_write = os.pipe()
+
+    def add(self, source):
+        with self.lock:
+            self.added.append(source)
+            if not self.running:
+                self.running = True
+                thread = threading.Thread(target=self._run)
+                thread.daemon = True
+                thread.start()
+        self.wake()
+
+    def wake(self):
+        try:
+            os.write(self.wake_write, "x")
+        except OSError:
+            pass
+
+    def _schedule(self, source, delay, tail):
+        heapq.heappush(self.reconnects, (time.time() + delay, next(self.sequence), source, tail))
+
+    def _connect(self, source, tail):
+        connection = LogConnection(source, tail)
+        self.connections[source] = connection
+        try:
+            connection.connect()
+        except (socket.error, LogConnectionError) as e:
+            self._disconnect(source, e)
+
+    def _finish(self, source):
+        connection = self.connections.pop(source, None)
+        if connection:
+            connection.close()
+        self.finished.add(source)
+        source.put(None)
+
+    def _disconnect(self, source, error):
+        connection = self.connections.pop(source)
+        connection.close()
+        if error:
+            source._on_error(error, connection.opened)
+        if not source.follow or source._stopped.is_set():
+            self._finish(source)
+            return
+        if connection.opened:
+            self.backoff[source] = MIN_BACKOFF
+        backoff = self.backoff.get(source, MIN_BACKOFF)
+        cli_log.debug("log stream of %s disconnected, reconnecting in %ds" % (source.name, backoff))
+        source.start_replay()
+        self._schedule(source, backoff, RECONNECT_TAIL)
+        self.backoff[source] = min(backoff * 2, MAX_BACKOFF)
+
+    def _handle(self, connection, frames):
+        for opcode, payload in frames:
+            if opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY):
+                connection.source._on_message(payload)
+            elif opcode == ABNF.OPCODE_PING:
+                connection.send_frame(payload, ABNF.OPCODE_PONG)
+            elif opcode == ABNF.OPCODE_CLOSE:
+                return True
+        return False
+
+    def _step(self):
+        now = time.time()
+        while self.reconnects and self.reconnects[0][0] <= now:
+            _, _, source, tail = heapq.heappop(self.reconnects)
+            if source not in self.finished:
+                self._connect(source, tail)
+
+        for source in list(self.sources):
+            if source in self.finished:
+                source.transfer()
+                if not source.pending:
+                    self.sources.remove(source)
+                continue
+            if source._stopped.is_set():
+                self._finish(source)
+            elif source in self.connections and not self.connections[source].opened and \
+                    now - self.connections[source].started > CONNECT_TIMEOUT:
+                self._disconnect(source, LogConnectionError("Connection timed out"))
+            else:
+                source.transfer()
+
+        readers = [c for c in self.connections.values() if c.wants_read() and not c.source.pending]
+        writers = [c for c in self.connections.values() if c.wants_write()]
+        timeout = 1
+        if any(source.pending for source in self.sources):
+            timeout = BACKPRESSURE_INTERVAL
+        if self.reconnects:
+            timeout = max(0, min(timeout, self.reconnects[0][0] - now))
+        readable, writable, _ = select.select(readers + [self.wake_read], writers, [], timeout)
+
+        if self.wake_read in readable:
+            os.read(self.wake_read, 4096)
+            readable.remove(self.wake_read)
+        for connection in writable:
+            if self.connections.get(connection.source) is not connection:
+                continue
+            try:
+                connection.on_writable()
+            except (socket.error, ssl.SSLError, LogConnectionError) as e:
+                self._disconnect(connection.source, e)
+        for connection in readable:
+            if self.connections.get(connection.source) is not connection:
+                continue
+            try:
+                frames, eof = connection.read()
+                closed = self._handle(connection, frames)
+            except (socket.error, ssl.SSLError, LogConnectionError) as e:
+                self._disconnect(connection.source, e)
+                continue
+            if closed or eof:
+                self._disconnect(connection.source, None)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                for source in self.added:
+                    self.sources.append(source)
+                    self._schedule(source, 0, source.tail)
+                self.added = []
+                if not self.sources:
+                    self.running = False
+                    return
+            try:
+                self._step()
+            except Exception as e:
+                cli_log.debug("log engine: %s" % e)
+                for source in list(self.sources):
+                    if source not in self.finished:
+                        source.error = source.error or e
+                        self._finish(source)
@@ -0,0 +1,458 @@
+import Queue
+import collections
+import gzip
+import heapq
+import itertools
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+
+from exceptions import BadParameter
+from tutumcli import logengine
+
+
+LOG_COLORS = [36, 33, 32, 35, 34, 31]
+DRAIN_BATCH = 256
+# seconds a followed line may wait for older lines from other sources
+MERGE_WINDOW = 2
+ROTATE_SIZE = 100
+ROTATE_INTERVAL = 3600
+# buffered bytes per file before it is written without waiting for the end of the drain cycle
+WRITE_BATCH = 64 * 1024
+# rotated files waiting for compression, writers block when the compressor falls behind
+COMPRESS_QUEUE = 16
+
+cli_log = logging.getLogger("cli")
+
+
+class LogFilter(object):
+    # Include and exclude patterns are joined into one regular expression each, so every line is
+    # matched at most twice however many patterns were given.
+
+    def __init__(self, grep=None, exclude=None, since=None, until=None):
+        self.grep = self._compile(grep)
+        self.exclude = self._compile(exclude)
+        self.since = since
+        self.until = until
+
+    @staticmethod
+    def _compile(patterns):
+        if not patterns:
+            return None
+        try:
+            return re.compile("|".join(["(?:%s)" % pattern for pattern in patterns]))
+        except re.error as e:
+            raise BadParameter("Invalid regular expression in %s: %s" % (", ".join(patterns), e))
+
+    def is_after(self, message):
+        timestamp = message.get('timestamp')
+        return self.until is not None and timestamp is not None and timestamp > self.until
+
+    def apply(self, message):
+        timestamp = message.get('timestamp')
+        if timestamp is not None:
+            if self.since is not None and timestamp < self.since:
+                return None
+            if self.until is not None and timestamp > self.until:
+                return None
+        if not self.grep and not self.exclude:
+            return message
+        lines = [line for line in message.get('log', '').splitlines(True)
+                 if (not self.grep or self.grep.search(line)) and not (self.exclude and self.exclude.search(line))]
+        if not lines:
+            return None
+        message = dict(message)
+        message['log'] = "".join(lines)
+        return message
+
+
+class LogSource(object):
+    # Streams the logs of one service or container into its own bounded buffer, fed by a shared
+    # LogEngine. When following, a dropped connection is resumed without affecting other sources.
+
+    def __init__(self, name, obj_type, uuid, tail, follow, buffer_size=1024, log_filter=None, engine=None):
+        self.name = name
+        self.obj_type = obj_type
+        self.uuid = uuid
+        self.tail = tail
+        self.follow = follow
+        self.buffer = Queue.Queue(maxsize=buffer_size)
+        self.log_filter = log_filter
+        self.engine = engine
+        # messages waiting for room in the buffer, the engine thread must never block on it
+        self.pending = collections.deque()
+        self.error = None
+        self.notify = None
+        # newest timestamp seen and how many times each line was seen with it
+        self.last_timestamp = None
+        self.last_lines = collections.Counter()
+        # set after a reconnection until the stream goes past the lines printed before it
+        self.replay_timestamp = None
+        self.replay_lines = None
+        self._stopped = threading.Event()
+
+    def start(self, notify=None):
+        self.notify = notify
+        self.engine.add(self)
+
+    def stop(self):
+        self._stopped.set()
+        if self.engine:
+            self.engine.wake()
+
+    def put(self, item):
+        self.pending.append(item)
+        self.transfer()
+
+    def transfer(self):
+        moved = False
+        while self.pending:
+            try:
+                self.buffer.put_nowait(self.pending[0])
+            except Queue.Full:
+                break
+            self.pending.popleft()
+            moved = True
+        if moved and self.notify:
+            self.notify.set()
+
+    def start_replay(self):
+        # the tail requested on reconnection repeats lines already printed, up to the last one seen
+        if self.last_timestamp is not None:
+            self.replay_timestamp = self.last_timestamp
+            self.replay_lines = collections.Counter(self.last_lines)
+
+    def _is_duplicate(self, message):
+        timestamp = message.get('timestamp')
+        if timestamp is None:
+            return False
+        log = message.get('log')
+        if self.replay_timestamp is not None:
+            if timestamp < self.replay_timestamp:
+                return True
+            if timestamp == self.replay_timestamp and self.replay_lines[log] > 0:
+                self.replay_lines[log] -= 1
+                return True
+            if timestamp > self.replay_timestamp:
+                self.replay_timestamp = None
+                self.replay_lines = None
+        if self.last_timestamp is None or timestamp > self.last_timestamp:
+            self.last_timestamp = timestamp
+            self.last_lines = collections.Counter()
+        if timestamp == self.last_timestamp:
+            self.last_lines[log] += 1
+        return False
+
+    def _on_message(self, data):
+        try:
+            message = json.loads(data)
+        except ValueError:
+            return
+        if message.get('type') == 'error':
+            self.error = message.get('data', {}).get('errorMessage') or message
+            self.stop()
+            return
+        if 'log' not in message or self._is_duplicate(message):
+            return
+        if self.log_filter:
+            if self.log_filter.is_after(message):
+                # logs arrive in order, nothing later can fall within the window
+                self.stop()
+                return
+            message = self.log_filter.apply(message)
+        if message:
+            self.put(message)
+
+    def _on_error(self, error, opened):
+        cli_log.debug("log stream of %s: %s" % (self.name, error))
+        if not opened and not self.follow:
+            self.error = error
+
+
+class LogMultiplexer(object):
+    # Writes the messages of several log sources to one output. With more than one source every line
+    # gets the name of its source as prefix, colored when the output is a terminal.
+
+    def __init__(self, sources, output):
+        self.sources = sources
+        self.output = output
+        self.ready = threading.Event()
+        is_terminal = hasattr(output, 'fileno') and os.isatty(output.fileno())
+        width = max([len(source.name) for source in sources] or [0])
+        self.prefixes = {}
+        for index, source in enumerate(sources):
+            if len(sources) == 1:
+                prefix = ""
+            elif is_terminal:
+                prefix = "%c[%dm%s |%c[0m " % (27, LOG_COLORS[index % len(LOG_COLORS)], source.name.ljust(width), 27)
+            else:
+                prefix = "%s | " % source.name.ljust(width)
+            self.prefixes[source] = prefix
+
+    def write(self, source, message):
+        prefix = self.prefixes[source]
+        log = message.get('log', '')
+        if not prefix:
+            self.output.write(log)
+            return
+        for line in log.splitlines(True):
+            self.output.write(prefix + line)
+        if log and not log.endswith("\n"):
+            self.output.write("\n")
+
+    def idle(self):
+        pass
+
+    def run(self):
+        for source in self.sources:
+            source.start(self.ready)
+        active = list(self.sources)
+        try:
+            while active:
+                self.ready.clear()
+                wrote = False
+                for source in list(active):
+                    for i in range(DRAIN_BATCH):
+                        try:
+                            message = source.buffer.get_nowait()
+                        except Queue.Empty:
+                            break
+                        if message is None:
+                            active.remove(source)
+                            break
+                        self.write(source, message)
+                        wrote = True
+                if wrote:
+                    self.output.flush()
+                else:
+                    self.ready.wait(0.5)
+                    self.idle()
+        finally:
+            for source in self.sources:
+                source.stop()
+        return [source for source in self.sources if source.error]
+
+
+class LogMerger(LogMultiplexer):
+    # Interleaves the messages of several sources by timestamp. Without follow this is an exact
+    # k-way merge, as every source's logs are already ordered. When following, a quiet source cannot
+    # hold back the others, so lines are only reordered within `window` seconds.
+
+    def __init__(self, sources, output, window=MERGE_WINDOW):
+        super(LogMerger, self).__init__(sources, output)
+        self.window = window
+        self.sequence = itertools.count()
+
+    def _entry(self, source, message):
+        timestamp = message.get('timestamp')
+        received = time.time()
+        return (received if timestamp is None else timestamp, next(self.sequence), received, source, message)
+
+    def _merge(self):
+        heap = []
+        needs = list(self.sources)
+        while needs or heap:
+            self.ready.clear()
+            for source in list(needs):
+                try:
+                    message = source.buffer.get_nowait()
+                except Queue.Empty:
+                    continue
+                needs.remove(source)
+                if message is not None:
+                    heapq.heappush(heap, self._entry(source, message))
+            if needs:
+                # the next line can only be chosen once every source has one ready
+                self.output.flush()
+                self.ready.wait(0.5)
+                continue
+            if not heap:
+                break
+            entry = heapq.heappop(heap)
+            self.write(entry[3], entry[4])
+            needs.append(entry[3])
+        self.output.flush()
+
+    def _merge_window(self):
+        heap = []
+        newest = None
+        active = list(self.sources)
+        while active or heap:
+            self.ready.clear()
+            for source in list(active):
+                for i in range(DRAIN_BATCH):
+                    try:
+                        message = source.buffer.get_nowait()
+                    except Queue.Empty:
+                        break
+                    if message is None:
+                        active.remove(source)
+                        break
+                    entry = self._entry(source, message)
+                    heapq.heappush(heap, entry)
+                    newest = max(newest, entry[0])
+
+            now = time.time()
+            wrote = False
+            while heap and (not active or heap[0][0] <= newest - self.window or heap[0][2] <= now - self.window):
+                entry = heapq.heappop(heap)
+                self.write(entry[3], entry[4])
+                wrote = True
+            if wrote:
+                self.output.flush()
+            if active:
+                self.ready.wait(min(self.window, 0.5))
+
+    def run(self):
+        for source in self.sources:
+            source.start(self.ready)
+        try:
+            if any(source.follow for source in self.sources):
+                self._merge_window()
+            else:
+                self._merge()
+        finally:
+            for source in self.sources:
+                source.stop()
+        return [source for source in self.sources if source.error]
+
+
+class LogCompressor(object):
+    # Gzips rotated log files in a background thread and removes the uncompressed copies.
+
+    def __init__(self):
+        self.queue = Queue.Queue(maxsize=COMPRESS_QUEUE)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, path):
+        self.queue.put(path)
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            path = self.queue.get()
+            if path is None:
+                break
+            try:
+                with open(path, 'rb') as f_in:
+                    f_out = gzip.open(path + '.gz', 'wb')
+                    try:
+                        shutil.copyfileobj(f_in, f_out)
+                    finally:
+                        f_out.close()
+                os.remove(path)
+            except (IOError, OSError) as e:
+                cli_log.debug("cannot compress %s: %s" % (path, e))
+
+
+class LogFile(object):
+    # Appends to <directory>/<name>.log, rotating it to <name>-<time>.log once it grows over
+    # rotate_size bytes or gets older than rotate_interval seconds.
+
+    def __init__(self, directory, name, compressor, rotate_size, rotate_interval):
+        self.directory = directory
+        self.name = name.replace(os.sep, '_')
+        self.path = os.path.join(directory, self.name + '.log')
+        self.compressor = compressor
+        self.rotate_size = rotate_size
+        self.rotate_interval = rotate_interval
+        self.pending = []
+        self.pending_size = 0
+        self._open()
+
+    def _open(self):
+        self.file = open(self.path, 'ab')
+        self.size = self.file.tell()
+        self.opened = time.time()
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.pending.append(data)
+        self.pending_size += len(data)
+        if self.pending_size >= WRITE_BATCH:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.file.write("".join(self.pending))
+            self.file.flush()
+            self.size += self.pending_size
+            self.pending = []
+            self.pending_size = 0
+        if self.size and ((self.rotate_size and self.size >= self.rotate_size) or
+                          (self.rotate_interval and time.time() - self.opened >= self.rotate_interval)):
+            self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        rotated = os.path.join(self.directory, "%s-%s.log" % (self.name, time.strftime("%Y%m%dT%H%M%S")))
+        index = 1
+        while os.path.exists(rotated) or os.path.exists(rotated + '.gz'):
+            rotated = os.path.join(self.directory, "%s-%s-%d.log" % (self.name, time.strftime("%Y%m%dT%H%M%S"), index))
+            index += 1
+        os.rename(self.path, rotated)
+        self.compressor.put(rotated)
+        self._open()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class LogArchiver(LogMultiplexer):
+    # Writes every source to its own rotating file in a directory instead of a shared output.
+
+    def __init__(self, sources, directory, rotate_size=ROTATE_SIZE * 1024 * 1024, rotate_interval=ROTATE_INTERVAL):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.compressor = LogCompressor()
+        self.files = dict([(source, LogFile(directory, source.name, self.compressor, rotate_size, rotate_interval))
+                           for source in sources])
+        super(LogArchiver, self).__init__(sources, self)
+
+    def write(self, source, message):
+        self.files[source].write(message.get('log', ''))
+
+    def flush(self):
+        for log_file in self.files.values():
+            log_file.flush()
+
+    def idle(self):
+        # files of quiet sources must still be rotated once their interval is over
+        self.flush()
+
+    def run(self):
+        try:
+            return super(LogArchiver, self).run()
+        finally:
+            for log_file in self.files.values():
+                log_file.close()
+            self.compressor.stop()
+
+
+def create_multiplexer(sources, output, merge=False, directory=None, rotate_size=ROTATE_SIZE,
+                       rotate_interval=ROTATE_INTERVAL):
+    if directory:
+        return LogArchiver(sources, directory, rotate_size * 1024 * 1024, rotate_interval)
+    if merge:
+        return LogMerger(sources, output)
+    return LogMultiplexer(sources, output)
+
+
+def stream_logs(targets, output, tail, follow, merge=False, log_filter=None, directory=None, rotate_size=ROTATE_SIZE,
+                rotate_interval=ROTATE_INTERVAL):
+    # streams the (name, type, uuid) targets from one engine, returns the sources that failed
+    engine = logengine.LogEngine()
+    sources = [LogSource(name, obj_type, uuid, tail, follow, log_filter=log_filter, engine=engine)
+               for name, obj_type, uuid in targets]
+    return create_multiplexer(sources, output, merge, directory, rotate_size, rotate_interval).run()
@@ -0,0 +1,62 @@
+import Queue
+import threading
+
+from exceptions import BadParameter
+from tutumcli import logs
+
+
+class PrefixedOutput(object):
+    # Writes complete lines of several jobs to shared streams, prefixed with the name of the job.
+
+    def __init__(self, names, stdout, stderr):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.lock = threading.Lock()
+        is_terminal = hasattr(stdout, 'isatty') and stdout.isatty()
+        width = max([len(name) for name in names] or [0])
+        self.prefixes = {}
+        for index, name in enumerate(names):
+            if is_terminal:
+                color = logs.LOG_COLORS[index % len(logs.LOG_COLORS)]
+                self.prefixes[name] = "%c[%dm%s |%c[0m " % (27, color, name.ljust(width), 27)
+            else:
+                self.prefixes[name] = "%s | " % name.ljust(width)
+
+    def write_lines(self, name, stream, lines):
+        if not lines:
+            return
+        prefix = self.prefixes[name]
+        data = "".join([prefix + line + "\n" for line in lines])
+        with self.lock:
+            stream.write(data)
+            stream.flush()
+
+
+def check_parallel(parallel):
+    if parallel < 1:
+        raise BadParameter("--parallel must be at least 1, got %d" % parallel)
+
+
+def run_jobs(jobs, parallel):
+    # calls run() of every job with at most `parallel` of them running at the same time
+    check_parallel(parallel)
+    queue = Queue.Queue()
+    for job in jobs:
+        queue.put(job)
+
+    def worker():
+        while True:
+            try:
+                job = queue.get_nowait()
+            except Queue.Empty:
+                return
+            job.run()
+
+    threads = [threading.Thread(target=worker) for i in range(min(parallel, len(jobs)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(0.5)
+    return jobs
@@ -14,22 +14,66 @@ def add_build_parser(subparsers):
     build_parser = subparsers.add_parser('build', help='Build an image using tutum/builder',
                                          description='Build an image using tutum/builder')
     build_parser.add_argument('-t', '--tag', help='repository name (and optionally a tag) to be applied '
-                                                  'to the resulting image in case of success')
-    build_parser.add_argument('directory', help='working directory')
+                                                  'to the resulting image in case of success, not with -f')
+    build_parser.add_argument('directory', help='working directory', nargs='?')
+    build_parser.add_argument('-f', '--file', help='YAML file listing builds to run in parallel, each with a '
+                                                   'directory and a tag')
+    build_parser.add_argument('--parallel', help='number of builds to run at the same time with -f (default: 4)',
+                              type=int, default=4)
     build_parser.add_argument('-s', '--sock', help='docker unix sock address. Default: "/var/run/docker.sock"')
+    build_parser.add_argument('--pull', help='when to pull tutum/builder. By default it is pulled when missing, or '
+                                             'when its digest differs from the one on Docker Hub',
+                              choices=['always', 'missing', 'never'])
+    build_parser.add_argument('--pull-interval', help='seconds between two digest comparisons of tutum/builder '
+                                                      '(default: 86400)', type=int, default=86400)
+    build_parser.add_argument('--force', help='build even when the context did not change since a previous build',
+                              action='store_true')
 
 
 def add_event_parser(subparsers):
     # tutum event
-    subparsers.add_parser('event', help='Get real time tutum events',
-                          description='Get real time tutum events')
+    event_parser = subparsers.add_parser('event', help='Get real time tutum events',
+                                         description='Get real time tutum events')
+    event_parser.add_argument('--buffer-size', help='maximum number of events held between the stream and the '
+                                                    'output (default: 1024)', type=int, default=1024)
+    event_parser.add_argument('--on-full', help='what to do when the buffer is full: stop reading from the stream '
+                                                'or discard the oldest event (default: block)',
+                              choices=['block', 'drop-oldest'], default='block')
+    event_parser.add_argument('--heartbeat', help='seconds between keepalive pings, 0 to disable (default: 30)',
+                              type=int, default=30)
+    log_group = event_parser.add_mutually_exclusive_group()
+    log_group.add_argument('--record', help='also append the events to a compressed event log file')
+    log_group.add_argument('--replay', help='emit the events of an event log file instead of connecting to Tutum')
+    event_parser.add_argument('--speed', help='replay speed multiplier, 0 to replay without delays (default: 1)',
+                              type=float, default=1.0)
+    event_parser.add_argument('--stats', help='show rolling event counts and deployment latencies instead of '
+                                              'the events', action='store_true')
+    event_parser.add_argument('--stats-interval', help='seconds between statistics refreshes (default: 5)',
+                              type=int, default=5)
+    event_parser.add_argument('--stats-format', help='output format of the statistics (default: table)',
+                              choices=['table', 'json'], default='table')
+
+def add_watch_parser(subparsers):
+    # tutum watch
+    watch_parser = subparsers.add_parser('watch', help='Mirror tutum state locally from real time events',
+                                         description='Mirror tutum state locally from real time events, '
+                                                     'to be read by commands run with --from-cache')
+    watch_parser.add_argument('--reconcile-interval', help='seconds between full reconciliations with Tutum '
+                                                           '(default: 300)', type=int, default=300)
+
 
 def add_push_parser(subparsers):
     # tutum push
     push_parser = subparsers.add_parser('push', help='Push a local image to Tutum private registry',
                                              description='Push a local image to Tutum private registry')
-    push_parser.add_argument('name', help='name of the image to push')
-    push_parser.add_argument('--public', help='push image to public registry', action='store_true')
+    push_parser.add_argument('name', help='names of the images to push', nargs='+')
+    push_parser.add_argument('--public', help='push image to public registry, same as --to public',
+                             action='store_true')
+    push_parser.add_argument('--to', help='comma separated registries to push to: tutum, public (default: tutum)')
+    push_parser.add_argument('--parallel', help='number of pushes to run at the same time (default: 4)', type=int,
+                             default=4)
+    push_parser.add_argument('--retries', help='times a push failing with a registry or network error is retried '
+                                               '(default: 3)', type=int, default=3)
 
 def add_run_parser(subparsers):
     # tutum run
@@ -92,11 +136,65 @@ def add_up_parser(subparsers):
     up_parser.add_argument('--sync', help='block the command until the async operation has finished',
                            action='store_true')
 
+def add_cp_parser(subparsers):
+    # tutum cp
+    cp_parser = subparsers.add_parser('cp', help='Copy files between a container and the local filesystem',
+                                      description='Copy files between a container and the local filesystem')
+    cp_parser.add_argument('source', help="local path, or container:path to copy from a container")
+    cp_parser.add_argument('destination', help="local directory, or container:directory to copy into a container")
+
+
+def add_port_forward_parser(subparsers):
+    # tutum port-forward
+    port_forward_parser = subparsers.add_parser('port-forward', help='Forward local ports to a container',
+                                                description='Forward local ports to a container through its exec '
+                                                            'endpoint, netcat (nc) must be available in the '
+                                                            'container. Only text protocols can be forwarded, '
+                                                            'a connection carrying binary data is closed')
+    port_forward_parser.add_argument('identifier', help="container's UUID (either long or short) or name")
+    port_forward_parser.add_argument('ports', help="ports to forward, format: [local_port:]container_port, "
+                                                   "local_port 0 picks a free port", nargs='+')
+    port_forward_parser.add_argument('--address', help="local address to listen on (default: 127.0.0.1)",
+                                     default="127.0.0.1")
+
+
+def add_replay_parser(subparsers):
+    # tutum replay
+    replay_parser = subparsers.add_parser('replay', help='Play a session recorded with exec --record',
+                                          description='Play a session recorded with exec --record')
+    replay_parser.add_argument('file', help="asciicast file to play")
+    replay_parser.add_argument('--speed', help='playback speed multiplier, 0 to print without delays (default: 1)',
+                               type=float, default=1.0)
+    replay_parser.add_argument('--idle-limit', help='longest pause between outputs, in seconds', type=float)
+
+
 def add_exec_parser(subparsers):
     # tutum exec
     exec_parser = subparsers.add_parser('exec', help='Run a command in a running container',
                                                  description='Run a command in a running container')
-    exec_parser.add_argument('identifier', help="container's UUID (either long or short) or name")
+    exec_parser.add_argument('identifier', help="container's UUID (either long or short) or name, or the first "
+                                                "word of the command when --service or --stack is used")
+    target_group = exec_parser.add_mutually_exclusive_group()
+    target_group.add_argument('--service', help="run the command in every running container of this service")
+    target_group.add_argument('--stack', help="run the command in every running container of this stack")
+    exec_parser.add_argument('--parallel', help="number of containers to run the command in at the same time with "
+                                                "--service or --stack (default: 10)", type=int, default=10)
+    exec_parser.add_argument('--ping-interval', help="seconds between websocket pings keeping the session alive, 0 "
+                                                     "disables them (default: 30)", type=int, default=30)
+    exec_parser.add_argument('--connect-timeout', help="seconds to wait for the connection (default: 10)", type=int,
+                             default=10)
+    exec_parser.add_argument('--read-timeout', help="close the session when nothing is received for this number of "
+                                                    "seconds, 0 waits forever (default: 0)", type=int, default=0)
+    exec_parser.add_argument('--retries', help="connection attempts to retry for non-interactive commands "
+                                               "(default: 3)", type=int, default=3)
+    exec_parser.add_argument('--latency', help="report the round-trip latency measured by the pings",
+                             action='store_true')
+    exec_parser.add_argument('--record', help="save the output of the interactive session to an asciicast file, "
+                                              "which can be played with 'tutum replay'")
+    exec_parser.add_argument('-T', '--no-tty', help="do not use the local terminal, pass piped stdin, read until "
+                                                    "its end first, and the command's output as raw data through "
+                                                    "base64 in the container (default when stdin or stdout is not "
+                                                    "a terminal)", action='store_true')
     exec_parser.add_argument('command', help="the command to run (default: sh)", nargs=argparse.REMAINDER)
 
 def add_service_parser(subparsers):
@@ -171,8 +269,22 @@ def add_service_parser(subparsers):
                                                description='Get logs from a service')
     logs_parser.add_argument('identifier', help="service's UUID (either long or short) or name", nargs='+')
     logs_parser.add_argument('-f', '--follow', help='follow log output', action='store_true')
+    logs_parser.add_argument('-m', '--merge', help="interleave the logs of the service's containers by timestamp",
+                             action='store_true')
     logs_parser.add_argument('-t', '--tail', help='Output the specified number of lines at the end of logs '
                                                   '(defaults: 300)', type=int)
+    logs_parser.add_argument('--grep', help='only output log lines matching the regular expression '
+                                            '(can be repeated)', action='append')
+    logs_parser.add_argument('--exclude', help='do not output log lines matching the regular expression '
+                                               '(can be repeated)', action='append')
+    logs_parser.add_argument('--since', help='only output logs after a time, either relative (e.g. 10m, 2h), a unix '
+                                             'timestamp or a date (e.g. 2015-05-01T10:00:00)')
+    logs_parser.add_argument('--until', help='only output logs before a time, in the same formats as --since')
+    logs_parser.add_argument('-o', '--output', help='write the logs of each source to its own file in this directory')
+    logs_parser.add_argument('--rotate-size', help='rotate and compress output files larger than this size in MB '
+                                                   '(default: 100)', type=int, default=100)
+    logs_parser.add_argument('--rotate-interval', help='rotate and compress output files older than this number of '
+                                                       'seconds (default: 3600)', type=int, default=3600)
 
     # tutum service ps
     ps_parser = service_subparser.add_parser('ps', help='List services', description='List services')
@@ -181,6 +293,8 @@ def add_service_parser(subparsers):
                            choices=['Init', 'Stopped', 'Starting', 'Running', 'Stopping', 'Terminating', 'Terminated',
                                     'Scaling', 'Partly running', 'Not running', 'Redeploying'])
     ps_parser.add_argument('--stack', help="filter services by stack (UUID either long or short, or name)")
+    ps_parser.add_argument('--from-cache', help="read services from the state mirrored by 'tutum watch'",
+                           action='store_true')
 
 
     # tutum service redeploy
@@ -335,7 +449,29 @@ def add_container_parser(subparsers):
     # tutum container exec
     exec_parser = container_subparser.add_parser('exec', help='Run a command in a running container',
                                                  description='Run a command in a running container')
-    exec_parser.add_argument('identifier', help="container's UUID (either long or short) or name")
+    exec_parser.add_argument('identifier', help="container's UUID (either long or short) or name, or the first "
+                                                "word of the command when --service or --stack is used")
+    target_group = exec_parser.add_mutually_exclusive_group()
+    target_group.add_argument('--service', help="run the command in every running container of this service")
+    target_group.add_argument('--stack', help="run the command in every running container of this stack")
+    exec_parser.add_argument('--parallel', help="number of containers to run the command in at the same time with "
+                                                "--service or --stack (default: 10)", type=int, default=10)
+    exec_parser.add_argument('--ping-interval', help="seconds between websocket pings keeping the session alive, 0 "
+                                                     "disables them (default: 30)", type=int, default=30)
+    exec_parser.add_argument('--connect-timeout', help="seconds to wait for the connection (default: 10)", type=int,
+                             default=10)
+    exec_parser.add_argument('--read-timeout', help="close the session when nothing is received for this number of "
+                                                    "seconds, 0 waits forever (default: 0)", type=int, default=0)
+    exec_parser.add_argument('--retries', help="connection attempts to retry for non-interactive commands "
+                                               "(default: 3)", type=int, default=3)
+    exec_parser.add_argument('--latency', help="report the round-trip latency measured by the pings",
+                             action='store_true')
+    exec_parser.add_argument('--record', help="save the output of the interactive session to an asciicast file, "
+                                              "which can be played with 'tutum replay'")
+    exec_parser.add_argument('-T', '--no-tty', help="do not use the local terminal, pass piped stdin, read until "
+                                                    "its end first, and the command's output as raw data through "
+                                                    "base64 in the container (default when stdin or stdout is not "
+                                                    "a terminal)", action='store_true')
     exec_parser.add_argument('command', help="the command to run (default: sh)", nargs=argparse.REMAINDER)
 
     # tutum container inspect
@@ -350,6 +486,18 @@ def add_container_parser(subparsers):
     logs_parser.add_argument('-f', '--follow', help='follow log output', action='store_true')
     logs_parser.add_argument('-t', '--tail', help='Output the specified number of lines at the end of logs '
                                                   '(defaults: 300)', type=int)
+    logs_parser.add_argument('--grep', help='only output log lines matching the regular expression '
+                                            '(can be repeated)', action='append')
+    logs_parser.add_argument('--exclude', help='do not output log lines matching the regular expression '
+                                               '(can be repeated)', action='append')
+    logs_parser.add_argument('--since', help='only output logs after a time, either relative (e.g. 10m, 2h), a unix '
+                                             'timestamp or a date (e.g. 2015-05-01T10:00:00)')
+    logs_parser.add_argument('--until', help='only output logs before a time, in the same formats as --since')
+    logs_parser.add_argument('-o', '--output', help='write the logs of each source to its own file in this directory')
+    logs_parser.add_argument('--rotate-size', help='rotate and compress output files larger than this size in MB '
+                                                   '(default: 100)', type=int, default=100)
+    logs_parser.add_argument('--rotate-interval', help='rotate and compress output files older than this number of '
+                                                       'seconds (default: 3600)', type=int, default=3600)
 
     redeploy_parser = container_subparser.add_parser('redeploy', help='Redeploy a running container',
                                                      description='Redeploy a running container')
@@ -364,6 +512,8 @@ def add_container_parser(subparsers):
                            choices=['Init', 'Stopped', 'Starting', 'Running', 'Stopping', 'Terminating', 'Terminated'])
     ps_parser.add_argument('--service', help="filter containers by service (UUID either long or short, or name)")
     ps_parser.add_argument('--no-trunc', help="don't truncate output", action='store_true')
+    ps_parser.add_argument('--from-cache', help="read containers from the state mirrored by 'tutum watch'",
+                           action='store_true')
 
     # tutum container start
     start_parser = container_subparser.add_parser('start', help='Start a container', description='Start a container')
@@ -415,8 +565,14 @@ def add_image_parser(subparsers):
     # tutum image push
     push_parser = image_subparser.add_parser('push', help='Push a local image to Tutum private registry',
                                              description='Push a local image to Tutum private registry')
-    push_parser.add_argument('name', help='name of the image to push')
-    push_parser.add_argument('--public', help='push image to public registry', action='store_true')
+    push_parser.add_argument('name', help='names of the images to push', nargs='+')
+    push_parser.add_argument('--public', help='push image to public registry, same as --to public',
+                             action='store_true')
+    push_parser.add_argument('--to', help='comma separated registries to push to: tutum, public (default: tutum)')
+    push_parser.add_argument('--parallel', help='number of pushes to run at the same time (default: 4)', type=int,
+                             default=4)
+    push_parser.add_argument('--retries', help='times a push failing with a registry or network error is retried '
+                                               '(default: 3)', type=int, default=3)
 
     # tutum image rm
     rm_parser = image_subparser.add_parser('rm', help='Deregister a private image from Tutum',
@@ -429,6 +585,13 @@ def add_image_parser(subparsers):
     search_parser = image_subparser.add_parser('search', help='Search for images in the Docker Index',
                                                description='Search for images in the Docker Index')
     search_parser.add_argument('query', help='query to search')
+    search_parser.add_argument('--limit', help='maximum number of results to show', type=int)
+    search_parser.add_argument('--stars', help='only show images with at least this number of stars', type=int)
+    search_parser.add_argument('--official', help='only show official images', action='store_true')
+    search_parser.add_argument('--format', help='output format (default: table)', choices=['table', 'json'],
+                               default='table')
+    search_parser.add_argument('--cache-ttl', help='seconds the results of the same query are reused for, 0 to '
+                                                   'always search (default: 3600)', type=int, default=3600)
 
     # tutum image update
     update_parser = image_subparser.add_parser('update', help='Update a private image',
@@ -457,6 +620,8 @@ def add_node_parser(subparsers):
     # tutum node list
     list_parser = node_subparser.add_parser('list', help='List nodes', description='List nodes')
     list_parser.add_argument('-q', '--quiet', help='print only node uuid', action='store_true')
+    list_parser.add_argument('--from-cache', help="read nodes from the state mirrored by 'tutum watch'",
+                             action='store_true')
 
     # tutum node rm
     rm_parser = node_subparser.add_parser('rm', help='Remove a node', description='Remove a container')
@@ -655,6 +820,28 @@ def add_stack_parser(subparsers):
     list_parser = stack_subparser.add_parser('list', help='List stacks', description='List stacks')
     list_parser.add_argument('-q', '--quiet', help='print only long UUIDs', action='store_true')
 
+    # tutum stack logs
+    logs_parser = stack_subparser.add_parser('logs', help='Get logs from the services of a stack',
+                                             description='Get logs from the services of a stack')
+    logs_parser.add_argument('identifier', help="stack's UUID (either long or short) or name", nargs='+')
+    logs_parser.add_argument('-f', '--follow', help='follow log output', action='store_true')
+    logs_parser.add_argument('-m', '--merge', help="interleave the logs of the stack's containers by timestamp",
+                             action='store_true')
+    logs_parser.add_argument('-t', '--tail', help='Output the specified number of lines at the end of logs '
+                                                  '(defaults: 300)', type=int)
+    logs_parser.add_argument('--grep', help='only output log lines matching the regular expression '
+                                            '(can be repeated)', action='append')
+    logs_parser.add_argument('--exclude', help='do not output log lines matching the regular expression '
+                                               '(can be repeated)', action='append')
+    logs_parser.add_argument('--since', help='only output logs after a time, either relative (e.g. 10m, 2h), a unix '
+                                             'timestamp or a date (e.g. 2015-05-01T10:00:00)')
+    logs_parser.add_argument('--until', help='only output logs before a time, in the same formats as --since')
+    logs_parser.add_argument('-o', '--output', help='write the logs of each source to its own file in this directory')
+    logs_parser.add_argument('--rotate-size', help='rotate and compress output files larger than this size in MB '
+                                                   '(default: 100)', type=int, default=100)
+    logs_parser.add_argument('--rotate-interval', help='rotate and compress output files older than this number of '
+                                                       'seconds (default: 3600)', type=int, default=3600)
+
     # tutum stack redeploy
     redeploy_parser = stack_subparser.add_parser('redeploy', help='Redeploy a running stack',
                                                  description='Redeploy a running stack')
@@ -0,0 +1,233 @@
+from __future__ import print_function
+import codecs
+import collections
+import errno
+import logging
+import select
+import socket
+import ssl
+import sys
+import time
+
+from websocket import ABNF
+
+from exceptions import BadParameter, PortForwardError
+from tutumcli import logengine
+from tutumcli import shell
+
+
+RECV_SIZE = 64 * 1024
+# bytes queued in either direction before the other side stops being read
+MAX_BUFFER = 1024 * 1024
+
+cli_log = logging.getLogger("cli")
+
+
+def parse_ports(value):
+    parts = value.split(":")
+    if len(parts) == 1:
+        parts = parts * 2
+    try:
+        local_port, remote_port = [int(part) for part in parts]
+    except ValueError:
+        raise BadParameter("%s does not match with 'local_port:remote_port'" % value)
+    if not 0 <= local_port < 65536 or not 0 < remote_port < 65536:
+        raise BadParameter("Invalid port in %s" % value)
+    return local_port, remote_port
+
+
+def forward_command(port):
+    return ["nc", "127.0.0.1", str(port)]
+
+
+class Tunnel(object):
+    # Relays one local connection through an exec session running netcat in the container. Data
+    # received from either side is queued as is and the side that produced it is not read from
+    # while its queue is over MAX_BUFFER, so a slow peer holds back a fast one.
+    # The exec endpoint only relays text (see shell), so the tunnel carries text protocols only: client
+    # data that is not valid utf-8 and output that lost bytes on the way (U+FFFD) close the tunnel
+    # instead of being relayed corrupted.
+
+    def __init__(self, client, url):
+        self.client = client
+        self.connection = logengine.WebSocketConnection(url)
+        self.to_client = collections.deque()
+        self.to_client_size = 0
+        self.offset = 0
+        self.client_eof = False
+        self.remote_closed = False
+        # characters split over two reads are completed by the next one
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def wants_client_read(self):
+        return self.connection.opened and not self.client_eof and len(self.connection.outgoing) < MAX_BUFFER
+
+    def wants_client_write(self):
+        return bool(self.to_client)
+
+    def wants_remote_read(self):
+        return not self.remote_closed and self.connection.wants_read() and self.to_client_size < MAX_BUFFER
+
+    def wants_remote_write(self):
+        return not self.remote_closed and self.connection.wants_write()
+
+    def is_done(self):
+        return self.remote_closed and not self.to_client
+
+    def on_client_readable(self):
+        data = self.client.recv(RECV_SIZE)
+        if data:
+            try:
+                text = self.decoder.decode(data)
+            except UnicodeDecodeError:
+                raise PortForwardError("the client sent binary data, only text can be relayed")
+            if text:
+                self.connection.send_frame(text.encode('utf-8'), ABNF.OPCODE_TEXT)
+        else:
+            # the exec endpoint cannot close the remote stdin, the tunnel stays up until nc exits
+            self.client_eof = True
+
+    def on_client_writable(self):
+        while self.to_client:
+            chunk = self.to_client[0]
+            try:
+                sent = self.client.send(buffer(chunk, self.offset))
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            self.offset += sent
+            self.to_client_size -= sent
+            if self.offset < len(chunk):
+                return
+            self.to_client.popleft()
+            self.offset = 0
+
+    def on_remote_readable(self):
+        frames, eof = self.connection.read()
+        for opcode, payload in frames:
+            if opcode == ABNF.OPCODE_BINARY:
+                self._queue(payload)
+            elif opcode == ABNF.OPCODE_TEXT:
+                stream_type, output = shell.parse_message(payload)
+                if stream_type == "stderr":
+                    cli_log.debug("port-forward: %s" % output)
+                elif isinstance(output, unicode) and u"\ufffd" in output:
+                    raise PortForwardError("the container sent binary data as text, it cannot be relayed")
+                elif output:
+                    self._queue(output)
+            elif opcode == ABNF.OPCODE_PING:
+                self.connection.send_frame(payload, ABNF.OPCODE_PONG)
+            elif opcode == ABNF.OPCODE_CLOSE:
+                eof = True
+        if eof:
+            self.remote_closed = True
+
+    def _queue(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        if data:
+            self.to_client.append(data)
+            self.to_client_size += len(data)
+
+    def close(self):
+        self.connection.close()
+        try:
+            self.client.close()
+        except socket.error:
+            pass
+
+
+class PortForwarder(object):
+    # Listens on local ports and multiplexes every accepted connection, each one tunnelled through
+    # its own exec session, in a single select loop.
+
+    def __init__(self, container_uuid, ports, address="127.0.0.1", connect_timeout=shell.CONNECT_TIMEOUT):
+        self.container_uuid = container_uuid
+        self.connect_timeout = connect_timeout
+        self.listeners = {}
+        self.tunnels = []
+        for local_port, remote_port in ports:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind((address, local_port))
+            listener.listen(128)
+            listener.setblocking(0)
+            self.listeners[listener] = remote_port
+
+    def addresses(self):
+        return [(listener.getsockname(), remote_port) for listener, remote_port in self.listeners.items()]
+
+    def _accept(self, listener):
+        try:
+            client, peer = listener.accept()
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        client.setblocking(0)
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        remote_port = self.listeners[listener]
+        tunnel = Tunnel(client, shell.get_exec_url(self.container_uuid, forward_command(remote_port)))
+        try:
+            tunnel.connection.connect()
+        except socket.error as e:
+            print("Cannot open a tunnel for %s:%d: %s" % (peer[0], peer[1], e), file=sys.stderr)
+            tunnel.close()
+            return
+        cli_log.debug("port-forward: %s:%d -> %d" % (peer[0], peer[1], remote_port))
+        self.tunnels.append(tunnel)
+
+    def _close(self, tunnel, error=None):
+        if error:
+            print("Tunnel closed: %s" % error, file=sys.stderr)
+        tunnel.close()
+        self.tunnels.remove(tunnel)
+
+    def step(self, timeout=1):
+        now = time.time()
+        for tunnel in list(self.tunnels):
+            if tunnel.is_done():
+                self._close(tunnel)
+            elif not tunnel.connection.opened and now - tunnel.connection.started > self.connect_timeout:
+                self._close(tunnel, "connection to the container timed out")
+
+        readers = list(self.listeners)
+        writers = []
+        for tunnel in self.tunnels:
+            if tunnel.wants_client_read():
+                readers.append(tunnel.client)
+            if tunnel.wants_client_write():
+                writers.append(tunnel.client)
+            if tunnel.wants_remote_read():
+                readers.append(tunnel.connection)
+            if tunnel.wants_remote_write():
+                writers.append(tunnel.connection)
+        readable, writable, _ = select.select(readers, writers, [], timeout)
+        readable, writable = set(readable), set(writable)
+
+        for listener in self.listeners:
+            if listener in readable:
+                self._accept(listener)
+        for tunnel in list(self.tunnels):
+            try:
+                if tunnel.connection in writable:
+                    tunnel.connection.on_writable()
+                if tunnel.connection in readable:
+                    tunnel.on_remote_readable()
+                if tunnel.client in readable:
+                    tunnel.on_client_readable()
+                if tunnel.client in writable:
+                    tunnel.on_client_writable()
+            except (socket.error, ssl.SSLError, logengine.LogConnectionError, PortForwardError) as e:
+                self._close(tunnel, e)
+
+    def serve_forever(self):
+        while True:
+            self.step()
+
+    def close(self):
+        for tunnel in list(self.tunnels):
+            self._close(tunnel)
+        for listener in self.listeners:
+            listener.close()
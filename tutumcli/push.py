@@ -0,0 +1,214 @@
+import codecs
+import os
+import re
+import socket
+import threading
+import time
+
+import requests
+
+from exceptions import StreamOutputError
+from tutumcli import utils
+from tutumcli.transfer import human_size
+
+
+PUBLIC = 'public'
+TUTUM = 'tutum'
+DESTINATIONS = [TUTUM, PUBLIC]
+PUSHED = 'pushed'
+FAILED = 'failed'
+RETRIES = 3
+# seconds before the first retry, doubled for every following one
+RETRY_BACKOFF = 2
+MAX_RETRY_BACKOFF = 60
+TRANSIENT_ERROR_REGEXP = re.compile(r"status 5\d\d|\b50[0234]\b|timeout|timed out|connection reset|broken pipe|"
+                                    r"unexpected eof|connection refused|temporary failure|i/o error", re.I)
+
+
+def split_tag(name):
+    if ':' in name.split('/')[-1]:
+        repository, tag = name.rsplit(':', 1)
+        return repository, tag
+    return name, None
+
+
+def get_tutum_repository(name, registry, user):
+    repository, tag = split_tag(filter(None, name.split('/'))[-1])
+    return '%s/%s/%s' % (registry.split('//')[-1].split('/')[0], user, repository), tag
+
+
+def is_transient_error(error):
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, socket.error)):
+        return True
+    return bool(TRANSIENT_ERROR_REGEXP.search(str(error)))
+
+
+def human_rate(size, seconds):
+    return "%.1f MB/s" % (size / 1024.0 / 1024.0 / max(seconds, 0.001))
+
+
+class PushJob(object):
+    # Pushes one image to one destination and keeps the progress of its layers, only the bytes of
+    # layers actually sent are counted. A push failing with a transient error is started again after
+    # a growing delay, the daemon skips the layers that already reached the registry.
+
+    def __init__(self, name, destination, docker_client, monitor, registry=None, user=None, retries=RETRIES):
+        self.name = name
+        self.destination = destination
+        self.docker_client = docker_client
+        self.monitor = monitor
+        if destination == PUBLIC:
+            self.repository, self.tag = split_tag(name)
+        else:
+            self.repository, self.tag = get_tutum_repository(name, registry, user)
+        self.target = "%s:%s" % (self.repository, self.tag) if self.tag else self.repository
+        self.retries = retries
+        self.layers = {}
+        self.skipped = 0
+        self.attempts = []
+        # bytes sent by the attempts that already ended
+        self.sent_before = 0
+        self.retry_at = None
+        self.status = None
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    @property
+    def transferred(self):
+        return self.sent_before + sum([current for current, total in self.layers.values()])
+
+    @property
+    def total(self):
+        return sum([total for current, total in self.layers.values()])
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - (self.started or time.time())
+
+    def describe(self):
+        if self.status == FAILED:
+            return "%s: failed, %s" % (self.target, self.error)
+        if self.status == PUSHED:
+            return "%s: pushed %s in %.1fs" % (self.target, human_size(self.transferred), self.elapsed)
+        if self.retry_at:
+            return "%s: attempt %d failed (%s), retrying in %ds" % (self.target, len(self.attempts),
+                                                                     self.attempts[-1]['error'],
+                                                                     max(0, self.retry_at - time.time()))
+        if not self.total:
+            return "%s: %s" % (self.target, "preparing" if self.started else "waiting")
+        return "%s: %s / %s (%d%%), %s" % (self.target, human_size(self.transferred),
+                                           human_size(self.total), self.transferred * 100 / self.total,
+                                           human_rate(self.transferred, self.elapsed))
+
+    def _update(self, event):
+        layer = event.get('id')
+        if not layer:
+            return
+        status = event.get('status', '')
+        detail = event.get('progressDetail') or {}
+        if status == 'Pushing' and detail.get('total'):
+            self.layers[layer] = [detail.get('current', 0), detail['total']]
+        elif status in ('Pushed', 'Image successfully pushed') and layer in self.layers:
+            self.layers[layer][0] = self.layers[layer][1]
+        elif status in ('Image already exists', 'Layer already exists'):
+            self.skipped += 1
+
+    def _push(self):
+        if self.destination == PUBLIC:
+            # tags the image to its name to check that it exists
+            self.docker_client.tag(self.name, self.name, force=True)
+        else:
+            self.docker_client.tag(self.name, self.repository, tag=self.tag, force=True)
+        output = self.docker_client.push(self.repository, tag=self.tag, stream=True)
+        for event in utils.decode_stream(output):
+            if 'errorDetail' in event:
+                raise StreamOutputError(event['errorDetail']['message'])
+            self._update(event)
+            self.monitor.refresh()
+
+    def run(self):
+        self.started = time.time()
+        self.finished = None
+        self.status = None
+        self.error = None
+        self.attempts = []
+        self.sent_before = 0
+        for attempt in range(self.retries + 1):
+            attempt_started = time.time()
+            self.layers = {}
+            self.skipped = 0
+            self.retry_at = None
+            error = None
+            try:
+                self._push()
+            except Exception as e:
+                error = getattr(e, 'explanation', None) or e
+            sent = self.transferred - self.sent_before
+            self.attempts.append({'elapsed': time.time() - attempt_started, 'sent': sent, 'skipped': self.skipped,
+                                  'error': error})
+            if error is None or attempt == self.retries or not is_transient_error(error):
+                break
+            delay = min(RETRY_BACKOFF * 2 ** attempt, MAX_RETRY_BACKOFF)
+            self.retry_at = time.time() + delay
+            self.monitor.refresh()
+            time.sleep(delay)
+            self.sent_before += sent
+        self.retry_at = None
+        self.status = FAILED if error else PUSHED
+        self.error = error
+        self.finished = time.time()
+        self.monitor.finish(self)
+
+    def report_attempts(self):
+        lines = []
+        for index, attempt in enumerate(self.attempts):
+            line = "%s attempt %d: %s in %.1fs, %s sent (%s), %d layers already pushed" % (
+                self.target, index + 1, "failed" if attempt['error'] else "pushed", attempt['elapsed'],
+                human_size(attempt['sent']), human_rate(attempt['sent'], attempt['elapsed']), attempt['skipped'])
+            if attempt['error']:
+                line += ": %s" % attempt['error']
+            lines.append(line)
+        return lines
+
+
+class PushMonitor(object):
+    # Shows one line per push. A terminal gets a block of lines redrawn in place at most
+    # `frame_rate` times per second, other outputs only a line when a push finishes.
+
+    def __init__(self, stream, frame_rate=utils.STREAM_FRAME_RATE):
+        self.is_terminal = hasattr(stream, 'fileno') and os.isatty(stream.fileno())
+        self.stream = codecs.getwriter('utf-8')(stream)
+        self.interval = 1.0 / frame_rate if frame_rate else 0
+        self.lock = threading.Lock()
+        self.jobs = []
+        self.drawn = 0
+
+    def start(self, jobs):
+        self.jobs = jobs
+        with self.lock:
+            if self.is_terminal:
+                self.stream.write("".join(["%s\n" % job.describe() for job in jobs]))
+            else:
+                self.stream.write("".join(["Pushing %s to %s ...\n" % (job.name, job.target) for job in jobs]))
+            self.stream.flush()
+
+    def _draw(self):
+        lines = ["%c[2K\r%s\n" % (27, job.describe()) for job in self.jobs]
+        self.stream.write("%c[%dA%s" % (27, len(lines), "".join(lines)))
+        self.stream.flush()
+        self.drawn = time.time()
+
+    def refresh(self):
+        if not self.is_terminal or time.time() - self.drawn < self.interval:
+            return
+        with self.lock:
+            self._draw()
+
+    def finish(self, job):
+        with self.lock:
+            if self.is_terminal:
+                self._draw()
+            else:
+                self.stream.write("%s\n" % job.describe())
+                self.stream.flush()
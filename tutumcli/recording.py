@@ -0,0 +1,111 @@
+import Queue
+import codecs
+import fcntl
+import json
+import os
+import struct
+import termios
+import threading
+import time
+
+
+# seconds the writer waits to batch output before writing it to the file
+FLUSH_INTERVAL = 0.5
+ASCIICAST_VERSION = 2
+
+
+def get_terminal_size(fd):
+    try:
+        height, width = struct.unpack("hh", fcntl.ioctl(fd, termios.TIOCGWINSZ, "1234"))
+    except (IOError, struct.error):
+        return 80, 24
+    return width or 80, height or 24
+
+
+class SessionRecorder(object):
+    # Records terminal output as an asciicast v2 file. The session only stamps and queues the output,
+    # encoding and writing happen in a background thread so recording does not slow down the shell.
+
+    def __init__(self, path, width, height, command=None, flush_interval=FLUSH_INTERVAL):
+        self.file = open(path, 'w')
+        self.flush_interval = flush_interval
+        self.started = time.time()
+        self.queue = Queue.Queue()
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        header = {'version': ASCIICAST_VERSION, 'width': width, 'height': height, 'timestamp': int(self.started),
+                  'env': {'TERM': os.environ.get('TERM'), 'SHELL': os.environ.get('SHELL')}}
+        if command:
+            header['command'] = " ".join(command)
+        self.file.write(json.dumps(header) + "\n")
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, data):
+        if data:
+            self.queue.put((time.time(), data))
+
+    def _encode(self, timestamp, data):
+        if not isinstance(data, unicode):
+            # multi-byte characters can be split across messages
+            data = self.decoder.decode(data)
+            if not data:
+                return ""
+        return json.dumps([round(timestamp - self.started, 6), "o", data]) + "\n"
+
+    def _run(self):
+        while True:
+            events = [self.queue.get()]
+            deadline = time.time() + self.flush_interval
+            while events[-1] is not None:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    events.append(self.queue.get(timeout=timeout))
+                except Queue.Empty:
+                    break
+            self.file.write("".join([self._encode(*event) for event in events if event is not None]))
+            self.file.flush()
+            if events[-1] is None:
+                return
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+
+def read_session(path):
+    with open(path) as f:
+        header = json.loads(f.readline())
+        if header.get('version') != ASCIICAST_VERSION:
+            raise ValueError("%s is not an asciicast v%d recording" % (path, ASCIICAST_VERSION))
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                elapsed, event_type, data = json.loads(line)
+            except ValueError:
+                # the last line of an interrupted recording
+                return
+            if event_type == "o":
+                yield elapsed, data
+
+
+def replay_session(path, stream, speed=1.0, idle_limit=None):
+    started = time.time()
+    position = 0
+    previous = 0
+    for elapsed, data in read_session(path):
+        pause = elapsed - previous
+        previous = elapsed
+        if idle_limit:
+            pause = min(pause, idle_limit)
+        position += pause
+        if speed > 0:
+            delay = position / speed - (time.time() - started)
+            if delay > 0:
+                time.sleep(delay)
+        stream.write(data.encode('utf-8'))
+        stream.flush()
@@ -0,0 +1,287 @@
+import json
+import logging
+import os
+import pipes
+import re
+import select
+import socket
+import threading
+import time
+import urllib
+
+import tutum
+import websocket
+from tutum import TutumAuthError, TutumApiError
+from websocket import ABNF
+
+from exceptions import ExecTimeoutError
+
+
+# The exec endpoint is a text protocol. Every frame sent to it is written to the stdin of the command
+# and must be a text frame, so valid utf-8. The output comes back as JSON text messages (see
+# parse_message), in which bytes that are not valid utf-8 are replaced with U+FFFD. The endpoint can
+# neither close the stdin of the command nor report its exit status. Anything that is not text therefore
+# travels base64 encoded, with the size of the input known to the remote side in advance (see transfer),
+# and the exit status is printed by a wrapping shell (see wrap_command).
+
+INPUT_BATCH = 16 * 1024
+# seconds to wait for more input before sending what was typed or pasted so far
+INPUT_WINDOW = 0.002
+# longer wait used when the input ends in the middle of an escape sequence
+ESCAPE_WINDOW = 0.05
+OUTPUT_BATCH = 256
+# printed after the command by the wrapping shell, the exec endpoint does not report exit codes
+EXIT_MARKER = "__tutum_exit_status__:"
+# the marker ends up after the last output line when the command does not print a trailing newline
+EXIT_MARKER_REGEXP = re.compile(r"^(.*)%s(\d+)\r?$" % EXIT_MARKER)
+PING_INTERVAL = 30
+CONNECT_TIMEOUT = 10
+CONNECT_RETRIES = 3
+
+cli_log = logging.getLogger("cli")
+
+
+def get_exec_url(container_uuid, command):
+    if tutum.tutum_auth:
+        endpoint = "container/%s/exec/?auth=%s" % (container_uuid, urllib.quote_plus(tutum.tutum_auth))
+    else:
+        endpoint = "container/%s/exec/?user=%s&token=%s" % (container_uuid, tutum.user, tutum.apikey)
+
+    if command:
+        escaped_cmd = []
+        for c in command:
+            if r'"' in c:
+                c = c.replace(r'"', r'\"')
+            if " " in c:
+                c = '"%s"' % c
+            escaped_cmd.append(c)
+
+        escaped_cmd = " ".join(escaped_cmd)
+        cli_log.debug("escaped command: %s" % escaped_cmd)
+        endpoint = "%s&command=%s" % (endpoint, urllib.quote_plus(escaped_cmd))
+
+    url = "/".join([tutum.stream_url.rstrip("/"), endpoint.lstrip('/')])
+    cli_log.debug("websocket url: %s" % url)
+    return url
+
+
+def is_incomplete_escape(data):
+    index = data.rfind('\x1b')
+    if index == -1:
+        return False
+    sequence = data[index:]
+    if len(sequence) == 1:
+        return True
+    if sequence[1] == '[':
+        return not any(0x40 <= ord(c) <= 0x7e for c in sequence[2:])
+    if sequence[1] == 'O':
+        return len(sequence) == 2
+    return False
+
+
+def read_input(fd):
+    data = os.read(fd, INPUT_BATCH)
+    while data and len(data) < INPUT_BATCH:
+        window = ESCAPE_WINDOW if is_incomplete_escape(data) else INPUT_WINDOW
+        if not select.select([fd], [], [], window)[0]:
+            break
+        more = os.read(fd, INPUT_BATCH - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+def parse_message(data):
+    try:
+        message = json.loads(data)
+    except ValueError:
+        return "stdout", data
+    if not isinstance(message, dict):
+        return "stdout", data
+    if message.get("type") == "error":
+        if message.get("data", {}).get("errorMessage") == "UNAUTHORIZED":
+            raise TutumAuthError
+        raise TutumApiError(message)
+    return message.get("streamType"), message.get("output")
+
+
+def wait_readable(ws, timeout):
+    # frames already decrypted by the ssl wrapper do not make the socket readable again
+    ssl_obj = getattr(getattr(ws, 'io_sock', None), 'ssl', None)
+    if ssl_obj is not None and ssl_obj.pending():
+        return True
+    return bool(select.select([ws.sock], [], [], timeout)[0])
+
+
+def has_pending_data(ws):
+    return wait_readable(ws, 0)
+
+
+def connect(url, connect_timeout=CONNECT_TIMEOUT, read_timeout=0, retries=0):
+    # only establishing the connection is retried, a running command cannot be resumed
+    backoff = 1
+    for attempt in range(retries + 1):
+        try:
+            ws = websocket.create_connection(url, timeout=connect_timeout)
+            ws.settimeout(read_timeout or connect_timeout)
+            return ws
+        except (socket.error, websocket.WebSocketException) as e:
+            if attempt == retries:
+                raise
+            cli_log.debug("exec connection failed (%s), retrying in %ds" % (e, backoff))
+            time.sleep(backoff)
+            backoff *= 2
+
+
+class Keepalive(object):
+    # Pings the server every `interval` seconds, which keeps idle sessions open through load
+    # balancers and measures the round-trip time from the pongs. With a read timeout, a connection
+    # that did not send anything, pongs included, for that long is considered dead.
+
+    def __init__(self, ws, interval=PING_INTERVAL, read_timeout=0):
+        self.ws = ws
+        self.interval = interval
+        self.read_timeout = read_timeout
+        self.last_ping = time.time()
+        self.last_received = time.time()
+        self.rtts = []
+
+    def timeout(self, default=5):
+        now = time.time()
+        timeouts = [default]
+        if self.interval:
+            timeouts.append(self.last_ping + self.interval - now)
+        if self.read_timeout:
+            timeouts.append(self.last_received + self.read_timeout - now)
+        return max(0, min(timeouts))
+
+    def check(self):
+        now = time.time()
+        if self.read_timeout and now - self.last_received > self.read_timeout:
+            raise ExecTimeoutError("No data received for %d seconds" % self.read_timeout)
+        if self.interval and now - self.last_ping >= self.interval:
+            self.ws.ping("%.6f" % now)
+            self.last_ping = now
+
+    def on_frame(self, frame):
+        now = time.time()
+        self.last_received = now
+        if frame.opcode == ABNF.OPCODE_PONG:
+            try:
+                self.rtts.append(now - float(frame.data))
+            except ValueError:
+                pass
+
+    def report(self):
+        if not self.rtts:
+            return "round-trip latency: no pong received"
+        return "round-trip latency: last %.0fms, avg %.0fms, max %.0fms (%d pings)" % (
+            self.rtts[-1] * 1000, sum(self.rtts) * 1000 / len(self.rtts), max(self.rtts) * 1000, len(self.rtts))
+
+
+def recv_message(ws, keepalive=None):
+    # like WebSocket.recv_data, but pongs are passed to the keepalive instead of being dropped
+    while True:
+        frame = ws.recv_frame()
+        if not frame:
+            raise websocket.WebSocketException("Not a valid frame %s" % frame)
+        if keepalive:
+            keepalive.on_frame(frame)
+        if frame.opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY):
+            return frame.opcode, frame.data
+        if frame.opcode == ABNF.OPCODE_CLOSE:
+            ws.send_close()
+            return frame.opcode, None
+        if frame.opcode == ABNF.OPCODE_PING:
+            ws.pong(frame.data)
+        if not has_pending_data(ws):
+            return frame.opcode, None
+
+
+class OutputBuffer(object):
+    # Collects the output of one select cycle and writes it with a single call per stream.
+
+    def __init__(self, *streams):
+        self.chunks = dict([(stream, []) for stream in streams])
+
+    def write(self, stream, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.chunks[stream].append(data)
+
+    def flush(self):
+        for stream, chunks in self.chunks.items():
+            if chunks:
+                stream.write("".join(chunks))
+                stream.flush()
+                del chunks[:]
+
+
+def wrap_command(command):
+    return ["sh", "-c", "%s; echo %s$?" % (" ".join([pipes.quote(c) for c in command]), EXIT_MARKER)]
+
+
+class FanOutTarget(object):
+    def __init__(self, name, uuid, command, output, ping_interval=PING_INTERVAL, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=0, retries=CONNECT_RETRIES):
+        self.name = name
+        self.uuid = uuid
+        self.command = command
+        self.output = output
+        self.ping_interval = ping_interval
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.keepalive = None
+        self.partial = {}
+        self.status = None
+        self.error = None
+
+    def _feed(self, stream, data, final=False):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        lines = (self.partial.get(stream, "") + data).split("\n")
+        self.partial[stream] = "" if final else lines.pop()
+        lines = [line for line in lines if not (final and not line)]
+        if stream is self.output.stdout:
+            kept = []
+            for line in lines:
+                match = EXIT_MARKER_REGEXP.match(line)
+                if match:
+                    self.status = int(match.group(2))
+                    line = match.group(1)
+                if line or not match:
+                    kept.append(line)
+            lines = kept
+        self.output.write_lines(self.name, stream, lines)
+
+    def run(self):
+        try:
+            ws = connect(get_exec_url(self.uuid, wrap_command(self.command)), self.connect_timeout,
+                         self.read_timeout, self.retries)
+            self.keepalive = Keepalive(ws, self.ping_interval, self.read_timeout)
+            try:
+                while True:
+                    self.keepalive.check()
+                    if not wait_readable(ws, self.keepalive.timeout()):
+                        continue
+                    try:
+                        opcode, data = recv_message(ws, self.keepalive)
+                    except websocket.WebSocketConnectionClosedException:
+                        break
+                    if opcode == ABNF.OPCODE_CLOSE:
+                        break
+                    if data is None:
+                        continue
+                    stream_type, data = parse_message(data)
+                    if data:
+                        self._feed(self.output.stderr if stream_type == "stderr" else self.output.stdout, data)
+            finally:
+                ws.close()
+        except Exception as e:
+            self.error = e
+        for stream in self.partial.keys():
+            self._feed(stream, "", final=True)
+        if self.status is None and self.error is None:
+            self.error = "connection closed before the command finished"
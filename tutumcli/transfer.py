@@ -0,0 +1,273 @@
+import base64
+import errno
+import os
+import pipes
+import posixpath
+import re
+import select
+import sys
+import tarfile
+import tempfile
+import time
+
+import websocket
+from websocket import ABNF
+
+from exceptions import BadParameter, TransferError
+from tutumcli import shell
+
+
+# raw bytes sent per frame, a multiple of 3 so that the encoded chunks can simply be concatenated
+CHUNK = 48 * 1024
+PROGRESS_INTERVAL = 0.5
+TIMEOUT = 60
+BASE64_REGEXP = re.compile(r"^[A-Za-z0-9+/=]*$")
+
+
+def human_size(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024 or unit == 'GB':
+            return "%.1f %s" % (size, unit) if unit != 'B' else "%d B" % size
+        size /= 1024.0
+
+
+def parse_location(location):
+    if os.path.exists(location) or ":" not in location:
+        return None, location
+    container, path = location.split(":", 1)
+    if not container or not path:
+        raise BadParameter("%s does not match with 'container:path'" % location)
+    return container, path
+
+
+class Progress(object):
+    def __init__(self, label, total=None, stream=sys.stderr):
+        self.label = label
+        self.total = total
+        self.stream = stream
+        self.transferred = 0
+        self.started = time.time()
+        self.last = 0
+        self.is_terminal = hasattr(stream, 'isatty') and stream.isatty()
+
+    def _status(self, now):
+        status = "%s: %s" % (self.label, human_size(self.transferred))
+        if self.total:
+            status += " / %s (%d%%)" % (human_size(self.total), self.transferred * 100 / self.total)
+        return status + ", %s/s" % human_size(self.transferred / max(now - self.started, 0.001))
+
+    def update(self, size):
+        self.transferred += size
+        now = time.time()
+        if self.is_terminal and now - self.last >= PROGRESS_INTERVAL:
+            self.last = now
+            self.stream.write("\r" + self._status(now))
+            self.stream.flush()
+
+    def finish(self):
+        now = time.time()
+        self.stream.write("%s%s in %.1fs\n" % ("\r" if self.is_terminal else "", self._status(now), now - self.started))
+        self.stream.flush()
+
+
+class Base64Writer(object):
+    # Decodes base64 text received in arbitrary pieces into a file. Anything else in the text means that
+    # the output was not encoded or got mangled on the way, typically replaced with U+FFFD.
+
+    def __init__(self, fileobj, progress=None):
+        self.fileobj = fileobj
+        self.progress = progress
+        self.leftover = ""
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        data = self.leftover + "".join(data.split())
+        if not BASE64_REGEXP.match(data):
+            raise TransferError("Corrupted data received from the container, it is not base64 encoded")
+        size = len(data) // 4 * 4
+        decoded = base64.b64decode(data[:size])
+        self.leftover = data[size:]
+        self.fileobj.write(decoded)
+        if self.progress:
+            self.progress.update(len(decoded))
+
+    def close(self):
+        if self.leftover:
+            raise TransferError("Incomplete data received from the container")
+
+
+def run_script(container_uuid, script, timeout=TIMEOUT, chunks=None, on_output=None):
+    ws = websocket.create_connection(shell.get_exec_url(container_uuid, ["sh", "-c", script]), timeout=timeout)
+    errors = []
+    try:
+        for chunk in chunks or []:
+            ws.send(chunk)
+        while True:
+            try:
+                opcode, data = ws.recv_data()
+            except websocket.WebSocketConnectionClosedException:
+                break
+            if opcode == ABNF.OPCODE_CLOSE:
+                break
+            stream_type, output = shell.parse_message(data)
+            if not output:
+                continue
+            if stream_type == "stderr":
+                errors.append(output)
+            elif on_output:
+                on_output(output)
+    finally:
+        ws.close()
+    if errors:
+        raise TransferError("".join(errors).strip())
+
+
+def get_encoded_size(size):
+    return (size + 2) // 3 * 4
+
+
+def read_encoded_chunks(fileobj, progress=None):
+    while True:
+        chunk = fileobj.read(CHUNK)
+        if not chunk:
+            break
+        if progress:
+            progress.update(len(chunk))
+        yield base64.b64encode(chunk)
+
+
+def upload(container_uuid, local_path, remote_dir, timeout=TIMEOUT):
+    # The exec endpoint cannot close the command's stdin, so the compressed archive is staged in a
+    # temporary file to know its size and the remote side stops reading after exactly that much.
+    if not os.path.exists(local_path):
+        raise BadParameter("%s does not exist" % local_path)
+    archive = tempfile.TemporaryFile()
+    try:
+        tar = tarfile.open(fileobj=archive, mode='w:gz')
+        try:
+            tar.add(local_path, arcname=os.path.basename(os.path.normpath(os.path.abspath(local_path))))
+        finally:
+            tar.close()
+        size = archive.tell()
+        archive.seek(0)
+
+        remote_dir = pipes.quote(remote_dir)
+        script = "mkdir -p %s && head -c %d | base64 -d | tar xzf - -C %s" % (remote_dir, get_encoded_size(size),
+                                                                               remote_dir)
+        progress = Progress("Uploading %s" % local_path, size)
+        run_script(container_uuid, script, timeout, chunks=read_encoded_chunks(archive, progress))
+        progress.finish()
+    finally:
+        archive.close()
+
+
+def is_within(path, directory):
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+
+def check_member(member, local_dir):
+    # the member and the target of a link must stay in local_dir, also through links extracted before
+    root = os.path.realpath(local_dir)
+    path = os.path.join(root, member.name)
+    if os.path.isabs(member.name) or ".." in member.name.split("/") or \
+            not is_within(os.path.realpath(path), root):
+        raise TransferError("Refusing to extract %s outside of %s" % (member.name, local_dir))
+    if member.issym():
+        target = os.path.join(os.path.dirname(path), member.linkname)
+    elif member.islnk():
+        target = os.path.join(root, member.linkname)
+    else:
+        return
+    if os.path.isabs(member.linkname) or not is_within(os.path.realpath(target), root):
+        raise TransferError("Refusing to extract %s linking to %s outside of %s" % (member.name, member.linkname,
+                                                                                    local_dir))
+
+
+def download(container_uuid, remote_path, local_dir, timeout=TIMEOUT):
+    parent, name = posixpath.split(remote_path.rstrip("/") or "/")
+    script = "tar czf - -C %s %s | base64" % (pipes.quote(parent or "/"), pipes.quote(name or "."))
+    archive = tempfile.TemporaryFile()
+    try:
+        progress = Progress("Downloading %s" % remote_path)
+        writer = Base64Writer(archive, progress)
+        run_script(container_uuid, script, timeout, on_output=writer.write)
+        writer.close()
+        progress.finish()
+
+        archive.seek(0)
+        if not os.path.isdir(local_dir):
+            os.makedirs(local_dir)
+        tar = tarfile.open(fileobj=archive, mode='r:gz')
+        try:
+            for member in tar:
+                check_member(member, local_dir)
+                tar.extract(member, local_dir)
+        finally:
+            tar.close()
+    finally:
+        archive.close()
+
+
+def stage_input(fileobj):
+    # like upload, piped input is read until its end first for the remote side to know its size
+    staged = tempfile.TemporaryFile()
+    while True:
+        chunk = fileobj.read(CHUNK)
+        if not chunk:
+            break
+        staged.write(chunk)
+    size = staged.tell()
+    staged.seek(0)
+    return staged, size
+
+
+def wrap_pipe_command(command, size=None):
+    # the input of `size` bytes, if any, and the output of the command travel base64 encoded
+    command = " ".join([pipes.quote(c) for c in command]) or "sh"
+    if size is None:
+        return ["sh", "-c", "%s < /dev/null | base64" % command]
+    return ["sh", "-c", "head -c %d | base64 -d | %s | base64" % (get_encoded_size(size), command)]
+
+
+def pipe_exec(ws, staged, stdout, stderr, keepalive=None):
+    # Non-interactive exec of a command wrapped with wrap_pipe_command: the staged input is sent while the
+    # output is read, so that neither side waits for the other, until the server closes the connection.
+    writer = Base64Writer(stdout)
+    chunks = read_encoded_chunks(staged) if staged else iter([])
+    pending = next(chunks, None)
+    while True:
+        try:
+            if keepalive:
+                keepalive.check()
+            r, w, e = select.select([ws.sock], [ws.sock] if pending else [], [],
+                                    keepalive.timeout() if keepalive else 5)
+        except select.error as e:
+            if e.args and e.args[0] == errno.EINTR:
+                continue
+            raise
+        if w:
+            ws.send(pending)
+            pending = next(chunks, None)
+
+        if r:
+            try:
+                for i in range(shell.OUTPUT_BATCH):
+                    try:
+                        opcode, data = shell.recv_message(ws, keepalive)
+                    except websocket.WebSocketConnectionClosedException:
+                        opcode, data = ABNF.OPCODE_CLOSE, None
+                    if opcode == ABNF.OPCODE_CLOSE:
+                        writer.close()
+                        return
+                    if data is not None:
+                        stream_type, data = shell.parse_message(data)
+                        if data and stream_type == "stderr":
+                            stderr.write(data.encode('utf-8') if isinstance(data, unicode) else data)
+                        elif data:
+                            writer.write(data)
+                    if not shell.has_pending_data(ws):
+                        break
+            finally:
+                stdout.flush()
+                stderr.flush()
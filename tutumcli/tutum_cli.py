@@ -28,19 +28,23 @@ def initialize_parser():
     # Command Parsers
     parsers.add_build_parser(subparsers)
     parsers.add_container_parser(subparsers)
+    parsers.add_cp_parser(subparsers)
     parsers.add_event_parser(subparsers)
     parsers.add_exec_parser(subparsers)
     parsers.add_image_parser(subparsers)
     parsers.add_login_parser(subparsers)
     parsers.add_node_parser(subparsers)
     parsers.add_nodecluster_parser(subparsers)
+    parsers.add_port_forward_parser(subparsers)
     parsers.add_push_parser(subparsers)
+    parsers.add_replay_parser(subparsers)
     parsers.add_run_parser(subparsers)
     parsers.add_service_parser(subparsers)
     parsers.add_stack_parser(subparsers)
     parsers.add_tag_parser(subparsers)
     parsers.add_volume_parser(subparsers)
     parsers.add_volumegroup_parser(subparsers)
+    parsers.add_watch_parser(subparsers)
     parsers.add_trigger_parser(subparsers)
     parsers.add_up_parser(subparsers)
     return parser
@@ -58,8 +62,9 @@ def patch_help_option(argv=sys.argv):
 
     if len(args) == 1:
         args.append('-h')
-    elif len(args) == 2 and args[1] in ['service', 'build', 'container', 'image', 'exec', 'node', 'nodecluster', 'tag',
-                                        'volume', 'volumegroup', 'trigger', 'stack', 'push', 'run']:
+    elif len(args) == 2 and args[1] in ['service', 'build', 'container', 'cp', 'image', 'exec', 'node', 'nodecluster',
+                                        'tag', 'volume', 'volumegroup', 'trigger', 'stack', 'push', 'run',
+                                        'port-forward', 'replay']:
         args.append('-h')
     elif len(args) == 3:
         if args[1] == 'service' and args[2] in ['create', 'inspect', 'logs', 'redeploy', 'run', 'scale', 'set',
@@ -82,7 +87,7 @@ def patch_help_option(argv=sys.argv):
             args.append('-h')
         elif args[1] == 'volumegroup' and args[2] in ['inspect']:
             args.append('-h')
-        elif args[1] == 'stack' and args[2] in ['inspect', 'redeploy', 'terminate', 'start', 'stop', 'update',
+        elif args[1] == 'stack' and args[2] in ['inspect', 'logs', 'redeploy', 'terminate', 'start', 'stop', 'update',
                                                 'export']:
             args.append('-h')
 
@@ -100,13 +105,28 @@ def dispatch_cmds(args):
     if args.cmd == 'login':
         commands.login(args.username, args.password, args.email)
     elif args.cmd == 'build':
-        commands.build(args.tag, args.directory, args.sock)
+        commands.build(args.tag, args.directory, args.sock, args.pull, args.pull_interval, args.force, args.file,
+                       args.parallel)
+    elif args.cmd == 'cp':
+        commands.cp(args.source, args.destination)
     elif args.cmd == 'event':
-        commands.event()
+        commands.event(args.buffer_size, args.on_full, args.heartbeat, args.record, args.replay, args.speed,
+                       args.stats, args.stats_interval, args.stats_format)
     elif args.cmd == 'exec':
-        commands.container_exec(args.identifier, args.command)
+        if args.service or args.stack:
+            commands.container_exec_fanout([args.identifier] + args.command, args.service, args.stack, args.parallel,
+                                           args.ping_interval, args.connect_timeout, args.read_timeout, args.retries,
+                                           args.latency, args.record)
+        else:
+            commands.container_exec(args.identifier, args.command, args.no_tty, args.ping_interval,
+                                    args.connect_timeout, args.read_timeout, args.retries, args.latency,
+                                    args.record)
+    elif args.cmd == 'port-forward':
+        commands.port_forward(args.identifier, args.ports, args.address)
+    elif args.cmd == 'replay':
+        commands.replay(args.file, args.speed, args.idle_limit)
     elif args.cmd == 'push':
-        commands.image_push(args.name, args.public)
+        commands.image_push(args.name, args.public, args.to, args.parallel, args.retries)
     elif args.cmd == 'run':
         commands.service_run(image=args.image, name=args.name, cpu_shares=args.cpushares,
                                  memory=args.memory, privileged=args.privileged,
@@ -133,9 +153,10 @@ def dispatch_cmds(args):
         elif args.subcmd == 'inspect':
             commands.service_inspect(args.identifier)
         elif args.subcmd == 'logs':
-            commands.service_logs(args.identifier, args.tail, args.follow)
+            commands.service_logs(args.identifier, args.tail, args.follow, args.merge, args.grep, args.exclude,
+                                  args.since, args.until, args.output, args.rotate_size, args.rotate_interval)
         elif args.subcmd == 'ps':
-            commands.service_ps(args.quiet, args.status, args.stack)
+            commands.service_ps(args.quiet, args.status, args.stack, args.from_cache)
         elif args.subcmd == 'redeploy':
             commands.service_redeploy(args.identifier, args.sync)
         elif args.subcmd == 'run':
@@ -171,15 +192,23 @@ def dispatch_cmds(args):
             commands.service_terminate(args.identifier, args.sync)
     elif args.cmd == 'container':
         if args.subcmd == 'exec':
-            commands.container_exec(args.identifier, args.command)
+            if args.service or args.stack:
+                commands.container_exec_fanout([args.identifier] + args.command, args.service, args.stack,
+                                               args.parallel, args.ping_interval, args.connect_timeout,
+                                               args.read_timeout, args.retries, args.latency, args.record)
+            else:
+                commands.container_exec(args.identifier, args.command, args.no_tty, args.ping_interval,
+                                        args.connect_timeout, args.read_timeout, args.retries, args.latency,
+                                        args.record)
         elif args.subcmd == 'inspect':
             commands.container_inspect(args.identifier)
         elif args.subcmd == 'logs':
-            commands.container_logs(args.identifier, args.tail, args.follow)
+            commands.container_logs(args.identifier, args.tail, args.follow, args.grep, args.exclude, args.since,
+                                    args.until, args.output, args.rotate_size, args.rotate_interval)
         elif args.subcmd == 'redeploy':
             commands.container_redeploy(args.identifier, args.sync)
         elif args.subcmd == 'ps':
-            commands.container_ps(args.quiet, args.status, args.service, args.no_trunc)
+            commands.container_ps(args.quiet, args.status, args.service, args.no_trunc, args.from_cache)
         elif args.subcmd == 'start':
             commands.container_start(args.identifier, args.sync)
         elif args.subcmd == 'stop':
@@ -192,18 +221,18 @@ def dispatch_cmds(args):
         elif args.subcmd == 'register':
             commands.image_register(args.image_name, args.description, args.username, args.password, args.sync)
         elif args.subcmd == 'push':
-            commands.image_push(args.name, args.public)
+            commands.image_push(args.name, args.public, args.to, args.parallel, args.retries)
         elif args.subcmd == 'rm':
             commands.image_rm(args.image_name, args.sync)
         elif args.subcmd == 'search':
-            commands.image_search(args.query)
+            commands.image_search(args.query, args.limit, args.stars, args.official, args.format, args.cache_ttl)
         elif args.subcmd == 'update':
             commands.image_update(args.image_name, args.username, args.password, args.description, args.sync)
     elif args.cmd == 'node':
         if args.subcmd == 'inspect':
             commands.node_inspect(args.identifier)
         elif args.subcmd == 'list':
-            commands.node_list(args.quiet)
+            commands.node_list(args.quiet, args.from_cache)
         elif args.subcmd == 'rm':
             commands.node_rm(args.identifier, args.sync)
         elif args.subcmd == 'upgrade':
@@ -263,6 +292,9 @@ def dispatch_cmds(args):
             commands.stack_inspect(args.identifier)
         elif args.subcmd == 'list':
             commands.stack_list(args.quiet)
+        elif args.subcmd == 'logs':
+            commands.stack_logs(args.identifier, args.tail, args.follow, args.merge, args.grep, args.exclude,
+                                args.since, args.until, args.output, args.rotate_size, args.rotate_interval)
         elif args.subcmd == 'redeploy':
             commands.stack_redeploy(args.identifier, args.sync)
         elif args.subcmd == 'start':
@@ -279,6 +311,8 @@ def dispatch_cmds(args):
             commands.stack_export(args.identifier, args.file)
     elif args.cmd == 'up':
         commands.stack_up(args.name, args.file, args.sync)
+    elif args.cmd == 'watch':
+        commands.watch(args.reconcile_interval)
 
 def main():
     parser = initialize_parser()
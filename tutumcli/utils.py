@@ -1,4 +1,6 @@
 from __future__ import print_function
+import calendar
+import collections
 import datetime
 import json
 import urlparse
@@ -7,6 +9,7 @@ import re
 import os
 import codecs
 import sys
+import tempfile
 import time
 
 import requests
@@ -14,7 +17,7 @@ import yaml
 import ago
 import docker
 import tutum
-from dateutil import tz
+from dateutil import parser, tz
 from tabulate import tabulate
 
 from exceptions import BadParameter, DockerNotFound, StreamOutputError
@@ -22,6 +25,25 @@ from tutum import ObjectNotFound
 from . import __version__
 
 
+# redraws per second of the progress lines of docker streams
+STREAM_FRAME_RATE = 10
+JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+DOCKER_VERSION_CACHE = 'docker_api_versions.json'
+PULL_CHECK_CACHE = 'image_pull_checks.json'
+# seconds between two comparisons of a local image with the registry
+PULL_INTERVAL = 24 * 3600
+DOCKER_HUB_AUTH_URL = "https://auth.docker.io/token"
+DOCKER_HUB_REGISTRY_URL = "https://registry-1.docker.io/v2"
+REGISTRY_TIMEOUT = 10
+SEARCH_CACHE = 'image_searches.json'
+# seconds the results of a search are reused for
+SEARCH_CACHE_TTL = 3600
+# queries remembered, the oldest ones are forgotten first
+SEARCH_CACHE_SIZE = 100
+
+_docker_clients = {}
+
+
 def tabulate_result(data_list, headers):
     print(tabulate(data_list, headers, stralign="left", tablefmt="plain"))
 
@@ -46,6 +68,25 @@ def get_humanize_local_datetime_from_utc_datetime_string(utc_datetime_string):
     return get_humanize_local_datetime_from_utc_datetime(utc_target_datetime)
 
 
+def parse_time(value):
+    if value is None:
+        return None
+    match = re.match(r'^(\d+)([smhd])$', value)
+    if match:
+        seconds = int(match.group(1)) * {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+        return time.time() - seconds
+    if re.match(r'^\d+(\.\d+)?$', value):
+        return float(value)
+    try:
+        local_datetime = parser.parse(value)
+    except (ValueError, TypeError):
+        raise BadParameter("time %s does not match with a duration (e.g. 10m), a unix timestamp or a date"
+                           " (e.g. 2015-05-01T10:00:00)" % value)
+    if local_datetime.tzinfo is None:
+        local_datetime = local_datetime.replace(tzinfo=tz.tzlocal())
+    return calendar.timegm(local_datetime.utctimetuple())
+
+
 def is_uuid4(identifier):
     uuid4_regexp = re.compile('^[a-f0-9]{8}-[a-f0-9]{4}-4[a-f0-9]{3}-[89ab][a-f0-9]{3}-[a-f0-9]{12}', re.I)
     match = uuid4_regexp.match(identifier)
@@ -68,7 +109,118 @@ def add_unicode_symbol_to_state(state):
     return state
 
 
+def get_cache_dir():
+    return os.getenv('TUTUM_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.tutum_cache')
+
+
+def get_cache_path(name):
+    cache_dir = get_cache_dir()
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    return os.path.join(cache_dir, name)
+
+
+def load_cache(name):
+    try:
+        with open(os.path.join(get_cache_dir(), name)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_cache(name, data):
+    # every writer gets its own temporary file, the last rename wins
+    try:
+        path = get_cache_path(name)
+        fd, tmp_path = tempfile.mkstemp(prefix=name + ".", dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        pass
+
+
+def load_docker_api_versions():
+    return load_cache(DOCKER_VERSION_CACHE)
+
+
+def save_docker_api_version(docker_host, version):
+    versions = load_docker_api_versions()
+    versions[docker_host] = version
+    save_cache(DOCKER_VERSION_CACHE, versions)
+
+
+def search_images(text, ttl=SEARCH_CACHE_TTL):
+    searches = load_cache(SEARCH_CACHE)
+    search = searches.get(text)
+    if search and time.time() - search['time'] < ttl:
+        return search['results']
+    results = get_docker_client().search(text)
+    if ttl > 0:
+        searches[text] = {'time': time.time(), 'results': results}
+        if len(searches) > SEARCH_CACHE_SIZE:
+            for key in sorted(searches, key=lambda key: searches[key]['time'])[:len(searches) - SEARCH_CACHE_SIZE]:
+                del searches[key]
+        save_cache(SEARCH_CACHE, searches)
+    return results
+
+
+def filter_search_results(results, limit=None, stars=None, official=False):
+    results = [result for result in results
+               if (not stars or result["star_count"] >= stars) and (not official or result["is_official"])]
+    return results[:limit] if limit else results
+
+
+def is_version_mismatch(response):
+    if response.status_code not in (400, 404):
+        return False
+    message = response.text.lower()
+    return "client is newer than server" in message or "client and server don't have same version" in message
+
+
+class DockerClient(docker.Client):
+    # Client created with the API version negotiated by a previous run, so creating it does not reach
+    # the daemon. When the daemon rejects that version, the cached one is replaced by the version of
+    # the daemon and the request is sent again with it.
+
+    def __init__(self, docker_host, *args, **kwargs):
+        self.docker_host = docker_host
+        super(DockerClient, self).__init__(*args, **kwargs)
+
+    def _renegotiate_version(self):
+        try:
+            version = self._retrieve_server_version()
+        except docker.errors.DockerException:
+            return False
+        if version == self._version:
+            return False
+        self._version = version
+        save_docker_api_version(self.docker_host, version)
+        return True
+
+    def request(self, method, url, *args, **kwargs):
+        try:
+            response = super(DockerClient, self).request(method, url, *args, **kwargs)
+            prefix = "/v%s/" % self._version
+            if not is_version_mismatch(response) or prefix not in url or not self._renegotiate_version():
+                return response
+            data = kwargs.get('data')
+            if hasattr(data, 'seek'):
+                data.seek(0)
+            elif data is not None and not isinstance(data, (basestring, dict)):
+                # a consumed stream cannot be sent again, the next request uses the new version
+                return response
+            url = url.replace(prefix, "/v%s/" % self._version, 1)
+            return super(DockerClient, self).request(method, url, *args, **kwargs)
+        except requests.exceptions.ConnectionError:
+            raise DockerNotFound("Cannot connect to docker (is it running?)")
+
+
 def get_docker_client():
+    docker_host = os.getenv("DOCKER_HOST", None) or ""
+    key = (docker_host, os.environ.get('DOCKER_TLS_VERIFY'), os.environ.get('DOCKER_CERT_PATH'))
+    if key in _docker_clients:
+        return _docker_clients[key]
     try:
         DOCKER_TLS_VERIFY = bool(os.environ.get('DOCKER_TLS_VERIFY', False))
 
@@ -87,92 +239,215 @@ def get_docker_client():
             else:
                 tls_config = False
 
-        base_url = os.getenv("DOCKER_HOST", None)
+        base_url = docker_host
         if tls_config and base_url.startswith("tcp://"):
             base_url = base_url.replace("tcp://", "https://")
 
-        docker_client = docker.Client(base_url=base_url, tls=tls_config, version='auto')
-        docker_client.version()
-        return docker_client
+        # the version negotiated by a previous run saves a round trip to the daemon
+        version = load_docker_api_versions().get(docker_host)
+        docker_client = DockerClient(docker_host, base_url=base_url, tls=tls_config, version=version or 'auto')
+        if not version:
+            save_docker_api_version(docker_host, docker_client._version)
     except Exception:
         raise DockerNotFound("Cannot connect to docker (is it running?)")
+    _docker_clients[key] = docker_client
+    return docker_client
 
 
-def stream_output(output, stream):
-    def print_output_event(event, stream, is_terminal):
-        if 'errorDetail' in event:
-            raise StreamOutputError(event['errorDetail']['message'])
-
-        terminator = ''
-
-        if is_terminal and 'stream' not in event:
-            # erase current line
-            stream.write("%c[2K\r" % 27)
-            terminator = "\r"
-            pass
-        elif 'progressDetail' in event:
-            return
-
-        if 'time' in event:
-            stream.write("[%s] " % event['time'])
-
-        if 'id' in event:
-            stream.write("%s: " % event['id'])
+def split_image_name(image):
+    repository, _, tag = image.rpartition(":")
+    if not repository or "/" in tag:
+        return image, "latest"
+    return repository, tag
 
-        if 'from' in event:
-            stream.write("(from %s) " % event['from'])
 
-        status = event.get('status', '')
-
-        if 'progress' in event:
-            stream.write("%s %s%s" % (status, event['progress'], terminator))
-        elif 'progressDetail' in event:
-            detail = event['progressDetail']
-            if 'current' in detail:
-                percentage = float(detail['current']) / float(detail['total']) * 100
-                stream.write('%s (%.1f%%)%s' % (status, percentage, terminator))
-            else:
-                stream.write('%s%s' % (status, terminator))
-        elif 'stream' in event:
-            stream.write("%s%s" % (event['stream'], terminator))
+def get_local_image_digest(docker_client, image):
+    # returns None when the image is not present, and "" when it has no digest
+    try:
+        info = docker_client.inspect_image(image)
+    except docker.errors.APIError as e:
+        if e.response is not None and e.response.status_code == 404:
+            return None
+        raise
+    repository = split_image_name(image)[0]
+    for repo_digest in info.get('RepoDigests') or []:
+        name, _, digest = repo_digest.partition("@")
+        if name == repository:
+            return digest
+    return ""
+
+
+def get_registry_image_digest(image):
+    # digest of the image on Docker Hub, looked up without pulling it
+    repository, tag = split_image_name(image)
+    if "/" not in repository:
+        repository = "library/" + repository
+    token = requests.get(DOCKER_HUB_AUTH_URL, params={'service': 'registry.docker.io',
+                                                      'scope': 'repository:%s:pull' % repository},
+                         timeout=REGISTRY_TIMEOUT).json()['token']
+    response = requests.head("%s/%s/manifests/%s" % (DOCKER_HUB_REGISTRY_URL, repository, tag),
+                             timeout=REGISTRY_TIMEOUT, headers={'Authorization': 'Bearer %s' % token,
+                                      'Accept': 'application/vnd.docker.distribution.manifest.v2+json'})
+    response.raise_for_status()
+    return response.headers.get('Docker-Content-Digest')
+
+
+def is_image_pull_needed(docker_client, image, policy=None, interval=PULL_INTERVAL):
+    # With no policy the image is pulled when it is missing, or when its digest differs from the one
+    # on Docker Hub. The digests are compared at most once per `interval` seconds.
+    if policy == 'always':
+        return True
+    if policy == 'never':
+        return False
+    local_digest = get_local_image_digest(docker_client, image)
+    if local_digest is None or policy == 'missing':
+        return local_digest is None
+
+    checks = load_cache(PULL_CHECK_CACHE)
+    if image in checks and time.time() - checks[image] < interval:
+        return False
+    try:
+        remote_digest = get_registry_image_digest(image)
+    except (requests.exceptions.RequestException, ValueError, KeyError):
+        return True
+    if not local_digest or local_digest != remote_digest:
+        return True
+    record_image_pull(image)
+    return False
+
+
+def record_image_pull(image):
+    checks = load_cache(PULL_CHECK_CACHE)
+    checks[image] = time.time()
+    save_cache(PULL_CHECK_CACHE, checks)
+
+
+class JSONStreamDecoder(object):
+    # Decodes a stream of concatenated json objects received in chunks of any size. Decoded data is
+    # consumed by offset and an incomplete object is only decoded again once a chunk that can end
+    # it, one containing a closing brace, has arrived.
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+
+    def feed(self, data):
+        if self.buffer and '}' not in data:
+            self.buffer += data
+            return []
+        buf = self.buffer + data if self.buffer else data
+        events = []
+        pos = 0
+        end = len(buf)
+        while True:
+            pos = JSON_WHITESPACE.match(buf, pos).end()
+            if pos == end:
+                break
+            try:
+                event, pos = self.decoder.raw_decode(buf, pos)
+            except ValueError:
+                break
+            events.append(event)
+        self.buffer = buf[pos:]
+        return events
+
+    def close(self):
+        if self.buffer.strip():
+            raise StreamOutputError("Invalid or truncated docker output: %s" % self.buffer[:100])
+
+
+def decode_stream(chunks):
+    decoder = JSONStreamDecoder()
+    for chunk in chunks:
+        for event in decoder.feed(chunk):
+            yield event
+    decoder.close()
+
+
+def format_output_event(event):
+    text = ""
+    if 'time' in event:
+        text += "[%s] " % event['time']
+    if 'id' in event:
+        text += "%s: " % event['id']
+    if 'from' in event:
+        text += "(from %s) " % event['from']
+
+    status = event.get('status', '')
+    if 'progress' in event:
+        text += "%s %s" % (status, event['progress'])
+    elif 'progressDetail' in event:
+        detail = event['progressDetail']
+        if detail.get('current') and detail.get('total'):
+            text += '%s (%.1f%%)' % (status, float(detail['current']) / float(detail['total']) * 100)
         else:
-            stream.write("%s%s\n" % (status, terminator))
+            text += status
+    elif 'stream' in event:
+        text += event['stream']
+    else:
+        text += status
+    return text
 
+
+def stream_output(output, stream, history=0, frame_rate=STREAM_FRAME_RATE):
+    # On a terminal every layer gets a line that is redrawn in place, progress events only keep the
+    # latest one per layer and the pending lines are redrawn at most `frame_rate` times per second.
+    # Otherwise progress is skipped and only the status lines are printed. Up to `history` events
+    # are kept and returned.
     is_terminal = hasattr(stream, 'fileno') and os.isatty(stream.fileno())
     stream = codecs.getwriter('utf-8')(stream)
-    all_events = []
+    events = collections.deque(maxlen=history)
     lines = {}
-    diff = 0
+    pending = collections.OrderedDict()
+    interval = 1.0 / frame_rate if frame_rate else 0
+    state = {'drawn': 0}
+
+    def draw_line(image_id, text):
+        if image_id not in lines:
+            lines[image_id] = len(lines)
+            stream.write("%c[2K\r%s\n" % (27, text))
+            return
+        diff = len(lines) - lines[image_id]
+        stream.write("%c[%dA%c[2K\r%s\r%c[%dB" % (27, diff, 27, text, 27, diff))
+
+    def draw_pending():
+        for image_id, event in pending.items():
+            draw_line(image_id, format_output_event(event))
+        pending.clear()
+        state['drawn'] = time.time()
+        stream.flush()
 
-    for chunk in output:
-        event = json.loads(chunk)
-        all_events.append(event)
+    for event in decode_stream(output):
+        if history:
+            events.append(event)
+        if 'errorDetail' in event:
+            raise StreamOutputError(event['errorDetail']['message'])
 
+        image_id = event.get('id')
         if 'progress' in event or 'progressDetail' in event:
-            image_id = event.get('id')
-            if not image_id:
-                continue
-
-            if image_id in lines:
-                diff = len(lines) - lines[image_id]
-            else:
-                lines[image_id] = len(lines)
-                stream.write("\n")
-                diff = 0
-
-            if is_terminal:
-                # move cursor up `diff` rows
-                stream.write("%c[%dA" % (27, diff))
-
-        print_output_event(event, stream, is_terminal)
-
-        if 'id' in event and is_terminal:
-            # move cursor back down
-            stream.write("%c[%dB" % (27, diff))
+            if image_id and is_terminal:
+                pending[image_id] = event
+                if time.time() - state['drawn'] >= interval:
+                    draw_pending()
+            continue
 
+        if pending:
+            draw_pending()
+        text = format_output_event(event)
+        if image_id and is_terminal:
+            draw_line(image_id, text)
+        elif 'stream' in event:
+            stream.write(text)
+        else:
+            stream.write("%s\n" % text)
+        if is_terminal and ('stream' in event or not image_id):
+            # lines printed below the layers would shift them, later updates start new lines
+            lines.clear()
         stream.flush()
 
-    return all_events
+    if pending:
+        draw_pending()
+    return list(events)
 
 
 def get_uuids_of_trigger(trigger, identifiers):